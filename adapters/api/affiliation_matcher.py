@@ -1,14 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
+import threading
 import unicodedata as ud
-from typing import List
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from domain.api.abstract_affiliation_matcher import AbstractAffiliationMatcher
+from domain.storages.abstract_match_cache import AbstractMatchCache
 from project.server.main.logger import get_logger
 
 logger = get_logger(__name__)
 
 CACHE_SIZE = 100_000
+DEFAULT_MAX_IN_FLIGHT = 16
 
 class AffiliationMatcher(AbstractAffiliationMatcher):
     french_publishers = [
@@ -20,13 +25,27 @@ class AffiliationMatcher(AbstractAffiliationMatcher):
             "DataSuds",
         ]
     french_alpha2 = ["fr", "gp", "gf", "mq", "re", "yt", "pm", "mf", "bl", "wf", "tf", "nc", "pf"]
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 cache: Optional[AbstractMatchCache] = None):
+        """max_in_flight is the maximum number of concurrent requests of get_affiliations_many,
+        and the number of keep-alive connections kept by the session.
+        cache is the persistent cache of the results of get_affiliations_many, it can be set once the version
+        of the matcher is known"""
         self.base_url = base_url
+        self.cache = cache
         self.headers = {"Content-type": "application/json"}
         self.french_publishers = list(map(self._normalizer, self.french_publishers))
+        self.max_in_flight = max(1, max_in_flight or DEFAULT_MAX_IN_FLIGHT)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # requests sent to the matcher, counted from the threads of get_affiliations_multi
+        self.nb_requests, self.nb_failed_requests = 0, 0
+        self._counters_lock = threading.Lock()
 
     def get_version(self):
-        return requests.post(
+        return self.session.post(
                     url=f"{self.base_url}/match",
                     headers=self.headers,
                     json={
@@ -40,19 +59,74 @@ class AffiliationMatcher(AbstractAffiliationMatcher):
         Calls affiliation matcher to determine the countries/ror/grid/rnsr mentionned in the string.
         Uses a cache to avoid repeating frequent queries.
         """
+        results = self._request_affiliation(match_type, affiliation_string)
+        return results if results is not None else []
+
+    def _request_affiliation(self, match_type: str, affiliation_string: str) -> Optional[List]:
+        """Results of the affiliation matcher for the string, None if the request failed"""
         if not isinstance(affiliation_string, str):
             return []
+        with self._counters_lock:
+            self.nb_requests += 1
         try:
-            return requests.post(
+            return self.session.post(
                     url=f"{self.base_url}/match",
                     headers=self.headers,
                     json={"type": match_type, "query": affiliation_string},
                 ).json()["results"]
         except:
+            with self._counters_lock:
+                self.nb_failed_requests += 1
             logger.exception(
                 f"Error during get affiliation {{'type': {match_type}, 'query': {affiliation_string}}}",
                 exc_info=True)
-            return []
+            return None
+
+    def get_affiliations_many(self, match_type: str, affiliation_strings: Iterable[str]) -> List[List]:
+        """
+        get_affiliation of each string, in the order of the strings. Each distinct string is queried once,
+        up to max_in_flight requests being sent concurrently on the pooled connections.
+        With a cache, only the strings not in the cache are queried, and their results are added to it
+        (unless the request failed).
+        """
+        return self.get_affiliations_multi([match_type], affiliation_strings)[match_type]
+
+    def get_affiliations_multi(self, match_types: List[str], affiliation_strings: Iterable[str]) -> Dict[str, List[List]]:
+        """
+        get_affiliations_many of the strings for several match types, by match type. The matcher answers one
+        match type per call: the calls of all the match types of a string are sent one after the other without
+        waiting for the answers, with the calls of the other strings, up to max_in_flight at a time.
+        """
+        affiliation_strings = list(affiliation_strings)
+        distinct_strings = list(dict.fromkeys(affiliation_strings))
+        results_by_type = {match_type: self.cache.get_many(match_type, distinct_strings) if self.cache is not None else {}
+                           for match_type in match_types}
+        missing_calls = [(match_type, string) for string in distinct_strings for match_type in match_types
+                         if string not in results_by_type[match_type]]
+        new_results_by_type = {match_type: {} for match_type in match_types}
+        for (match_type, string), result in zip(missing_calls, self._request_affiliations(missing_calls)):
+            if result is not None:
+                new_results_by_type[match_type][string] = result
+        for match_type in match_types:
+            if self.cache is not None:
+                self.cache.put_many(match_type, new_results_by_type[match_type])
+            results_by_type[match_type].update(new_results_by_type[match_type])
+        return {match_type: [results_by_type[match_type].get(string, []) for string in affiliation_strings]
+                for match_type in match_types}
+
+    def _request_affiliations(self, calls: List[Tuple[str, str]]) -> List[Optional[List]]:
+        """_request_affiliation of each (match_type, affiliation_string), up to max_in_flight at a time"""
+        if len(calls) <= 1 or self.max_in_flight == 1:
+            return [self._request_affiliation(match_type, string) for match_type, string in calls]
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(calls))) as executor:
+            return list(executor.map(lambda call: self._request_affiliation(*call), calls))
+
+    def stats(self) -> Dict:
+        """Number of requests sent to the matcher and failed, with the stats of the cache if any"""
+        stats = {'requests': self.nb_requests, 'failed_requests': self.nb_failed_requests}
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
 
     # @deprecated("This function is not use anymore")
     def is_publisher_fr(self, publisher: str) -> bool:
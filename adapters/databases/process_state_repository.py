@@ -4,6 +4,11 @@ from adapters.databases.postgres_session import PostgresSession
 from adapters.databases.utils import check_conformity, check_conformity_and_get_where_clauses
 
 from sqlalchemy import select, update, and_, asc
+from sqlalchemy.dialects.postgresql import insert
+from typing import Iterable, List, Set
+
+# number of file paths per IN clause
+FILE_PATHS_CHUNK_SIZE = 10000
 
 
 class ProcessStateRepository(AbstractProcessStateRepository):
@@ -20,7 +25,7 @@ class ProcessStateRepository(AbstractProcessStateRepository):
 
             # check if the file has already been processed in the past
             statement = select(ProcessStateTable).where(
-                ProcessStateTable.file_name == process_state.file_name
+                ProcessStateTable.relative_path == process_state.relative_path
             )
             result = session.execute(statement).scalars().all()
 
@@ -32,6 +37,41 @@ class ProcessStateRepository(AbstractProcessStateRepository):
 
         return added
 
+    def create_many(self, process_states: List[ProcessStateTable]) -> int:
+        """Insert the process states in one statement and one transaction,
+        skipping the files already in the table (the table must have been migrated). Return the number of rows inserted."""
+        if not process_states:
+            return 0
+
+        columns = [column.name for column in ProcessStateTable.__table__.columns if column.name != "id"]
+        rows = [{column: getattr(process_state, column) for column in columns} for process_state in process_states]
+        with self.session.sessionScope() as session:
+            statement = insert(ProcessStateTable.__table__).values(rows)\
+                .on_conflict_do_nothing(index_elements=[ProcessStateTable.__table__.c.relative_path])
+            result = session.execute(statement)
+
+        return result.rowcount
+
+    def migrate(self):
+        """Create the table and its indexes if needed, once before the partition jobs"""
+        ProcessStateTable.migrate(self.session.getEngine())
+
+    def get_processed_file_paths(self, file_paths: Iterable[str]) -> Set[str]:
+        """Return the file paths among file_paths which are already in the table, selecting only them"""
+        file_paths = list(dict.fromkeys(file_paths))
+        if not ProcessStateTable.checkExistence(self.session.getEngine()):
+            ProcessStateTable.createTable(self.session.getEngine())
+            return set()
+
+        processed_file_paths = set()
+        file_path_column = ProcessStateTable.__table__.c.file_path
+        with self.session.sessionScope() as session:
+            for i in range(0, len(file_paths), FILE_PATHS_CHUNK_SIZE):
+                statement = select(file_path_column).where(file_path_column.in_(file_paths[i:i + FILE_PATHS_CHUNK_SIZE]))
+                processed_file_paths.update(session.execute(statement).scalars().all())
+
+        return processed_file_paths
+
     def get(self, where_args: dict = {}):
         where_clauses: list = check_conformity_and_get_where_clauses(where_args, ProcessStateTable)
 
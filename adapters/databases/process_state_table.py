@@ -1,11 +1,18 @@
 from datetime import datetime
+from config.logger_config import LOGGER_LEVEL
 from domain.model.process_state import ProcessState
-from sqlalchemy import Column, DateTime, Integer, String, Table, Boolean
+from project.server.main.logger import get_logger
+from sqlalchemy import Column, DateTime, Index, Integer, String, Table, Boolean, text
 from sqlalchemy.orm import registry
 from sqlalchemy.engine import Engine
 
+logger = get_logger(__name__, level=LOGGER_LEVEL)
+
 mapper_registry = registry()
 
+# key of the postgres advisory lock serializing the migrations of the process_state table
+MIGRATION_LOCK_KEY = 4242
+
 
 @mapper_registry.mapped
 class ProcessStateTable(ProcessState):
@@ -15,15 +22,22 @@ class ProcessStateTable(ProcessState):
         Column("id", Integer, primary_key=True, autoincrement=True),
         Column("file_name", String(200)),
         Column("file_path", String(200)),
+        # path of the dump file relative to the dump folder: dump files in different sub folders may have the same name
+        Column("relative_path", String(200)),
         Column("number_of_dois", Integer),
         Column("number_of_dois_with_null_attributes", Integer),
         Column("number_of_non_null_dois", Integer),
         Column("process_date", DateTime),
         Column("processed", Boolean),
+        # conflict target of ProcessStateRepository.create_many
+        Index("process_state_relative_path_idx", "relative_path", unique=True),
+        # used by ProcessStateRepository.get_processed_file_paths
+        Index("process_state_file_path_idx", "file_path"),
     )
     id: int
     file_name: str
     file_path: str
+    relative_path: str
     number_of_dois: int
     number_of_dois_with_null_attributes: int
     number_of_non_null_dois: int
@@ -35,6 +49,7 @@ class ProcessStateTable(ProcessState):
             process_date: datetime,
             file_name: str,
             file_path: str,
+            relative_path: str = None,
             number_of_dois: int = None,
             number_of_dois_with_null_attributes: int = None,
             number_of_non_null_dois: int = None,
@@ -44,6 +59,8 @@ class ProcessStateTable(ProcessState):
         self.id = id
         self.file_name = file_name
         self.file_path = file_path
+        # the relative path of a file of the dump folder is its name
+        self.relative_path = relative_path or file_name
         self.number_of_dois = number_of_dois
         self.number_of_dois_with_null_attributes = number_of_dois_with_null_attributes
         self.number_of_non_null_dois = number_of_non_null_dois
@@ -58,6 +75,33 @@ class ProcessStateTable(ProcessState):
     def checkExistence(engine: Engine):
         return ProcessStateTable.__table__.exists(engine)
 
+    @staticmethod
+    def migrate(engine: Engine):
+        """Create the table and its indexes if they do not exist, to be run once before the partition jobs
+        (ProcessStateRepository.create_many and get_processed_file_paths expect them). The relative_path of the
+        rows written before it existed is their file_name. The rows of a relative_path present several times are
+        removed, except the first one, before creating the unique index on relative_path, which replaces the one
+        on file_name: the number of rows removed and their file names are logged.
+        Concurrent migrations are serialized by an advisory lock."""
+        with engine.begin() as connection:
+            connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            ProcessStateTable.__table__.create(connection, checkfirst=True)
+            connection.execute(text("ALTER TABLE process_state ADD COLUMN IF NOT EXISTS relative_path VARCHAR(200)"))
+            connection.execute(text("UPDATE process_state SET relative_path = file_name WHERE relative_path IS NULL"))
+            deleted_rows = connection.execute(text(
+                "DELETE FROM process_state duplicate USING process_state kept "
+                "WHERE duplicate.relative_path = kept.relative_path AND duplicate.id > kept.id "
+                "RETURNING duplicate.file_name, duplicate.relative_path")).fetchall()
+            if deleted_rows:
+                affected_files = sorted({f"{file_name} ({relative_path})" for file_name, relative_path in deleted_rows})
+                logger.warning(f"{len(deleted_rows)} duplicate process_state rows deleted, "
+                               f"file_name (relative_path): {affected_files}")
+            connection.execute(text("DROP INDEX IF EXISTS process_state_file_name_idx"))
+            connection.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS process_state_relative_path_idx ON process_state (relative_path)"))
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS process_state_file_path_idx ON process_state (file_path)"))
+
     @staticmethod
     def dropTable(engine: Engine):
         ProcessStateTable.__table__.drop(engine, checkfirst=True)
@@ -0,0 +1,151 @@
+import json
+import os
+import sqlite3
+import unicodedata as ud
+from time import time
+from typing import Dict, Iterable, List, Optional
+
+from config.logger_config import LOGGER_LEVEL
+from domain.storages.abstract_match_cache import AbstractMatchCache
+from project.server.main.logger import get_logger
+
+logger = get_logger(__name__, level=LOGGER_LEVEL)
+
+# below the default maximum number of variables of a sqlite statement
+QUERY_CHUNK_SIZE = 500
+# share of the entries evicted, the least recently used first, when the cache is over its size
+EVICTED_SHARE = 0.1
+DEFAULT_MAX_SIZE_MB = 2048
+
+
+def _normalize_key(affiliation_string: str) -> str:
+    """Key of an affiliation string: unicode NFC form, whitespaces collapsed"""
+    return " ".join(ud.normalize("NFC", affiliation_string).split())
+
+
+class MatchCache(AbstractMatchCache):
+    """
+    Results of the affiliation matcher stored in a sqlite file, shared by the processes (WAL mode) and the runs.
+    Entries are keyed by matcher version, match type and normalized affiliation string: the entries of the other
+    versions of the matcher are deleted when the cache is opened. Once the data of the file are over max_size_mb,
+    the least recently used entries are evicted. The reads do not write: the last uses of the hits are kept
+    in memory and written with the next eviction or on close, so lookups do not wait for the sqlite writer lock.
+    Hits and misses are counted for the stats.
+
+    Args:
+        path (str): path of the sqlite file, created if needed, on a node-local filesystem (the WAL mode does not
+            work on network filesystems)
+        matcher_version (str): version of the affiliation matcher (AffiliationMatcher.get_version)
+        max_size_mb (int): maximum size of the data of the file
+    """
+
+    def __init__(self, path: str, matcher_version: str, max_size_mb: Optional[int] = DEFAULT_MAX_SIZE_MB):
+        self.path = path
+        self.matcher_version = str(matcher_version)
+        self.max_size = (max_size_mb or DEFAULT_MAX_SIZE_MB) * 2**20
+        self.hits, self.misses, self.nb_evicted = 0, 0, 0
+        # last use time of the hits not written yet, by (match type, key)
+        self._last_used = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # waits for the writes of the other processes instead of failing
+        self._connection = sqlite3.connect(path, timeout=600, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS matches (version TEXT NOT NULL, match_type TEXT NOT NULL, "
+            "query TEXT NOT NULL, results TEXT NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (version, match_type, query))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS matches_last_used_idx ON matches (last_used)")
+        nb_invalidated = self._connection.execute("DELETE FROM matches WHERE version != ?",
+                                                  (self.matcher_version,)).rowcount
+        if nb_invalidated:
+            logger.debug(f'{nb_invalidated} entries of other matcher versions removed from {path}')
+
+    def get_many(self, match_type: str, affiliation_strings: Iterable[str]) -> Dict[str, List]:
+        """Results of the affiliation strings found in the cache, by affiliation string"""
+        keys_by_string = {string: _normalize_key(string) for string in affiliation_strings if isinstance(string, str)}
+        keys = list(dict.fromkeys(keys_by_string.values()))
+        results_by_key = {}
+        for start in range(0, len(keys), QUERY_CHUNK_SIZE):
+            chunk = keys[start:start + QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            results_by_key.update(
+                (key, json.loads(results)) for key, results in self._connection.execute(
+                    f"SELECT query, results FROM matches WHERE version = ? AND match_type = ? "
+                    f"AND query IN ({placeholders})", [self.matcher_version, match_type, *chunk]))
+        now = time()
+        self._last_used.update(((match_type, key), now) for key in results_by_key)
+        results_by_string = {string: results_by_key[key] for string, key in keys_by_string.items()
+                             if key in results_by_key}
+        self.hits += len(results_by_string)
+        self.misses += len(keys_by_string) - len(results_by_string)
+        return results_by_string
+
+    def put_many(self, match_type: str, results_by_string: Dict[str, List]):
+        """Add the results of the affiliation strings, then evict entries if the cache is over its size"""
+        now = time()
+        rows = [(self.matcher_version, match_type, _normalize_key(string), json.dumps(results), now)
+                for string, results in results_by_string.items() if isinstance(string, str)]
+        if not rows:
+            return
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._connection.executemany("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?)", rows)
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        if self.get_size() > self.max_size:
+            self.evict()
+
+    def get_size(self) -> int:
+        """Size of the data of the file, without its free pages"""
+        page_count, = self._connection.execute("PRAGMA page_count").fetchone()
+        freelist_count, = self._connection.execute("PRAGMA freelist_count").fetchone()
+        page_size, = self._connection.execute("PRAGMA page_size").fetchone()
+        return (page_count - freelist_count) * page_size
+
+    def write_last_used(self):
+        """Write the last use times of the hits, in one transaction"""
+        if not self._last_used:
+            return
+        rows = [(last_used, self.matcher_version, match_type, key)
+                for (match_type, key), last_used in self._last_used.items()]
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._connection.executemany(
+                "UPDATE matches SET last_used = MAX(last_used, ?) WHERE version = ? AND match_type = ? AND query = ?",
+                rows)
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._last_used.clear()
+
+    def evict(self):
+        """Remove the least recently used EVICTED_SHARE of the entries, their pages being reused by the next inserts.
+        The last uses of the hits of this instance are written first (not the ones of the other processes)"""
+        self.write_last_used()
+        nb_entries, = self._connection.execute("SELECT COUNT(*) FROM matches").fetchone()
+        nb_evicted = self._connection.execute(
+            "DELETE FROM matches WHERE rowid IN (SELECT rowid FROM matches ORDER BY last_used LIMIT ?)",
+            (max(1, int(nb_entries * EVICTED_SHARE)),)).rowcount
+        self.nb_evicted += nb_evicted
+        logger.debug(f'{nb_evicted} entries evicted from {self.path}')
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+
+    def stats(self) -> Dict:
+        nb_lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / nb_lookups, 3) if nb_lookups else 0,
+            'evicted': self.nb_evicted,
+            'size_mb': round(self.get_size() / 2**20, 1),
+        }
+
+    def close(self):
+        self.write_last_used()
+        self._connection.close()
@@ -0,0 +1,145 @@
+import mmap
+import os
+import pickle
+import struct
+from bisect import bisect_left
+from hashlib import blake2b
+from typing import Any, Dict, Iterable, Iterator, Tuple, Union
+
+from config.logger_config import LOGGER_LEVEL
+from domain.storages.abstract_reference_store import AbstractReferenceStore
+from project.server.main.logger import get_logger
+
+logger = get_logger(__name__, level=LOGGER_LEVEL)
+
+MAGIC = b'REFSTOR1'
+# magic, number of keys, fingerprint
+HEADER = struct.Struct('<8sQ16s')
+KEY_LENGTH = struct.Struct('<I')
+UINT64_SIZE = 8
+
+
+def _key_hash(key: bytes) -> int:
+    return int.from_bytes(blake2b(key, digest_size=UINT64_SIZE).digest(), 'little')
+
+
+class ReferenceStore(AbstractReferenceStore):
+    """
+    Read-only mapping (or set) of reference data stored in a memory-mapped file, so that the worker processes
+    share its pages through the OS cache instead of each unpickling its own copy of a large dict.
+
+    File layout: a header, the sorted 64 bits hashes of the keys, the offsets of the entries, then the entries
+    (key length, utf-8 key and pickled value, empty for a set). A lookup is a binary search in the hashes.
+    Values are unpickled on each access. Pickling a ReferenceStore only pickles its path.
+
+    Args:
+        path (str): path of a file written by ReferenceStore.build
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._nb_keys, fingerprint = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a reference store')
+        self.fingerprint = fingerprint.hex()
+        hashes_start = HEADER.size
+        offsets_start = hashes_start + self._nb_keys * UINT64_SIZE
+        offsets_end = offsets_start + (self._nb_keys + 1) * UINT64_SIZE
+        self._hashes = memoryview(self._mmap)[hashes_start:offsets_start].cast('Q')
+        self._offsets = memoryview(self._mmap)[offsets_start:offsets_end].cast('Q')
+
+    @staticmethod
+    def build(path: str, data: Union[Dict[str, Any], Iterable[str]]) -> 'ReferenceStore':
+        """Write the dict (or the set of keys) data in a new store file at path, and open it"""
+        is_mapping = isinstance(data, dict)
+        entries = []
+        for key in data:
+            key_bytes = str(key).encode()
+            value = pickle.dumps(data[key], protocol=pickle.HIGHEST_PROTOCOL) if is_mapping else b''
+            entries.append((_key_hash(key_bytes), key_bytes, value))
+        entries.sort(key=lambda entry: (entry[0], entry[1]))
+        fingerprint = blake2b(digest_size=16)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(entries), b'\0' * 16))
+            f.write(b''.join(struct.pack('<Q', entry_hash) for entry_hash, _, _ in entries))
+            offset = HEADER.size + len(entries) * UINT64_SIZE + (len(entries) + 1) * UINT64_SIZE
+            offsets = [offset]
+            for _, key_bytes, value in entries:
+                offset += KEY_LENGTH.size + len(key_bytes) + len(value)
+                offsets.append(offset)
+            f.write(b''.join(struct.pack('<Q', offset) for offset in offsets))
+            for _, key_bytes, value in entries:
+                entry = KEY_LENGTH.pack(len(key_bytes)) + key_bytes + value
+                fingerprint.update(entry)
+                f.write(entry)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, len(entries), fingerprint.digest()))
+        os.replace(tmp_path, path)
+        logger.debug(f'{len(entries)} keys written in {path}')
+        return ReferenceStore(path)
+
+    def _entry(self, index: int) -> Tuple[bytes, int, int]:
+        """Key, start and end offsets of the value of the index th entry"""
+        start = self._offsets[index]
+        key_length, = KEY_LENGTH.unpack_from(self._mmap, start)
+        key_start = start + KEY_LENGTH.size
+        return self._mmap[key_start:key_start + key_length], key_start + key_length, self._offsets[index + 1]
+
+    def _find(self, key: str) -> int:
+        """Index of the entry of the key, -1 if the key is not in the store"""
+        if not isinstance(key, str):
+            return -1
+        key_bytes = key.encode()
+        key_hash = _key_hash(key_bytes)
+        index = bisect_left(self._hashes, key_hash)
+        while index < self._nb_keys and self._hashes[index] == key_hash:
+            if self._entry(index)[0] == key_bytes:
+                return index
+            index += 1
+        return -1
+
+    def __contains__(self, key: str) -> bool:
+        return self._find(key) >= 0
+
+    def _value(self, index: int) -> Any:
+        _, value_start, value_end = self._entry(index)
+        return pickle.loads(self._mmap[value_start:value_end]) if value_end > value_start else None
+
+    def __getitem__(self, key: str) -> Any:
+        index = self._find(key)
+        if index < 0:
+            raise KeyError(key)
+        return self._value(index)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        index = self._find(key)
+        return self._value(index) if index >= 0 else default
+
+    def __len__(self) -> int:
+        return self._nb_keys
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self._nb_keys):
+            yield self._entry(index)[0].decode()
+
+    def keys(self) -> Iterator[str]:
+        return iter(self)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        for index in range(self._nb_keys):
+            yield self._entry(index)[0].decode(), self._value(index)
+
+    def close(self):
+        self._hashes.release()
+        self._offsets.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __getstate__(self) -> Dict:
+        return {'path': self.path}
+
+    def __setstate__(self, state: Dict):
+        self.__init__(state['path'])
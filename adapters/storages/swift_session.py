@@ -1,4 +1,5 @@
-from typing import List
+import io
+from typing import Iterable, Iterator, List
 from swiftclient.service import SwiftService, SwiftError, SwiftUploadObject
 
 from config.global_config import config_harvester
@@ -10,6 +11,28 @@ from project.server.main.logger import get_logger
 logger = get_logger(__name__, level=LOGGER_LEVEL)
 
 
+class _IterableStream(io.RawIOBase):
+    """Read-only file-like object over an iterable of bytes chunks, pulled when read"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks: Iterator[bytes] = iter(chunks)
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b""
+                return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
 class SwiftSession(AbstractSwiftSession):
     session: SwiftService
 
@@ -67,3 +90,17 @@ class SwiftSession(AbstractSwiftSession):
                             f'Result upload : {result["object"]} succesfully uploaded on {result["container"]} (from {result["path"]})')
         except SwiftError as e:
             logger.exception("error uploading file to SWIFT container", exc_info=True)
+
+    def upload_stream_to_swift(self, container, chunks: Iterable[bytes], dest_path: OvhPath, segment_size: int):
+        """
+        Upload a stream of bytes chunks to a SWIFT object, as a static large object of segments of segment_size bytes,
+        the chunks being consumed as the segments are sent. Raise a SwiftError if the upload fails.
+        """
+        obj = SwiftUploadObject(_IterableStream(chunks), object_name=str(dest_path),
+                                options={'segment_size': segment_size, 'use_slo': True})
+        for result in self._session.upload(container, [obj]):
+            if not result['success']:
+                logger.error(f"Failed to upload {result.get('object')} to container {container}: {result['error']}")
+                raise SwiftError(f"Failed to upload {dest_path} to container {container}: {result['error']}")
+            if result['action'] == "upload_object":
+                logger.debug(f'Result upload : {result["object"]} succesfully uploaded on {result["container"]}')
@@ -0,0 +1,108 @@
+import io
+from typing import Dict, Optional, Union
+from pathlib import Path
+
+import pandas as pd
+
+from application.utils_processor import (
+    _get_hash_bucket, _get_hash_buckets_path, _get_hash_partition_byte_range, _get_partition_byte_range,
+    _read_partition_index, NB_HASH_BUCKETS,
+)
+from config.logger_config import LOGGER_LEVEL
+from domain.api.abstract_affiliation_matcher import AbstractAffiliationMatcher
+from project.server.main.logger import get_logger
+
+logger = get_logger(__name__, level=LOGGER_LEVEL)
+
+# columns of the global (consolidated) affiliation file
+AFFILIATION_FILE_COLUMNS = ["doi_publisher", "doi_client_id", "affiliation_str"]
+# match types only queried for the french affiliations, after the country
+FRENCH_MATCH_TYPES = ["grid", "rnsr", "ror"]
+READ_CHUNK_SIZE = 100_000
+
+
+def get_affiliation_partition_index(affiliation_string: str, total_partition_number: int) -> int:
+    """Partition of an affiliation string, from its hash bucket (as in the hash buckets file of the
+    global affiliation file): total_partition_number must not exceed NB_HASH_BUCKETS"""
+    return _get_hash_bucket(str(affiliation_string)) * total_partition_number // NB_HASH_BUCKETS
+
+
+def _read_affiliations_byte_range(affiliation_file: Union[str, Path], start: int, end: int) -> pd.DataFrame:
+    """Rows of the byte range of an affiliation file, starting and ending at records boundaries"""
+    if start == end:
+        return pd.DataFrame(columns=AFFILIATION_FILE_COLUMNS)
+    with open(affiliation_file, "rb") as f:
+        f.seek(start)
+        partition_bytes = f.read(end - start)
+    return pd.read_csv(io.BytesIO(partition_bytes), header=None, names=AFFILIATION_FILE_COLUMNS)
+
+
+def read_affiliations_partition_by_hash(affiliation_file: Union[str, Path], partition_index: int,
+                                        total_partition_number: int) -> pd.DataFrame:
+    """Rows of the global affiliation file whose affiliation string is in the partition: all the rows of
+    an affiliation string are in the same partition. Only the byte range of the buckets of the partition is read
+    from the hash buckets file written at consolidation, else the whole file is read chunk by chunk."""
+    buckets_path = _get_hash_buckets_path(affiliation_file)
+    offsets = _read_partition_index(buckets_path)
+    if offsets is not None:
+        start, end = _get_hash_partition_byte_range(offsets, partition_index, total_partition_number)
+        return _read_affiliations_byte_range(buckets_path, start, end)
+    logger.debug(f"no hash buckets file for {affiliation_file}, reading the whole file")
+    partition_chunks = []
+    for chunk in pd.read_csv(affiliation_file, header=None, names=AFFILIATION_FILE_COLUMNS, chunksize=READ_CHUNK_SIZE):
+        # an empty affiliation string, read as NaN, is bucketed as in the hash buckets file
+        partition_indices = chunk["affiliation_str"].fillna("").map(
+            lambda affiliation_string: get_affiliation_partition_index(affiliation_string, total_partition_number))
+        partition_chunks.append(chunk[partition_indices == partition_index])
+    if not partition_chunks:
+        return pd.DataFrame(columns=AFFILIATION_FILE_COLUMNS)
+    return pd.concat(partition_chunks, ignore_index=True)
+
+
+def read_affiliations_partition_by_offsets(affiliation_file: Union[str, Path], partition_index: int,
+                                           total_partition_number: int) -> Optional[pd.DataFrame]:
+    """Rows of a partition of the global affiliation file, only its byte range being read, from the offsets
+    of the partition index written at consolidation. Return None if the file has no up to date index."""
+    offsets = _read_partition_index(affiliation_file)
+    if offsets is None:
+        return None
+    start, end = _get_partition_byte_range(offsets, partition_index, total_partition_number)
+    return _read_affiliations_byte_range(affiliation_file, start, end)
+
+
+def match_affiliations(affiliations_df: pd.DataFrame, affiliation_matcher: AbstractAffiliationMatcher) -> Dict:
+    """Add the countries detected in the affiliation strings, the french signals, and the grid, rnsr and ror
+    of the french affiliations to affiliations_df. Each distinct affiliation string is matched once per match type.
+    Return the number of rows and matcher calls, against one call per row and match type."""
+    affiliations_df["detected_countries"] = pd.Series(
+        affiliation_matcher.get_affiliations_many("country", affiliations_df["affiliation_str"]),
+        index=affiliations_df.index, dtype=object)
+    affiliations_df["is_publisher_fr"] = affiliations_df["doi_publisher"].apply(str).apply(
+        affiliation_matcher.is_publisher_fr)
+    affiliations_df["is_clientId_fr"] = affiliations_df["doi_client_id"].apply(str).apply(
+        affiliation_matcher.is_clientId_fr)
+    affiliations_df["is_countries_fr"] = affiliations_df["detected_countries"].apply(affiliation_matcher.is_countries_fr)
+    is_fr = (affiliations_df.is_publisher_fr | affiliations_df.is_clientId_fr | affiliations_df.is_countries_fr)
+    for match_type in FRENCH_MATCH_TYPES:
+        affiliations_df[match_type] = [[]] * len(affiliations_df)
+    # the match types of a french affiliation are requested together
+    french_results = affiliation_matcher.get_affiliations_multi(FRENCH_MATCH_TYPES,
+                                                                affiliations_df.loc[is_fr, "affiliation_str"])
+    for match_type in FRENCH_MATCH_TYPES:
+        affiliations_df.loc[is_fr, match_type] = pd.Series(french_results[match_type],
+                                                           index=affiliations_df.index[is_fr], dtype=object)
+
+    nb_french_rows = int(is_fr.sum())
+    nb_calls_per_row = len(affiliations_df) + nb_french_rows * len(FRENCH_MATCH_TYPES)
+    nb_matcher_calls = affiliations_df["affiliation_str"].nunique(dropna=False) \
+        + affiliations_df.loc[is_fr, "affiliation_str"].nunique(dropna=False) * len(FRENCH_MATCH_TYPES)
+    stats = {
+        'nb_rows': len(affiliations_df),
+        'nb_french_rows': nb_french_rows,
+        'nb_matcher_calls': nb_matcher_calls,
+        'nb_calls_per_row': nb_calls_per_row,
+        'calls_reduction': round(1 - nb_matcher_calls / nb_calls_per_row, 3) if nb_calls_per_row else 0,
+    }
+    logger.info(f"{nb_matcher_calls} matcher calls for {stats['nb_rows']} affiliations ({nb_french_rows} french) "
+                f"instead of {nb_calls_per_row}: {stats['calls_reduction']:.1%} less")
+    return stats
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+from hashlib import blake2b
+from typing import Iterable, Optional
+
+from config.logger_config import LOGGER_LEVEL
+from project.server.main.logger import get_logger
+
+logger = get_logger(__name__, level=LOGGER_LEVEL)
+
+DEFAULT_DIGEST_SIZE = 16
+DEFAULT_MAX_KEYS_IN_MEMORY = 5_000_000
+
+
+class DedupStore:
+    """
+    Set of already seen keys (natural keys, dois...) with constant time insert and lookup.
+    Keys are stored as fixed-width blake2b digests instead of the strings themselves.
+    In spill mode, the digests are kept in memory up to max_keys_in_memory, then moved
+    to a sqlite database in spill_folder, so the memory used stays bounded.
+    With a snapshot_file, the digests added since the last snapshot are appended to it on snapshot(),
+    and restore() reloads them, so the store can be checkpointed without rewriting all its digests.
+
+    Args:
+        digest_size (int): size in bytes of the digests (16 bytes: no collision expected below 10^15 keys)
+        spill_folder (str): folder of the sqlite spill database, no spill if None
+        max_keys_in_memory (int): number of digests kept in memory before spilling them to disk
+        snapshot_file (str): file of the snapshots, no snapshot if None
+    """
+
+    def __init__(self, digest_size: int = DEFAULT_DIGEST_SIZE, spill_folder: Optional[str] = None,
+                 max_keys_in_memory: int = DEFAULT_MAX_KEYS_IN_MEMORY, snapshot_file: Optional[str] = None):
+        self.digest_size = digest_size
+        self.spill_folder = spill_folder
+        self.max_keys_in_memory = max_keys_in_memory
+        self.snapshot_file = snapshot_file
+        self._digests = set()
+        self._nb_spilled = 0
+        # digests added since the last snapshot, and whether the snapshot file has to be rewritten
+        self._unsaved_digests = []
+        self._is_snapshot_reset = True
+        self._connection = None
+        if spill_folder is not None:
+            os.makedirs(spill_folder, exist_ok=True)
+            self._spill_file = os.path.join(spill_folder, f'dedup_{os.getpid()}_{id(self)}.sqlite')
+            self._connection = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        if os.path.exists(self._spill_file):
+            os.remove(self._spill_file)
+        connection = sqlite3.connect(self._spill_file)
+        connection.execute('PRAGMA journal_mode=OFF')
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.execute('CREATE TABLE digests (digest BLOB PRIMARY KEY) WITHOUT ROWID')
+        return connection
+
+    def digest(self, key: str) -> bytes:
+        return blake2b(key.encode(), digest_size=self.digest_size).digest()
+
+    def _is_spilled(self, digest: bytes) -> bool:
+        if not self._nb_spilled:
+            return False
+        return self._connection.execute('SELECT 1 FROM digests WHERE digest = ?', (digest,)).fetchone() is not None
+
+    def _spill(self):
+        self._connection.executemany('INSERT OR IGNORE INTO digests VALUES (?)', ((d,) for d in self._digests))
+        self._connection.commit()
+        self._nb_spilled += len(self._digests)
+        logger.debug(f'{len(self._digests)} digests spilled to {self._spill_file}')
+        self._digests = set()
+
+    def __contains__(self, key: str) -> bool:
+        digest = self.digest(key)
+        return digest in self._digests or self._is_spilled(digest)
+
+    def _add_digest(self, digest: bytes) -> bool:
+        if digest in self._digests or self._is_spilled(digest):
+            return False
+        self._digests.add(digest)
+        if self._connection is not None and len(self._digests) >= self.max_keys_in_memory:
+            self._spill()
+        return True
+
+    def add(self, key: str) -> bool:
+        """Add the key, return True if it was not already in the store"""
+        digest = self.digest(key)
+        is_new = self._add_digest(digest)
+        if is_new and self.snapshot_file is not None:
+            self._unsaved_digests.append(digest)
+        return is_new
+
+    def update(self, keys: Iterable[str]):
+        for key in keys:
+            self.add(key)
+
+    def __len__(self) -> int:
+        return len(self._digests) + self._nb_spilled
+
+    def reset(self):
+        """Forget all the keys, to start a new deduplication scope"""
+        self._digests = set()
+        self._unsaved_digests = []
+        self._is_snapshot_reset = True
+        if self._nb_spilled:
+            self._connection.execute('DELETE FROM digests')
+            self._connection.commit()
+            self._nb_spilled = 0
+
+    def snapshot(self) -> int:
+        """Persist the digests added since the last snapshot in the snapshot file.
+        Return the size of the snapshot file, to give to restore()."""
+        with open(self.snapshot_file, 'wb' if self._is_snapshot_reset else 'ab') as f:
+            f.write(b''.join(self._unsaved_digests))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        self._unsaved_digests = []
+        self._is_snapshot_reset = False
+        return size
+
+    def restore(self, size: int):
+        """Replace the keys of the store by the digests of the snapshot file, as they were
+        when snapshot() returned size. Digests written after it are dropped from the file."""
+        self.reset()
+        self._is_snapshot_reset = False
+        if size == 0 and not os.path.exists(self.snapshot_file):
+            return
+        with open(self.snapshot_file, 'r+b') as f:
+            f.truncate(size)
+            for block in iter(lambda: f.read(self.digest_size * 65536), b''):
+                for i in range(0, len(block), self.digest_size):
+                    self._add_digest(block[i:i + self.digest_size])
+
+    def close(self):
+        self._digests = set()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+            os.remove(self._spill_file)
+
+    def __enter__(self) -> 'DedupStore':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,131 @@
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from application.dedup_store import DedupStore
+from application.enricher import LOG_EVERY_N_DOIS, enrich_record, is_natural_keys_scope_end, log_counters, new_counters
+from application.enrichment_report import EnrichmentReport
+from application.index_sink_writer import IndexSinkWriter
+from application.processor import Processor
+from application.utils_processor import _new_affiliation_columns, dump_record_generator
+from config.logger_config import LOGGER_LEVEL
+from domain.api.abstract_dump_stage import AbstractDumpStage
+from project.server.main.logger import get_logger
+
+logger = get_logger(__name__, level=LOGGER_LEVEL)
+
+
+class DumpPipeline:
+    """
+    Single scan of the dump files feeding several stages: each record is decoded once and given to the stages
+    in their order, so a stage sees the changes made to the record by the previous ones.
+
+    Args:
+        stages (List[AbstractDumpStage]): consumers of the records
+        report (EnrichmentReport): the time spent reading the dump files is added to it if given
+    """
+
+    def __init__(self, stages: List[AbstractDumpStage], report: Optional[EnrichmentReport] = None):
+        self.stages = stages
+        self.report = report or EnrichmentReport()
+
+    def run(self, dump_files: List[str]):
+        """Read the dump files in order, the stages being closed at the end (or on failure)"""
+        try:
+            for dump_file in dump_files:
+                logger.debug(f'treating {dump_file}')
+                for stage in self.stages:
+                    stage.start_file(dump_file)
+                for doi in self.report.timed('read', dump_record_generator(dump_file)):
+                    for stage in self.stages:
+                        stage.process_record(doi)
+                for stage in self.stages:
+                    stage.end_file(dump_file)
+        finally:
+            for stage in self.stages:
+                stage.close()
+
+
+class AffiliationStage(AbstractDumpStage):
+    """
+    Extract the affiliations of the dois, as Processor.process_partition does, and write them in the partition
+    files of the processor. The files not in the files to process of the processor (already processed) are skipped.
+    The processed dois and files and their status are set once the stage is closed.
+    """
+
+    def __init__(self, processor: Processor, report: Optional[EnrichmentReport] = None):
+        self.processor = processor
+        self.report = report or EnrichmentReport()
+        self.files_to_process = {str(file) for file in processor.files_to_process}
+        self.affiliations = None
+        self.origin_file_name = None
+        self.non_null_dois, self.null_dois = 0, 0
+        self.global_processed_dois, self.processed_files_and_status = 0, []
+        processor.start_partition()
+
+    def start_file(self, dump_file: str):
+        self.affiliations = _new_affiliation_columns() if str(dump_file) in self.files_to_process else None
+        self.origin_file_name = self.processor.get_relative_path(dump_file)
+        self.non_null_dois, self.null_dois = 0, 0
+
+    def process_record(self, doi: Dict):
+        if self.affiliations is None:
+            return
+        with self.report.timer('affiliations'):
+            if Processor.append_doi_affiliations(self.affiliations, doi, self.origin_file_name):
+                self.non_null_dois += 1
+            else:
+                self.null_dois += 1
+
+    def end_file(self, dump_file: str):
+        if self.affiliations is None:
+            return
+        logger.info(f'partition_index : {self.processor.partition_index} {dump_file} number of dois '
+                    f'{self.non_null_dois + self.null_dois} number of non null dois {self.non_null_dois} '
+                    f'and null dois {self.null_dois}')
+        with self.report.timer('affiliations'):
+            self.processor.write_file_affiliations(dump_file, self.non_null_dois + self.null_dois, self.non_null_dois,
+                                                   self.null_dois, pd.DataFrame(self.affiliations))
+        self.affiliations = None
+
+    def close(self):
+        self.global_processed_dois, self.processed_files_and_status = self.processor.end_partition()
+
+
+class EnrichmentStage(AbstractDumpStage):
+    """
+    Look for the french signals of the dois and write the ES index records of the french ones with sink_writer,
+    as enrich_dump_files does without dois deduplication nor checkpoints:
+    dump files are expected to be sorted from the latest to the oldest.
+    """
+
+    def __init__(self, sink_writer: IndexSinkWriter, references: Dict, report: Optional[EnrichmentReport] = None):
+        self.sink_writer = sink_writer
+        self.references = references
+        self.report = report or EnrichmentReport()
+        # to handle natural keys present multiple times
+        self.known_natural_keys = DedupStore()
+        self.dump_file = None
+        self.counters = new_counters()
+        self.nb_read = 0
+
+    def start_file(self, dump_file: str):
+        self.dump_file = dump_file
+        self.counters = new_counters()
+        self.nb_read = 0
+
+    def process_record(self, doi: Dict):
+        self.nb_read += 1
+        enriched_record = enrich_record(doi, self.dump_file, self.references, self.known_natural_keys, self.counters,
+                                        self.report)
+        if enriched_record is not None and enriched_record[1]:
+            with self.report.timer('write'):
+                self.sink_writer.write_record(enriched_record[1])
+        if self.nb_read % LOG_EVERY_N_DOIS == 0:
+            log_counters(self.dump_file, self.nb_read, self.counters, self.known_natural_keys, None)
+
+    def end_file(self, dump_file: str):
+        self.report.count_file(dump_file, 'read', self.nb_read)
+        log_counters(dump_file, self.nb_read, self.counters, self.known_natural_keys, None)
+        if is_natural_keys_scope_end(dump_file):
+            self.known_natural_keys.reset()
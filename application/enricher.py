@@ -0,0 +1,421 @@
+import json
+import os
+import shutil
+from multiprocessing import Pool
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from application.dedup_store import DedupStore
+from application.enrichment_checkpoint import EnrichmentCheckpoint
+from application.enrichment_manifest import EnrichmentManifest, get_file_signature, get_references_fingerprint
+from application.enrichment_report import EnrichmentReport
+from application.french_signal_detector import FrenchSignalDetector
+from application.index_sink_writer import IndexSinkWriter
+from application.utils_processor import (
+    _format_string, dump_record_generator, get_client_id, get_es_index_record,
+    get_natural_key, get_publisher, get_resourceTypeGeneral,
+)
+from config.business_rules import FRENCH_ALPHA2
+from config.logger_config import LOGGER_LEVEL
+from project.server.main.logger import get_logger
+from project.server.main.strings import log_normalize_cache_stats, normalize, normalize_many
+
+logger = get_logger(__name__, level=LOGGER_LEVEL)
+
+EXCLUDED_FULL_NAMES = ["anne houles"]
+# Natural keys are deduplicated within an updated_* folder: files are treated from the latest
+# to the oldest, and the last file treated in a folder is its 0000 file
+NATURAL_KEYS_SCOPE_END = '0000.jsonl.gz'
+SHARD_SUFFIX = '.shard'
+LOG_EVERY_N_DOIS = 1000
+CHECKPOINT_EVERY_N_DOIS = 100000
+
+# Built once per process, inherited by the workers of the sharded mode
+french_signal_detector = FrenchSignalDetector()
+# Reference data of a worker process of the sharded mode, set by _init_worker
+worker_references = {}
+
+
+def enrich_doi(doi: Dict, references: Dict, counters: Dict) -> Optional[Dict]:
+    """Look for french signals in a doi.
+    Return the doi enriched with its fr_reasons, rors, french authors and linked publications,
+    or None if the doi is not french or has to be skipped.
+
+    references is a dict with the bso_doi_dict, french_authors_dict, french_rors,
+    bso3_local_affiliations_dict and excluded_last_names reference data.
+    """
+    bso_doi_dict = references['bso_doi_dict']
+    french_authors_dict = references['french_authors_dict']
+    french_rors = references['french_rors']
+    excluded_last_names = references['excluded_last_names']
+    fr_reasons = []
+    rors = []
+    bso_local_affiliations_from_publications = []
+    fr_publications_linked = []
+    fr_authors_orcid = []
+    fr_authors_name = []
+    current_year = doi['attributes'].get('publicationYear')
+    publisher = doi['attributes'].get('publisher')
+    doi_split_last = doi['id'].lower().split('.')[-1]
+    has_version_in_doi = ( len(doi_split_last) >= 2 and doi_split_last[0] == 'v' and doi_split_last[1:].isdigit() )
+    # do not keep 10.6084/m9.figshare.12874890.v1 type doi (duplicates from figshare)
+    if has_version_in_doi:
+        if isinstance(publisher, str) and publisher.lower() in ['figshare', '4tu.researchdata']:
+            return None
+        if 'figshare' in doi['id'].lower():
+            return None
+    if 'attributes' in doi and 'relatedIdentifiers' in doi['attributes']:
+        for rel_id in doi['attributes']['relatedIdentifiers']:
+            if rel_id.get('relationType') == 'IsSupplementTo':
+                if isinstance(rel_id.get('relatedIdentifier'), str) and rel_id['relatedIdentifier'].lower() in bso_doi_dict:
+                    fr_reasons.append('linked_article')
+                    publi_info = bso_doi_dict[rel_id['relatedIdentifier'].lower()]
+                    rors += publi_info['rors']
+                    bso_local_affiliations_from_publications += publi_info['bso_local_affiliations_from_publications']
+                    fr_publications_linked.append({'doi': rel_id['relatedIdentifier'].lower(), 'rors': publi_info['rors'], 'bso_local_affiliations_from_publications': publi_info['bso_local_affiliations_from_publications']})
+    countries, affiliations = [], []
+    affiliation_strings = []
+    for obj in doi["attributes"]["creators"] + doi["attributes"]["contributors"]:
+        if 'nameIdentifiers' in obj:
+            nameIdentifiers = obj.get('nameIdentifiers', [])
+            if not isinstance(nameIdentifiers, list):
+                nameIdentifiers = [nameIdentifiers]
+            assert(isinstance(nameIdentifiers, list))
+            for nameIdentifier in nameIdentifiers:
+                if isinstance(nameIdentifier.get('nameIdentifierScheme'), str) and nameIdentifier.get('nameIdentifierScheme').lower().strip()=='orcid':
+                    if isinstance(nameIdentifier.get('nameIdentifier'), str):
+                        current_orcid = nameIdentifier.get('nameIdentifier').split('/')[-1].upper()
+                        if current_orcid in french_authors_dict and current_year in french_authors_dict[current_orcid]:
+                            fr_reasons.append('french_orcid')
+                            orcid_info = french_authors_dict[current_orcid][current_year]
+                            rors += orcid_info
+                            fr_authors_orcid.append({'author': obj, 'rors': orcid_info})
+        normalized_names = []
+        if isinstance(obj.get('name'), str):
+            normalized_name = normalize(obj['name'].replace(',', ' '))
+            normalized_names.append(normalized_name)
+            fr_reasons += french_signal_detector.get_name_reasons(normalized_name)
+        if isinstance(obj.get('familyName'), str) and isinstance(obj.get('givenName'), str):
+            normalized_name = normalize(obj['givenName'])+' '+normalize(obj['familyName'])
+            normalized_names.append(normalized_name)
+            normalized_name = normalize(obj['familyName'])+' '+normalize(obj['givenName'])
+            normalized_names.append(normalized_name)
+        for normalized_name in list(set(normalized_names)):
+            to_exclude = False
+            if normalized_name in french_authors_dict and current_year in french_authors_dict[normalized_name]:
+                if publisher=='UNITE Community' and normalized_name in EXCLUDED_FULL_NAMES:
+                    to_exclude = True
+                for word in excluded_last_names:
+                    if word in normalized_name.split(' '):
+                        to_exclude = True
+                if to_exclude:
+                    continue
+                fr_reasons.append('french_author')
+                author_info = french_authors_dict[normalized_name][current_year]
+                rors += author_info
+                fr_authors_name.append({'author': {'name': normalized_name}, 'rors':author_info})
+        for affiliation in obj.get("affiliation", []):
+            if 'affiliationIdentifier' in obj:
+                assert(isinstance(obj['affiliationIdentifier'], str))
+                if 'ror' in obj['affiliationIdentifier'].lower():
+                    current_ror = obj['affiliationIdentifier'].lower().split('/')[-1]
+                    rors.append(current_ror)
+                    if current_ror in french_rors:
+                        fr_reasons.append('french_ror')
+            if affiliation:
+                aff_str = str(affiliation)
+                affiliation_strings.append(aff_str)
+    normalized_affiliations = normalize_many(affiliation_strings)
+    for affiliation_reasons in french_signal_detector.get_affiliation_reasons_many(normalized_affiliations):
+        fr_reasons += affiliation_reasons
+    countries = list(set(countries))
+    doi['countries'] = countries
+    doi['affiliations'] = affiliations
+    for c in countries:
+        if c in FRENCH_ALPHA2:
+            fr_reasons.append('country')
+            counters['nb_new_country'] += 1
+    if french_signal_detector.is_french_publisher(get_publisher(doi)):
+        fr_reasons.append('publisher')
+        counters['nb_new_publisher'] += 1
+    if get_client_id(doi).startswith('inist.'):
+        fr_reasons.append("clientId")
+        counters['nb_new_client'] += 1
+    rors = list(set(rors))
+    bso_local_affiliations_from_publications = list(set(bso_local_affiliations_from_publications))
+    fr_reasons = list(set(fr_reasons))
+    fr_reasons.sort()
+    fr_reasons_concat = ';'.join(fr_reasons)
+    # skip image from nakala without any other interesting meta
+    if fr_reasons_concat == 'clientId;publisher' and get_resourceTypeGeneral(doi) == 'image':
+        return None
+    if len(fr_reasons) == 0:
+        return None
+    doi['fr_reasons'] = fr_reasons
+    doi['fr_reasons_concat'] = fr_reasons_concat
+    doi['rors'] = rors
+    doi['bso_local_affiliations_from_publications'] = bso_local_affiliations_from_publications
+    doi['fr_authors_orcid'] = fr_authors_orcid
+    doi['fr_authors_name'] = fr_authors_name
+    doi['fr_publications_linked'] = fr_publications_linked
+    return doi
+
+
+def new_counters() -> Dict:
+    return {'nb_new_doi': 0, 'nb_new_country': 0, 'nb_new_publisher': 0, 'nb_new_client': 0}
+
+
+def enrich_record(doi: Dict, dump_file: str, references: Dict, known_natural_keys: DedupStore, counters: Dict,
+                  report: EnrichmentReport) -> Optional[Tuple[Optional[str], Optional[Dict]]]:
+    """Enrich a doi read in dump_file. Return its (natural_key, es_index_record) tuple if it is french
+    (see enrich_dump_file), None if it is not french or its natural key is already in known_natural_keys."""
+    with report.timer('natural_key'):
+        natural_key = get_natural_key(doi)
+    if natural_key and natural_key in known_natural_keys:
+        return None
+    with report.timer('detect'):
+        enriched_doi = enrich_doi(doi, references, counters)
+    if enriched_doi is None:
+        return None
+    enriched_doi['natural_key'] = natural_key
+    with report.timer('index_record'):
+        es_index_record = get_es_index_record(enriched_doi, references['bso3_local_affiliations_dict'])
+    if es_index_record:
+        counters['nb_new_doi'] += 1
+    if natural_key:
+        known_natural_keys.add(natural_key)  # only for french
+    report.count_french_doi(dump_file, enriched_doi['fr_reasons'], get_publisher(enriched_doi), bool(es_index_record))
+    return natural_key, es_index_record
+
+
+def enrich_dump_file(dump_file: str, references: Dict, known_natural_keys: DedupStore,
+                     known_dois: Optional[DedupStore] = None, nb_skipped: int = 0, counters: Optional[Dict] = None,
+                     on_checkpoint: Optional[Callable[[int, Dict], None]] = None,
+                     report: Optional[EnrichmentReport] = None) -> Iterator[Tuple[Optional[str], Optional[Dict]]]:
+    """Read a datacite dump file and yield a (natural_key, es_index_record) tuple for each french doi.
+    es_index_record is None when the doi is french but not indexed (versions, files).
+    Dois whose natural key is already in known_natural_keys are skipped, the natural keys
+    of the french dois are added to known_natural_keys.
+    If known_dois is given, the dois already read are skipped too, and every doi read is added to it.
+    To resume a file, the nb_skipped first dois are skipped and the counters start from the given ones.
+    on_checkpoint(nb_read, counters) is called every CHECKPOINT_EVERY_N_DOIS dois read, once all the
+    tuples of these dois are consumed.
+    The time spent and the dois read / french / indexed are added to report if given."""
+    counters = counters or new_counters()
+    report = report or EnrichmentReport()
+    logger.debug(f'start reading {dump_file}' + (f' from doi {nb_skipped + 1}' if nb_skipped else ''))
+    index = 0
+    for index, doi in enumerate(report.timed('read', dump_record_generator(dump_file)), start=1):
+        if index <= nb_skipped:
+            continue
+        if on_checkpoint is not None and index - 1 > nb_skipped and (index - 1) % CHECKPOINT_EVERY_N_DOIS == 0:
+            on_checkpoint(index - 1, counters)
+        if known_dois is not None and not known_dois.add(doi['id']):
+            continue
+        enriched_record = enrich_record(doi, dump_file, references, known_natural_keys, counters, report)
+        if enriched_record is not None:
+            yield enriched_record
+        if index % LOG_EVERY_N_DOIS == 0:
+            log_counters(dump_file, index, counters, known_natural_keys, known_dois)
+    report.count_file(dump_file, 'read', max(index - nb_skipped, 0))
+    log_counters(dump_file, index, counters, known_natural_keys, known_dois)
+
+
+def log_counters(dump_file: str, nb_read: int, counters: Dict, known_natural_keys: DedupStore,
+                 known_dois: Optional[DedupStore]):
+    logger.debug(f"{dump_file}: {nb_read} dois read - {counters['nb_new_doi']} doi added - country {counters['nb_new_country']} - publisher {counters['nb_new_publisher']} - client {counters['nb_new_client']}")
+    logger.debug(f"known_natural_keys={len(known_natural_keys)} / known_dois = {len(known_dois) if known_dois is not None else '-'}")
+
+
+def is_natural_keys_scope_end(dump_file: str) -> bool:
+    return NATURAL_KEYS_SCOPE_END in dump_file
+
+
+def enrich_dump_files(dump_files: List[str], sink_writer: IndexSinkWriter, references: Dict,
+                      dedup_dois: bool = False, spill_folder: Optional[str] = None,
+                      checkpoint: Optional[EnrichmentCheckpoint] = None, report: Optional[EnrichmentReport] = None):
+    """Enrich the dump files one after the other and write the french dois in the ES index source file.
+    dump_files are expected to be sorted from the latest to the oldest.
+    If dedup_dois is set, only the first occurrence of a doi is treated, the dois read being
+    spilled to spill_folder when they do not fit in memory.
+    If checkpoint is given, the progress is saved after each dump file and every CHECKPOINT_EVERY_N_DOIS dois,
+    and the enrichment restarts from the saved progress if the checkpoint is resumed.
+    Timers and counters are added to report if given."""
+    report = report or EnrichmentReport()
+    # to handle natural keys present multiple times
+    known_natural_keys = DedupStore(snapshot_file=checkpoint.natural_keys_snapshot_file if checkpoint else None)
+    # to handle dois present multiple times
+    known_dois = DedupStore(spill_folder=spill_folder,
+                            snapshot_file=checkpoint.dois_snapshot_file if checkpoint else None) if dedup_dois else None
+    nb_files_done, nb_read, counters = 0, 0, None
+    if checkpoint is not None and checkpoint.get('nb_files_done') is not None:
+        nb_files_done, nb_read, counters = checkpoint.get('nb_files_done'), checkpoint.get('nb_read'), checkpoint.get('counters')
+        known_natural_keys.restore(checkpoint.get('natural_keys_snapshot'))
+        if known_dois is not None:
+            known_dois.restore(checkpoint.get('dois_snapshot') or 0)
+
+    def save_checkpoint(nb_files_done: int, nb_read: int, counters: Optional[Dict]):
+        checkpoint.save(nb_files_done=nb_files_done, nb_read=nb_read, counters=counters,
+                        output_offset=sink_writer.checkpoint(),
+                        natural_keys_snapshot=known_natural_keys.snapshot(),
+                        dois_snapshot=known_dois.snapshot() if known_dois is not None else None)
+
+    try:
+        for file_index, dump_file in enumerate(dump_files):
+            if file_index < nb_files_done:
+                continue
+            logger.debug(f'treating {dump_file}')
+            is_resumed_file = file_index == nb_files_done
+            on_checkpoint = None
+            if checkpoint is not None:
+                on_checkpoint = lambda nb_read, counters, file_index=file_index: save_checkpoint(file_index, nb_read, counters)
+            for natural_key, es_index_record in enrich_dump_file(dump_file, references, known_natural_keys, known_dois,
+                                                                 nb_skipped=nb_read if is_resumed_file else 0,
+                                                                 counters=counters if is_resumed_file else None,
+                                                                 on_checkpoint=on_checkpoint, report=report):
+                if es_index_record:
+                    with report.timer('write'):
+                        sink_writer.write_record(es_index_record)
+            if is_natural_keys_scope_end(dump_file):
+                known_natural_keys.reset()
+            if checkpoint is not None:
+                save_checkpoint(file_index + 1, 0, None)
+    finally:
+        if known_dois is not None:
+            known_dois.close()
+
+
+def get_shard_file(dump_file: str, shard_folder: str) -> str:
+    return os.path.join(shard_folder, f"{_format_string(dump_file)}{SHARD_SUFFIX}")
+
+
+def write_shard(dump_file: str, shard_file: str, references: Dict) -> EnrichmentReport:
+    """Enrich one dump file and write a shard file with one line per french doi:
+    the json encoded natural key, a tab, then the ES index record (empty if the doi is not indexed).
+    The shard is written in a temporary file renamed at the end, so an existing shard file is always complete.
+    Return the report of the enrichment of the file, its french dois being counted before the deduplication
+    of the natural keys across files."""
+    report = EnrichmentReport()
+    tmp_shard_file = f'{shard_file}.tmp'
+    with open(tmp_shard_file, 'w') as f:
+        # natural keys are only deduplicated inside the file, the merge handles the other files
+        for natural_key, es_index_record in enrich_dump_file(dump_file, references, DedupStore(), report=report):
+            with report.timer('write'):
+                f.write(json.dumps(natural_key))
+                f.write('\t')
+                if es_index_record:
+                    f.write(json.dumps(es_index_record))
+                f.write('\n')
+    os.replace(tmp_shard_file, shard_file)
+    log_normalize_cache_stats(f'shard of {dump_file}')
+    return report
+
+
+def _init_worker(references: Dict):
+    global worker_references
+    worker_references = references
+
+
+def _write_shard_in_worker(dump_file_and_shard_file: Tuple[str, str]) -> Tuple[str, Dict]:
+    dump_file, shard_file = dump_file_and_shard_file
+    report = write_shard(dump_file, shard_file, worker_references)
+    return dump_file, report.to_dict()
+
+
+def merge_shards(dump_files: List[str], shard_files: List[str], sink_writer: IndexSinkWriter):
+    """Write the shards in the ES index source file in the order of the dump files,
+    deduplicating the natural keys exactly as enrich_dump_files does."""
+    known_natural_keys = DedupStore()
+    for dump_file, shard_file in zip(dump_files, shard_files):
+        with open(shard_file, 'r') as shard:
+            for line in shard:
+                natural_key, es_index_record = line.rstrip('\n').split('\t', 1)
+                natural_key = json.loads(natural_key)
+                if natural_key and not known_natural_keys.add(natural_key):
+                    continue
+                if es_index_record:
+                    sink_writer.write(es_index_record)
+        if is_natural_keys_scope_end(dump_file):
+            known_natural_keys.reset()
+
+
+def write_shards(dump_files: List[str], shard_files: List[str], references: Dict, nb_workers: int,
+                 on_shard_written: Optional[Callable[[str], None]] = None, report: Optional[EnrichmentReport] = None):
+    """Write the shards of the dump files in a pool of nb_workers processes.
+    on_shard_written(dump_file) is called as soon as the shard of a dump file is written.
+    The reports of the workers are merged in report if given, their timers being summed over the workers."""
+    if len(dump_files) == 0:
+        return
+    logger.debug(f'enriching {len(dump_files)} files with {nb_workers} workers')
+    with Pool(processes=nb_workers, initializer=_init_worker, initargs=(references,)) as pool:
+        shard_reports = pool.imap_unordered(_write_shard_in_worker, zip(dump_files, shard_files))
+        for index, (dump_file, shard_report) in enumerate(shard_reports):
+            logger.debug(f'shard {index + 1} / {len(dump_files)} done for {dump_file}')
+            if report is not None:
+                report.merge(shard_report)
+            if on_shard_written is not None:
+                on_shard_written(dump_file)
+
+
+def enrich_dump_files_sharded(dump_files: List[str], sink_writer: IndexSinkWriter, references: Dict, nb_workers: int,
+                              shard_folder: str, resume: bool = False, report: Optional[EnrichmentReport] = None):
+    """Enrich the dump files in a pool of nb_workers processes, each dump file being written in its own shard,
+    then merge the shards in the ES index source file.
+    The output is the same as enrich_dump_files for the same dump_files order.
+    If resume is set, the shards written by a previous interrupted call are kept and only the missing ones are written."""
+    report = report or EnrichmentReport()
+    if not resume:
+        shutil.rmtree(shard_folder, ignore_errors=True)
+    os.makedirs(shard_folder, exist_ok=True)
+    shard_files = [get_shard_file(dump_file, shard_folder) for dump_file in dump_files]
+    missing_shards = [(dump_file, shard_file) for dump_file, shard_file in zip(dump_files, shard_files)
+                      if not os.path.isfile(shard_file)]
+    if resume:
+        logger.debug(f'{len(dump_files) - len(missing_shards)} shards already written in {shard_folder}')
+    # nothing buffered must be inherited by the forked workers
+    sink_writer.flush()
+    write_shards([dump_file for dump_file, _ in missing_shards], [shard_file for _, shard_file in missing_shards],
+                 references, nb_workers, report=report)
+    report.nb_files_reused += len(dump_files) - len(missing_shards)
+    logger.debug(f'merging {len(shard_files)} shards into {sink_writer.file}')
+    with report.timer('merge'):
+        merge_shards(dump_files, shard_files, sink_writer)
+    shutil.rmtree(shard_folder)
+
+
+def enrich_dump_files_incremental(dump_files: List[str], sink_writer: IndexSinkWriter, references: Dict, nb_workers: int,
+                                  shard_folder: str, fingerprint_files: List[str] = [],
+                                  report: Optional[EnrichmentReport] = None) -> List[str]:
+    """Same as enrich_dump_files_sharded, but the shards are kept in shard_folder with a manifest
+    so that the next call only enriches the dump files that are new or changed since.
+    All the shards are invalidated when the reference data (or the content of the fingerprint_files) change.
+    Return the list of the dump files enriched."""
+    report = report or EnrichmentReport()
+    os.makedirs(shard_folder, exist_ok=True)
+    manifest = EnrichmentManifest(shard_folder, get_references_fingerprint(references, fingerprint_files))
+    shard_files = [get_shard_file(dump_file, shard_folder) for dump_file in dump_files]
+    changed_dump_files, changed_shard_files = [], []
+    for dump_file, shard_file in zip(dump_files, shard_files):
+        if not manifest.is_up_to_date(dump_file, shard_file):
+            changed_dump_files.append(dump_file)
+            changed_shard_files.append(shard_file)
+    logger.debug(f'{len(changed_dump_files)} / {len(dump_files)} dump files to enrich in {shard_folder}')
+    for dump_file in set(manifest.files) - set(dump_files):
+        logger.debug(f'{dump_file} is not a dump file anymore, removing its shard')
+        manifest.remove(dump_file)
+        if os.path.isfile(get_shard_file(dump_file, shard_folder)):
+            os.remove(get_shard_file(dump_file, shard_folder))
+    signatures = {dump_file: get_file_signature(dump_file) for dump_file in changed_dump_files}
+    manifest.save()
+
+    def on_shard_written(dump_file: str):
+        # saved after each shard, so that an interrupted call does not have to enrich it again
+        manifest.update(dump_file, signatures[dump_file])
+        manifest.save()
+
+    sink_writer.flush()
+    write_shards(changed_dump_files, changed_shard_files, references, nb_workers, on_shard_written, report=report)
+    report.nb_files_reused += len(dump_files) - len(changed_dump_files)
+    logger.debug(f'merging {len(shard_files)} shards into {sink_writer.file}')
+    with report.timer('merge'):
+        merge_shards(dump_files, shard_files, sink_writer)
+    return changed_dump_files
@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+from hashlib import blake2b
+from typing import Any, List, Optional
+
+from config.logger_config import LOGGER_LEVEL
+from project.server.main.logger import get_logger
+
+logger = get_logger(__name__, level=LOGGER_LEVEL)
+
+CHECKPOINT_FILE_NAME = 'checkpoint.json'
+NATURAL_KEYS_SNAPSHOT_FILE_NAME = 'natural_keys.dedup'
+DOIS_SNAPSHOT_FILE_NAME = 'dois.dedup'
+
+
+class EnrichmentCheckpoint:
+    """
+    Progress of an enrichment run, persisted in checkpoint_folder so that the run can be resumed after a failure:
+    whether the PDBs are written, the number of dump files completed, the number of dois read in the current file,
+    the offset of the output file, the sizes of the dedup stores snapshots and the counters.
+
+    Args:
+        checkpoint_folder (str): folder of the checkpoint file and of the dedup stores snapshots
+        dump_files (List[str]): dump files of the run, a checkpoint of another list of dump files is not resumed
+        output_file (str): ES index source file, a checkpoint beyond its size is not resumed
+        resume (bool): resume from the checkpoint of the previous run if any, else start from scratch
+        mode (str): enrichment mode of the run ('sequential', 'sharded' or 'incremental'), with its nb_workers:
+            the output file and the shards of another mode or number of workers have another layout,
+            so a checkpoint of another mode or number of workers is not resumed
+    """
+
+    def __init__(self, checkpoint_folder: str, dump_files: List[str], output_file: str, resume: bool = False,
+                 mode: str = 'sequential', nb_workers: Optional[int] = None):
+        self.checkpoint_folder = checkpoint_folder
+        self.checkpoint_file = os.path.join(checkpoint_folder, CHECKPOINT_FILE_NAME)
+        self.natural_keys_snapshot_file = os.path.join(checkpoint_folder, NATURAL_KEYS_SNAPSHOT_FILE_NAME)
+        self.dois_snapshot_file = os.path.join(checkpoint_folder, DOIS_SNAPSHOT_FILE_NAME)
+        self.dump_files_fingerprint = blake2b('\n'.join(dump_files).encode(), digest_size=16).hexdigest()
+        self.mode = mode
+        self.nb_workers = nb_workers
+        self.state = {}
+        if resume and os.path.isfile(self.checkpoint_file):
+            with open(self.checkpoint_file, 'r') as f:
+                state = json.load(f)
+            output_size = os.path.getsize(output_file) if os.path.isfile(output_file) else -1
+            if state.get('dump_files_fingerprint') != self.dump_files_fingerprint:
+                logger.debug(f'the dump files changed since {self.checkpoint_file}, starting from scratch')
+            elif (state.get('mode'), state.get('nb_workers')) != (mode, nb_workers):
+                logger.debug(f"{self.checkpoint_file} is of mode {state.get('mode')} with {state.get('nb_workers')} "
+                             f"workers, not {mode} with {nb_workers} workers, starting from scratch")
+            elif state.get('output_offset', 0) > output_size:
+                logger.debug(f'{output_file} is shorter than in {self.checkpoint_file}, starting from scratch')
+            else:
+                logger.debug(f'resuming from {self.checkpoint_file}: {state}')
+                self.state = state
+        if not self.state:
+            shutil.rmtree(checkpoint_folder, ignore_errors=True)
+        os.makedirs(checkpoint_folder, exist_ok=True)
+
+    @property
+    def is_resumed(self) -> bool:
+        return len(self.state) > 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.state.get(key, default)
+
+    def save(self, **state):
+        """Update the checkpoint with the state given and persist it"""
+        self.state.update(state, dump_files_fingerprint=self.dump_files_fingerprint, mode=self.mode,
+                          nb_workers=self.nb_workers)
+        tmp_checkpoint_file = f'{self.checkpoint_file}.tmp'
+        with open(tmp_checkpoint_file, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_checkpoint_file, self.checkpoint_file)
+
+    def clear(self):
+        self.state = {}
+        shutil.rmtree(self.checkpoint_folder, ignore_errors=True)
@@ -0,0 +1,99 @@
+import json
+import os
+from hashlib import blake2b
+from typing import Dict, List
+
+import orjson
+
+from config.logger_config import LOGGER_LEVEL
+from domain.storages.abstract_reference_store import AbstractReferenceStore
+from project.server.main.logger import get_logger
+
+logger = get_logger(__name__, level=LOGGER_LEVEL)
+
+MANIFEST_FILE_NAME = 'manifest.json'
+FILE_READ_SIZE = 1024 * 1024
+ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+
+def _sorted_list(obj) -> List:
+    """orjson default serializer: sets are serialized as sorted lists"""
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError
+
+
+def _update_digest(digest, obj):
+    if isinstance(obj, AbstractReferenceStore):
+        # the fingerprint of its content is computed when the store is built
+        digest.update(obj.fingerprint.encode())
+    elif isinstance(obj, dict):
+        # item by item, not to serialize millions of entries at once
+        for key in sorted(obj, key=str):
+            digest.update(orjson.dumps([key, obj[key]], default=_sorted_list, option=ORJSON_OPTIONS))
+    else:
+        digest.update(orjson.dumps(obj, default=_sorted_list, option=ORJSON_OPTIONS))
+
+
+def get_references_fingerprint(references: Dict, files: List[str] = []) -> str:
+    """Fingerprint of the content of the reference data used to enrich the dois,
+    and of the content of the files the enrichment reads on its own (re3data signatures...)."""
+    fingerprint = {}
+    for name in sorted(references):
+        digest = blake2b(digest_size=16)
+        _update_digest(digest, references[name])
+        fingerprint[name] = digest.hexdigest()
+    for file in files:
+        digest = blake2b(digest_size=16)
+        if os.path.isfile(file):
+            with open(file, 'rb') as f:
+                for block in iter(lambda: f.read(FILE_READ_SIZE), b''):
+                    digest.update(block)
+        fingerprint[file] = digest.hexdigest()
+    return blake2b(json.dumps(fingerprint, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def get_file_signature(file: str) -> Dict:
+    stat = os.stat(file)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+class EnrichmentManifest:
+    """
+    Manifest of the shards of a previous enrichment: for each dump file, the signature (size, mtime)
+    of the dump file its shard was produced from, and the fingerprint of the reference data used.
+    A shard is up to date if its dump file did not change since and the reference data are the same.
+
+    Args:
+        shard_folder (str): folder of the shards, where the manifest is stored
+        references_fingerprint (str): fingerprint of the current reference data, see get_references_fingerprint
+    """
+
+    def __init__(self, shard_folder: str, references_fingerprint: str):
+        self.manifest_file = os.path.join(shard_folder, MANIFEST_FILE_NAME)
+        self.references_fingerprint = references_fingerprint
+        self.files = {}
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('references_fingerprint') == references_fingerprint:
+                self.files = manifest.get('files', {})
+            else:
+                logger.debug(f'reference data changed since the last enrichment, {self.manifest_file} is invalidated')
+
+    def is_up_to_date(self, dump_file: str, shard_file: str) -> bool:
+        return (dump_file in self.files and os.path.isfile(shard_file)
+                and self.files[dump_file] == get_file_signature(dump_file))
+
+    def update(self, dump_file: str, signature: Dict = None):
+        """Record the signature of the dump file, taken before its shard was written if given"""
+        self.files[dump_file] = signature or get_file_signature(dump_file)
+
+    def remove(self, dump_file: str):
+        self.files.pop(dump_file, None)
+
+    def save(self):
+        tmp_manifest_file = f'{self.manifest_file}.tmp'
+        with open(tmp_manifest_file, 'w') as f:
+            json.dump({'references_fingerprint': self.references_fingerprint, 'files': self.files}, f)
+        os.replace(tmp_manifest_file, self.manifest_file)
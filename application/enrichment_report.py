@@ -0,0 +1,116 @@
+import json
+import os
+import resource
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from config.logger_config import LOGGER_LEVEL
+from project.server.main.logger import get_logger
+
+logger = get_logger(__name__, level=LOGGER_LEVEL)
+
+# reading the dump files, computing the natural keys, looking for the french signals,
+# building the ES index records, writing them, extracting the affiliations (fused pipeline),
+# and the steps of the task around the enrichment
+STAGES = ['load_references', 'pdb', 'read', 'natural_key', 'detect', 'index_record', 'write', 'affiliations', 'merge',
+          'import']
+FILE_COUNTERS = ['read', 'french', 'indexed']
+
+
+class EnrichmentReport:
+    """
+    Timers and counters of an enrichment task: seconds spent per stage, dois read / french / indexed
+    per dump file, french dois per fr_reasons tag and per publisher.
+    The reports of the workers of the sharded mode are merged in the report of the task.
+    """
+
+    def __init__(self):
+        self.start_time = time()
+        self.seconds = defaultdict(float)
+        self.files = {}
+        self.fr_reasons = Counter()
+        self.publishers = Counter()
+        self.nb_files_reused = 0
+        # other figures of the task, reported as they are
+        self.extra = {}
+
+    def add_time(self, stage: str, seconds: float):
+        self.seconds[stage] += seconds
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, perf_counter() - start)
+
+    def timed(self, stage: str, iterable: Iterable) -> Iterator:
+        """Iterate over iterable, the time spent waiting for each item being added to the stage"""
+        iterator = iter(iterable)
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, perf_counter() - start)
+                return
+            self.add_time(stage, perf_counter() - start)
+            yield item
+
+    def count_file(self, dump_file: str, counter: str, increment: int = 1):
+        file_counters = self.files.setdefault(dump_file, dict.fromkeys(FILE_COUNTERS, 0))
+        file_counters[counter] += increment
+
+    def count_french_doi(self, dump_file: str, fr_reasons: List[str], publisher: str, is_indexed: bool):
+        self.count_file(dump_file, 'french')
+        if is_indexed:
+            self.count_file(dump_file, 'indexed')
+        self.fr_reasons.update(fr_reasons)
+        self.publishers[publisher] += 1
+
+    def merge(self, other: Dict):
+        """Add the timers and counters of a report exported with to_dict (by a worker)"""
+        for stage, seconds in other['seconds'].items():
+            self.add_time(stage, seconds)
+        for dump_file, file_counters in other['files'].items():
+            for counter, increment in file_counters.items():
+                self.count_file(dump_file, counter, increment)
+        self.fr_reasons.update(other['fr_reasons'])
+        self.publishers.update(other['publishers'])
+        self.nb_files_reused += other['nb_files_reused']
+
+    def to_dict(self) -> Dict:
+        elapsed_seconds = time() - self.start_time
+        nb_read = sum(file_counters['read'] for file_counters in self.files.values())
+        return {
+            'elapsed_seconds': round(elapsed_seconds, 3),
+            'seconds': {stage: round(self.seconds[stage], 3) for stage in STAGES if stage in self.seconds},
+            'nb_files': len(self.files),
+            'nb_files_reused': self.nb_files_reused,
+            'nb_read': nb_read,
+            'nb_french': sum(file_counters['french'] for file_counters in self.files.values()),
+            'nb_indexed': sum(file_counters['indexed'] for file_counters in self.files.values()),
+            'records_per_second': round(nb_read / elapsed_seconds, 1) if elapsed_seconds else 0,
+            # ru_maxrss is in kilobytes on linux, the children are the workers of the sharded mode
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'peak_rss_children_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+            'fr_reasons': dict(self.fr_reasons.most_common()),
+            'publishers': dict(self.publishers.most_common()),
+            'files': self.files,
+            **self.extra,
+        }
+
+    def save(self, report_file: Optional[str] = None) -> Dict:
+        """Log the main figures of the report and write it in report_file if given. Return the report."""
+        report = self.to_dict()
+        logger.debug(f"{report['nb_read']} dois read, {report['nb_french']} french, {report['nb_indexed']} indexed "
+                     f"in {report['elapsed_seconds']}s ({report['records_per_second']} dois/s) - seconds per stage {report['seconds']}")
+        if report_file is not None:
+            tmp_report_file = f'{report_file}.tmp'
+            with open(tmp_report_file, 'w') as f:
+                json.dump(report, f, indent=2)
+            os.replace(tmp_report_file, report_file)
+        return report
@@ -0,0 +1,57 @@
+import re
+from typing import Dict, List
+
+import ahocorasick
+
+from config.business_rules import FRENCH_AFFILIATION_KEYWORDS, FRENCH_NAME_KEYWORDS, FRENCH_PUBLISHERS
+
+
+class FrenchSignalDetector:
+    """
+    Detect the french signals (fr_reasons tags) in publishers, normalized names and normalized affiliations.
+    The patterns are compiled once: publishers in one regex, name and affiliation keywords in
+    Aho-Corasick automatons returning every matched keyword in one pass over the string.
+
+    Args:
+        french_publishers (List[str]): words matched (as whole words, case insensitive) against the publisher
+        name_keywords (List[str]): substrings looked for in the normalized names, tagged name_<keyword>
+        affiliation_keywords (List[str]): substrings looked for in the normalized affiliations, tagged affiliation_<keyword>
+    """
+
+    def __init__(self, french_publishers: List[str] = FRENCH_PUBLISHERS,
+                 name_keywords: List[str] = FRENCH_NAME_KEYWORDS,
+                 affiliation_keywords: List[str] = FRENCH_AFFILIATION_KEYWORDS):
+        #match regex INRA par ex (pas INRAP)
+        self.publisher_pattern = re.compile('|'.join([fr"\b{w}\b" for w in french_publishers]), re.IGNORECASE)
+        self.name_automaton = self._build_automaton({k: f'name_{k}' for k in name_keywords})
+        self.affiliation_automaton = self._build_automaton({k: f'affiliation_{k}' for k in affiliation_keywords})
+
+    @staticmethod
+    def _build_automaton(tags_by_keyword: Dict[str, str]) -> ahocorasick.Automaton:
+        automaton = ahocorasick.Automaton()
+        for keyword, tag in tags_by_keyword.items():
+            automaton.add_word(keyword, tag)
+        automaton.make_automaton()
+        return automaton
+
+    @staticmethod
+    def _find_tags(automaton: ahocorasick.Automaton, _str: str) -> List[str]:
+        """Return the tags of the keywords found in the string, without duplicates, in order of appearance"""
+        if not _str or len(automaton) == 0:
+            return []
+        return list(dict.fromkeys(tag for _, tag in automaton.iter(_str)))
+
+    def is_french_publisher(self, publisher: str) -> bool:
+        return isinstance(publisher, str) and self.publisher_pattern.search(publisher) is not None
+
+    def get_name_reasons(self, normalized_name: str) -> List[str]:
+        return self._find_tags(self.name_automaton, normalized_name)
+
+    def get_affiliation_reasons(self, normalized_affiliation: str) -> List[str]:
+        return self._find_tags(self.affiliation_automaton, normalized_affiliation)
+
+    def get_name_reasons_many(self, normalized_names: List[str]) -> List[List[str]]:
+        return [self._find_tags(self.name_automaton, name) for name in normalized_names]
+
+    def get_affiliation_reasons_many(self, normalized_affiliations: List[str]) -> List[List[str]]:
+        return [self._find_tags(self.affiliation_automaton, affiliation) for affiliation in normalized_affiliations]
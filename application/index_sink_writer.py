@@ -0,0 +1,97 @@
+import gzip
+import json
+import os
+from typing import Dict, Optional
+
+from config.global_config import COMPRESSION_SUFFIX
+from config.logger_config import LOGGER_LEVEL
+from project.server.main.logger import get_logger
+
+logger = get_logger(__name__, level=LOGGER_LEVEL)
+
+DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+LINE_SEPARATOR = os.linesep.encode()
+
+
+class IndexSinkWriter:
+    """
+    Long-lived writer of the ES index source file: one buffered handle is kept open for the whole task,
+    flushed by blocks of buffer_size bytes, and flushed / fsynced once on close.
+    Lines are written exactly as append_to_file does (the string followed by os.linesep).
+
+    Args:
+        file (str): path of the output file, appended to if it already exists
+        compress (bool): write gzip directly (a new gzip member is appended to an existing file)
+        buffer_size (int): size in bytes of the write buffer
+        truncate_at (int): offset returned by checkpoint() in a previous run, the file is truncated
+            to it before writing, to resume from this checkpoint
+    """
+
+    def __init__(self, file: str, compress: bool = False, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 truncate_at: Optional[int] = None):
+        self.file = file
+        self.compress = compress
+        self.nb_lines = 0
+        self._raw = open(file, 'ab', buffering=buffer_size)
+        if truncate_at is not None:
+            logger.debug(f'truncating {file} at {truncate_at} to resume from the checkpoint')
+            self._raw.truncate(truncate_at)
+            # truncate does not move the position: tell() (the checkpoint offset) would be past the end until a write
+            self._raw.seek(0, os.SEEK_END)
+        self._handle = self._open_handle()
+
+    def _open_handle(self):
+        return gzip.GzipFile(fileobj=self._raw, mode='ab', compresslevel=6) if self.compress else self._raw
+
+    @classmethod
+    def for_index(cls, folder: str, index_name: str, compress: bool = False, **kwargs) -> 'IndexSinkWriter':
+        """Writer of {folder}/{index_name}.jsonl, or {folder}/{index_name}.jsonl.gz if compress"""
+        file = f'{folder}/{index_name}.jsonl{COMPRESSION_SUFFIX if compress else ""}'
+        return cls(file, compress=compress, **kwargs)
+
+    @property
+    def closed(self) -> bool:
+        return self._raw.closed
+
+    def write(self, _str: str):
+        self._handle.write(_str.encode())
+        self._handle.write(LINE_SEPARATOR)
+        self.nb_lines += 1
+
+    def write_record(self, record: Dict):
+        self.write(json.dumps(record))
+
+    def flush(self):
+        self._handle.flush()
+        if self._handle is not self._raw:
+            self._raw.flush()
+
+    def checkpoint(self) -> int:
+        """Make everything written so far durable, and return the offset to give as truncate_at to resume from here.
+        When compressed, the current gzip member is ended and a new one started, so that the file is valid at this offset."""
+        if self._handle is not self._raw:
+            self._handle.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        offset = self._raw.tell()
+        if self._handle is not self._raw:
+            # the header of the new member is after the offset
+            self._handle = self._open_handle()
+        return offset
+
+    def close(self):
+        if self.closed:
+            return
+        if self._handle is not self._raw:
+            # writes the gzip trailer in the raw file
+            self._handle.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        logger.debug(f'{self.nb_lines} lines written in {self.file}')
+
+    def __enter__(self) -> 'IndexSinkWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
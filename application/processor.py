@@ -1,9 +1,14 @@
+from collections import deque
+from contextlib import nullcontext
 from glob import glob
 import os
+import shutil
 from datetime import datetime
+from multiprocessing import Pool
 from os import path
+from time import monotonic
 from pathlib import Path
-from typing import Union, Dict, List, Generator, Any, Tuple
+from typing import Union, ContextManager, Dict, List, Generator, Any, Iterator, Optional, Tuple
 import pandas as pd
 
 from adapters.databases.process_state_repository import ProcessStateRepository
@@ -12,24 +17,49 @@ from adapters.storages.swift_session import SwiftSession
 from domain.api.abstract_processor import AbstractProcessor
 from domain.model.ovh_path import OvhPath
 from application.utils_processor import (
-    _create_file, _load_csv_file_and_drop_duplicates,
-    _append_file, _format_string, _concat_affiliation, _list_files_in_directory, _merge_files,
-    _get_path, gzip_cli, json_line_generator,
+    _create_file, _csv_row_generator, _drop_known_rows, _get_row_key, log_dedup_ratio, _merge_files_drop_duplicates,
+    _append_file, _format_string, _append_affiliation_columns, _get_doi_values, _list_files_in_directory, _merge_files,
+    _new_affiliation_columns,
+    _get_path, gzip_blocks, json_line_generator, _merge_parquet_datasets, _merge_parquet_files, _write_parquet_dataset,
+    _list_parquet_part_files, _write_hash_buckets, _write_parquet_part_file, _write_partition_index,
+    CONSOLIDATED_AFFILIATION_COLUMNS,
+    DATAFRAME_ROW_SIZE, PARQUET_SUFFIX, ROW_DIGEST_SIZE,
 )
-from config.global_config import config_harvester
+from application.dedup_store import DedupStore
+from config.global_config import COMPRESSION_SUFFIX, config_harvester
 from project.server.main.logger import get_logger
 from config.logger_config import LOGGER_LEVEL
 
-from project.server.main.utils_swift import upload_object
-
 logger = get_logger(__name__, level=LOGGER_LEVEL)
 
+DEFAULT_MERGE_MEMORY_BUDGET_MB = 1024
+# swiftclient holds a segment in memory while uploading it: an upload uses about this memory
+DEFAULT_UPLOAD_SEGMENT_SIZE_MB = 100
+MAX_MERGE_BUFFER_SIZE = 64 * 1024 * 1024
+# rough memory size of a hash in the in-memory set of a DedupStore
+HASH_MEMORY_SIZE = 100
+STATE_FLUSH_EVERY_N_FILES = 100
+STATE_FLUSH_EVERY_SECONDS = 60
+
 
 class Processor(AbstractProcessor):
     """
     Read downloaded datacite files, extract affiliations infos
 
     Args:
+        nb_workers (int): if set, the files of the partition are parsed in a pool of nb_workers processes,
+            their affiliations being written (and their states pushed) in the order of the files by this process.
+            Up to 2 * nb_workers parsed files are held in memory
+        output_format (str): 'csv', or 'parquet' to write the detailed affiliations in a parquet dataset
+            partitioned by origin_file and the consolidated affiliations in a parquet folder, a part file per batch
+        dump_folder (str): root folder of the dump files, config['raw_dump_folder_name'] if not set. The files are
+            identified by their path relative to it (relative_path), in the process states and in the origin_file
+            column of the affiliations: dump files in different sub folders may have the same name
+        state_flush_every_n_files (int), state_flush_every_seconds (float): the states of the processed files
+            are pushed to the repository by batches, once there are state_flush_every_n_files of them or
+            state_flush_every_seconds after the previous push. The files of a batch not pushed on a crash
+            are processed again by the next run. In parquet mode, the consolidated affiliations of the batch
+            are written in a part file of the partition parquet folder before its states are pushed.
 
     Attributes:
 
@@ -48,8 +78,16 @@ class Processor(AbstractProcessor):
     process_state_repository: ProcessStateRepository
 
     def __init__(self, config, index_of_partition: int, files_in_partition: List[Union[str, Path]],
-                 repository: ProcessStateRepository):
+                 repository: ProcessStateRepository, nb_workers: Optional[int] = None, output_format: str = 'csv',
+                 dump_folder: Optional[Union[str, Path]] = None,
+                 state_flush_every_n_files: int = STATE_FLUSH_EVERY_N_FILES,
+                 state_flush_every_seconds: float = STATE_FLUSH_EVERY_SECONDS):
         self.config = config
+        self.dump_folder = Path(dump_folder or config['raw_dump_folder_name'])
+        self.state_flush_every_n_files = state_flush_every_n_files
+        self.state_flush_every_seconds = state_flush_every_seconds
+        self.nb_workers = nb_workers
+        self.output_format = output_format
         self.target_folder_name = config['processed_dump_folder_name']
         self.target_directory = _get_path(config['processed_dump_folder_name'])
 
@@ -63,24 +101,18 @@ class Processor(AbstractProcessor):
         self.files_to_process = self.retrieve_files_to_process(files_in_partition)
 
     @staticmethod
-    def get_affiliations(path_file: Path, partition_index: int):
-        """Parse a ndjson file and compile a list of affiliation objects"""
-        affiliations = []
+    def get_affiliations(path_file: Path, partition_index: int, origin_file_name: Optional[str] = None):
+        """Parse a ndjson file and compile the affiliations of its dois, in column buffers (a list per column).
+        origin_file_name is the origin_file column of the affiliations, the name of the file if not set"""
+        affiliations = _new_affiliation_columns()
+        origin_file_name = origin_file_name or os.path.basename(path_file)
         non_null_dois = 0
         null_dois = 0
         processed_dois_per_file = 0
 
         for json_obj in json_line_generator(path_file):
             for doi in json_obj.get('data'):
-                doi["mapped_id"] = _format_string(doi["id"])
-                current_size = len(affiliations)
-                try:
-                    affiliations += _concat_affiliation(doi, "creators", path_file)
-                    affiliations += _concat_affiliation(doi, "contributors", path_file)
-                except BaseException as e:
-                    logger.exception(f'Error while creating concat for {doi["id"]}. \n Detailed error {e}')
-
-                if len(affiliations) > current_size:
+                if Processor.append_doi_affiliations(affiliations, doi, origin_file_name):
                     non_null_dois += 1
                 else:
                     null_dois += 1
@@ -92,68 +124,183 @@ class Processor(AbstractProcessor):
 
         return processed_dois_per_file, non_null_dois, null_dois, affiliations
 
+    @staticmethod
+    def append_doi_affiliations(affiliations: Dict[str, List[str]], doi: Dict, origin_file_name: str) -> bool:
+        """Append the affiliations of the creators and contributors of a doi to the column buffers.
+        Return True if the doi has affiliation rows (non null doi)"""
+        doi["mapped_id"] = _format_string(doi["id"])
+        nb_rows = 0
+        try:
+            doi_values = _get_doi_values(doi)
+            nb_rows += _append_affiliation_columns(affiliations, doi, doi_values, "creators", origin_file_name)
+            nb_rows += _append_affiliation_columns(affiliations, doi, doi_values, "contributors", origin_file_name)
+        except BaseException as e:
+            logger.exception(f'Error while creating concat for {doi["id"]}. \n Detailed error {e}')
+        return nb_rows > 0
+
+    def _get_files_affiliations(self) -> Iterator[Tuple[Path, Tuple[int, int, int, pd.DataFrame]]]:
+        """Yield the files to process and their affiliations, in the order of the files"""
+        args = [(path_file, self.partition_index, self.get_relative_path(path_file))
+                for path_file in self.files_to_process]
+        if not self.nb_workers:
+            yield from zip(self.files_to_process, map(_get_affiliations_df, args))
+            return
+        logger.info(f'partition_index : {self.partition_index} parsing {len(args)} files with {self.nb_workers} workers')
+        with Pool(processes=self.nb_workers) as pool:
+            # up to 2 * nb_workers files are parsed ahead, so that their affiliations do not pile up in memory
+            # while the files are written one at a time
+            parsed_files = deque()
+            for path_file, file_args in zip(self.files_to_process, args):
+                parsed_files.append((path_file, pool.apply_async(_get_affiliations_df, (file_args,))))
+                if len(parsed_files) >= 2 * self.nb_workers:
+                    path_file, result = parsed_files.popleft()
+                    yield path_file, result.get()
+            while parsed_files:
+                path_file, result = parsed_files.popleft()
+                yield path_file, result.get()
+
     def process_partition(self) -> Tuple[int, List[Dict]]:
         """
             Process a partition of files, retrieve the affiliations per creator or contributors
             store the result in a detailed affiliation file and consolidated affiliation files
-            (keeping only unique affiliations)
+            (keeping only unique affiliations: each one is written once, when it is first seen)
         :return: the number of total processed dois and the list of files and their associated status
         """
-
+        self.start_partition()
+        try:
+            for index, (path_file, (processed_dois_per_file, non_null_dois, null_dois, affiliations_df))\
+                    in enumerate(self._get_files_affiliations()):
+                logger.info(f"Processing {index} / {len(self.files_to_process)}")
+                self.write_file_affiliations(path_file, processed_dois_per_file, non_null_dois, null_dois,
+                                             affiliations_df)
+        finally:
+            # the states of the files written are pushed anyway if the processing fails
+            self._flush_pending_states()
+        return self.end_partition()
+
+    def start_partition(self):
+        """Reset the counters of the partition before writing the affiliations of its files
+        (with write_file_affiliations, then end_partition)"""
         # TODO Modify state to False if needed
-        processed_files_and_status = []
+        self._processed_files_and_status = []
         # counter variables
-        global_processed_dois = 0
-        global_non_null_dois = 0
-        global_null_dois = 0
-
-        for index, path_file in enumerate(self.files_to_process):
-            logger.info(f"Processing {index} / {len(self.files_to_process)}")
-            (processed_dois_per_file, non_null_dois, null_dois, affiliations_list)\
-                = self.get_affiliations(path_file, self.partition_index)
-
-            global_processed_dois += processed_dois_per_file
-            global_non_null_dois += non_null_dois
-            global_null_dois += null_dois
-
-            affiliations_df = pd.DataFrame(affiliations_list)
-
-            if affiliations_df.shape[0] > 0:
-                global_affiliations = affiliations_df[["doi_publisher", "doi_client_id", "affiliation"]].drop_duplicates()
+        self._global_processed_dois = 0
+        self._global_non_null_dois = 0
+        self._global_null_dois = 0
+        self._consolidated_affiliations = []
+        self._known_consolidated_affiliations = self._get_known_consolidated_affiliations()
+        self._nb_consolidated_read, self._nb_consolidated_written = 0, 0
+        # states of the files written but not yet pushed
+        self._pending_states = []
+        self._last_flush_time = monotonic()
+
+    def write_file_affiliations(self, path_file: Path, processed_dois_per_file: int, non_null_dois: int,
+                                null_dois: int, affiliations_df: pd.DataFrame):
+        """Write the affiliations of a file of the partition in the detailed and consolidated affiliation files,
+        and push its state to the repository (by batches)"""
+        path_file = Path(path_file)
+        self._global_processed_dois += processed_dois_per_file
+        self._global_non_null_dois += non_null_dois
+        self._global_null_dois += null_dois
+
+        if affiliations_df.shape[0] > 0:
+            global_affiliations = _drop_known_rows(affiliations_df[CONSOLIDATED_AFFILIATION_COLUMNS],
+                                                   self._known_consolidated_affiliations)
+            self._nb_consolidated_read += affiliations_df.shape[0]
+            self._nb_consolidated_written += global_affiliations.shape[0]
+            if self.output_format == 'parquet':
+                self._consolidated_affiliations.append(global_affiliations)
+            else:
                 _append_file(global_affiliations, self.partition_consolidated_affiliation_file_path)
 
+        if self.output_format == 'parquet':
+            _write_parquet_dataset(affiliations_df, self.partition_detailed_affiliation_file_path)
+        else:
             _append_file(affiliations_df, self.partition_detailed_affiliation_file_path)
-            # Append list of path dictionary
-            processed_status = {
-                "file_name": path_file.name,
-                "file_path": path_file,
-                "number_of_dois": processed_dois_per_file,
-                "number_of_dois_with_null_attributes": null_dois,
-                "number_of_non_null_dois": non_null_dois,
-                "process_date": datetime.now(),
-                "processed": True,
-            }
-
-            self.push_state_to_database(processed_status)
-            # push to postgreSQL
-            processed_files_and_status.append(processed_status)
-
+        # Append list of path dictionary
+        processed_status = {
+            "file_name": path_file.name,
+            "file_path": path_file,
+            "relative_path": self.get_relative_path(path_file),
+            "number_of_dois": processed_dois_per_file,
+            "number_of_dois_with_null_attributes": null_dois,
+            "number_of_non_null_dois": non_null_dois,
+            "process_date": datetime.now(),
+            "processed": True,
+        }
+
+        # push to postgreSQL, by batches
+        self._pending_states.append(processed_status)
+        if len(self._pending_states) >= self.state_flush_every_n_files \
+                or monotonic() - self._last_flush_time >= self.state_flush_every_seconds:
+            self._flush_pending_states()
+        self._processed_files_and_status.append(processed_status)
+
+    def _flush_pending_states(self):
+        """Push the pending states, once the consolidated affiliations of their files are written
+        (in parquet mode, they are kept in memory until then): a state is never pushed for rows not on disk"""
+        if self.output_format == 'parquet' and self._consolidated_affiliations:
+            self._write_consolidated_parquet_file(self._consolidated_affiliations)
+            self._consolidated_affiliations = []
+        self.push_states_to_database(self._pending_states)
+        self._last_flush_time = monotonic()
+
+    def end_partition(self) -> Tuple[int, List[Dict]]:
+        """Write the remaining consolidated parquet rows, push the remaining states and log the counters of the
+        partition. Return the number of total processed dois and the list of files and their associated status"""
+        self._flush_pending_states()
         logger.info(
-            f' Partition index : {self.partition_index} Total number of processed dois {global_processed_dois}, total non null dois '
-            f'{global_non_null_dois} total null dois {global_null_dois}')
-
-        # Filter out global affiliation files
-        _load_csv_file_and_drop_duplicates(self.partition_consolidated_affiliation_file_path,
-                                           ["doi_publisher", "doi_client_id", "affiliation"])
-
-        return global_processed_dois, processed_files_and_status
+            f' Partition index : {self.partition_index} Total number of processed dois {self._global_processed_dois}, total non null dois '
+            f'{self._global_non_null_dois} total null dois {self._global_null_dois}')
+
+        log_dedup_ratio(f'partition_index : {self.partition_index} consolidated affiliations',
+                        self._nb_consolidated_read, self._nb_consolidated_written)
+
+        return self._global_processed_dois, self._processed_files_and_status
+
+    def _get_known_consolidated_affiliations(self) -> DedupStore:
+        """Hashes of the consolidated affiliations already written in the partition file (by a previous run)"""
+        known_consolidated_affiliations = DedupStore(digest_size=ROW_DIGEST_SIZE)
+        if self.output_format == 'parquet':
+            if self.partition_consolidated_affiliation_file_path.exists():
+                for part_file in _list_parquet_part_files([self.partition_consolidated_affiliation_file_path]):
+                    _drop_known_rows(pd.read_parquet(part_file), known_consolidated_affiliations)
+        else:
+            known_consolidated_affiliations.update(_get_row_key(row) for row in
+                                                   _csv_row_generator(self.partition_consolidated_affiliation_file_path)
+                                                   if row)
+        return known_consolidated_affiliations
+
+    def _write_consolidated_parquet_file(self, consolidated_affiliations: List[pd.DataFrame]):
+        """Write the unique affiliations of the batch in a new part file of the partition parquet folder,
+        the part files being merged by PartitionsController.concat_files"""
+        consolidated_affiliation = pd.concat(consolidated_affiliations).astype(object)
+        if consolidated_affiliation.shape[0] > 0:
+            _write_parquet_part_file(consolidated_affiliation, self.partition_consolidated_affiliation_file_path)
+
+    def get_relative_path(self, path_file: Union[str, Path]) -> str:
+        """Path of a dump file relative to the dump folder, its name if it is not in the dump folder"""
+        try:
+            return Path(path_file).relative_to(self.dump_folder).as_posix()
+        except ValueError:
+            return Path(path_file).name
 
     def retrieve_files_to_process(self, files_in_partition):
-        files_already_processed = [filepath['file_path'] for filepath in self.process_state_repository.get()]
-        return list(set(files_in_partition) - set(files_already_processed))
+        """Files of the partition not processed yet, in the order of the partition"""
+        files_in_partition = list(dict.fromkeys(files_in_partition))
+        files_already_processed = self.process_state_repository.get_processed_file_paths(
+            [str(file) for file in files_in_partition])
+        return [file for file in files_in_partition if str(file) not in files_already_processed]
 
     def _create_partition_affiliation_files(self, index_of_partition):
         """Create partition detailed and partition consolidated affiliation files"""
+        if self.output_format == 'parquet':
+            # the parquet files are written once there are affiliations
+            self.partition_consolidated_affiliation_file_path = \
+                _get_path(self.target_folder_name) / f"partition_consolidated_affiliations_{index_of_partition}{PARQUET_SUFFIX}"
+            self.partition_detailed_affiliation_file_path = \
+                _get_path(self.target_folder_name) / f"partition_detailed_affiliations_{index_of_partition}{PARQUET_SUFFIX}"
+            return
         partition_consolidated_affiliation_file_name = f"partition_consolidated_affiliations_{index_of_partition}.csv"
         partition_detailed_affiliation_file_name = f"partition_detailed_affiliations_{index_of_partition}.csv"
         logger.info(f'Creating files {partition_detailed_affiliation_file_name}'
@@ -165,83 +312,194 @@ class Processor(AbstractProcessor):
             _create_file(target_directory=self.target_folder_name,
                          file_name=partition_detailed_affiliation_file_name)
 
+    def push_states_to_database(self, states: List[Dict]):
+        """Push the states in one statement, and empty the list"""
+        if not states:
+            return
+        self.process_state_repository.create_many([self._get_process_state(state) for state in states])
+        logger.debug(f'partition_index : {self.partition_index} {len(states)} states pushed')
+        states.clear()
+
     def push_state_to_database(self, state: Dict):
+        return self.process_state_repository.create(self._get_process_state(state))
 
-        process_state = ProcessStateTable(
+    @staticmethod
+    def _get_process_state(state: Dict) -> ProcessStateTable:
+        return ProcessStateTable(
             file_name=state['file_name'],
             file_path=str(state['file_path']),
+            relative_path=state['relative_path'],
             number_of_dois=state['number_of_dois'],
             number_of_dois_with_null_attributes=state['number_of_dois_with_null_attributes'],
             number_of_non_null_dois=state['number_of_non_null_dois'],
             process_date=state['process_date'],
             processed=state['processed'],
         )
-        return self.process_state_repository.create(process_state)
+
+
+def _get_affiliations_df(args: Tuple[Path, int, str]) -> Tuple[int, int, int, pd.DataFrame]:
+    """Processor.get_affiliations of a file, the column buffers being returned as a DataFrame (run in the workers)"""
+    processed_dois_per_file, non_null_dois, null_dois, affiliations = Processor.get_affiliations(*args)
+    return processed_dois_per_file, non_null_dois, null_dois, pd.DataFrame(affiliations)
 
 
 class PartitionsController:
-    """Concatenates all the partitions files"""
+    """Concatenates all the partitions files
+
+    Args:
+        output_format (str): format of the partitions files, 'csv' or 'parquet' (see Processor)
+        memory_budget_mb (int): memory used by the merge, half for the copy buffer (up to MAX_MERGE_BUFFER_SIZE)
+            and half for the hashes of the consolidated affiliations, spilled to disk beyond it.
+            config['merge_memory_budget_mb'] if not set
+        dedup_consolidated (bool): keep each consolidated affiliation once in the global file, else only copy them
+        write_hash_buckets (bool): also write the csv global consolidated file grouped by hash bucket of the
+            affiliation strings, read by the matching jobs partitioned by hash, half the memory budget being used
+            to bucket the rows in memory
+
+    The affiliation matching jobs read the csv global consolidated file, so it is written (with its partition
+    index and hash buckets file) in parquet mode too, next to the parquet one.
+    """
 
     target_folder_name: str = ""
     list_of_files: List = []
 
     global_detailed_affiliation_file_path: Path
     global_consolidated_affiliation_file_path: Path
+    global_consolidated_affiliation_csv_file_path: Path
     partitions: List[Dict] = None
 
-    def __init__(self, config, file_prefix):
+    def __init__(self, config, file_prefix, output_format: str = 'csv', memory_budget_mb: Optional[int] = None,
+                 dedup_consolidated: bool = True, write_hash_buckets: bool = True):
         self.config = config
+        self.output_format = output_format
+        self.dedup_consolidated = dedup_consolidated
+        self.write_hash_buckets = write_hash_buckets
+        memory_budget = (memory_budget_mb or config.get('merge_memory_budget_mb', DEFAULT_MERGE_MEMORY_BUDGET_MB)) * 2**20
+        self.merge_buffer_size = min(memory_budget // 2, MAX_MERGE_BUFFER_SIZE)
+        self.max_hashes_in_memory = max(1, memory_budget // 2 // HASH_MEMORY_SIZE)
+        self.max_rows_in_memory = max(1, memory_budget // 2 // DATAFRAME_ROW_SIZE)
         self.target_folder_name = config['processed_dump_folder_name']
+        # the hashes of the consolidated affiliations are spilled here if they do not fit in memory
+        self.dedup_spill_folder = os.path.join(self.target_folder_name, 'dedup')
         self.consolidated_affiliation_files, self.detailed_affiliation_files = self._get_lists_of_files()
         self._create_affiliation_files(file_prefix)
 
     def _create_affiliation_files(self, file_prefix):
         """Create detailed and consolidated affiliation files prefixed (usually by a date)"""
+        if self.output_format == 'parquet':
+            # a parquet dataset (folder) of the detailed affiliations and a parquet file of the consolidated ones
+            self.global_detailed_affiliation_file_path = _get_path(self.target_folder_name) / \
+                f"{file_prefix}_{Path(self.config['detailed_affiliation_file_name']).stem}{PARQUET_SUFFIX}"
+            self.global_consolidated_affiliation_file_path = _get_path(self.target_folder_name) / \
+                f"{file_prefix}_{Path(self.config['global_affiliation_file_name']).stem}{PARQUET_SUFFIX}"
+            # read by the affiliation matching jobs
+            self.global_consolidated_affiliation_csv_file_path = \
+                _create_file(self.target_folder_name, f"{file_prefix}_{self.config['global_affiliation_file_name']}")
+            return
         self.global_detailed_affiliation_file_path =\
             _create_file(self.target_folder_name, f"{file_prefix}_{self.config['detailed_affiliation_file_name']}")
         self.global_consolidated_affiliation_file_path =\
             _create_file(self.target_folder_name, f"{file_prefix}_{self.config['global_affiliation_file_name']}")
+        self.global_consolidated_affiliation_csv_file_path = self.global_consolidated_affiliation_file_path
 
     def concat_files(self):
-        """Concatenate consolidated_affiliation files and detailed_affiliation files"""
+        """Concatenate consolidated_affiliation files (keeping each affiliation once) and detailed_affiliation files"""
+        if self.output_format == 'parquet':
+            logger.debug(f"merging consolidated_affiliation_files: {self.consolidated_affiliation_files}")
+            with self._get_known_rows() as known_rows:
+                nb_read, nb_written = _merge_parquet_files(
+                    self.consolidated_affiliation_files, self.global_consolidated_affiliation_file_path, known_rows,
+                    csv_file_path=self.global_consolidated_affiliation_csv_file_path)
+            log_dedup_ratio('consolidated affiliations', nb_read, nb_written)
+            self._write_global_consolidated_affiliation_indexes()
+            # the partitions of the detailed datasets are moved, not rewritten
+            logger.debug(f"merging detailed_affiliation_files: {self.detailed_affiliation_files}")
+            _merge_parquet_datasets(self.detailed_affiliation_files, self.global_detailed_affiliation_file_path)
+            return
         # Merge consolidated files
         logger.debug(f"merging consolidated_affiliation_files: {self.consolidated_affiliation_files}")
-        _merge_files(self.consolidated_affiliation_files, self.global_consolidated_affiliation_file_path)
+        if self.dedup_consolidated:
+            with self._get_known_rows() as known_rows:
+                nb_read, nb_written = _merge_files_drop_duplicates(self.consolidated_affiliation_files,
+                                                                   self.global_consolidated_affiliation_file_path,
+                                                                   known_rows)
+            log_dedup_ratio('consolidated affiliations', nb_read, nb_written)
+        else:
+            _merge_files(self.consolidated_affiliation_files, self.global_consolidated_affiliation_file_path,
+                         buffer_size=self.merge_buffer_size)
+        self._write_global_consolidated_affiliation_indexes()
         # Merge detailed files
         logger.debug(f"merging detailed_affiliation_files: {self.detailed_affiliation_files}")
-        _merge_files(self.detailed_affiliation_files, self.global_detailed_affiliation_file_path)
+        _merge_files(self.detailed_affiliation_files, self.global_detailed_affiliation_file_path,
+                     buffer_size=self.merge_buffer_size)
+
+    def _write_global_consolidated_affiliation_indexes(self):
+        """Write the partition index and the hash buckets file of the csv global consolidated file"""
+        # the affiliation matching jobs read their partition of the file from the offsets of the index
+        _write_partition_index(self.global_consolidated_affiliation_csv_file_path)
+        # the affiliation matching jobs partitioned by hash read the byte range of their buckets
+        if self.write_hash_buckets:
+            _write_hash_buckets(self.global_consolidated_affiliation_csv_file_path,
+                                key_column=CONSOLIDATED_AFFILIATION_COLUMNS.index("affiliation"),
+                                max_rows_in_memory=self.max_rows_in_memory)
+
+    def _get_known_rows(self) -> ContextManager[Optional[DedupStore]]:
+        """Store of the hashes of the consolidated affiliations already merged, None without deduplication"""
+        if not self.dedup_consolidated:
+            return nullcontext()
+        return DedupStore(digest_size=ROW_DIGEST_SIZE, spill_folder=self.dedup_spill_folder,
+                          max_keys_in_memory=self.max_hashes_in_memory)
 
     def _get_lists_of_files(self) -> Tuple[List[Union[str, Path]], List[Union[str, Path]]]:
         """Return consolidated files and detailed files"""
+        suffix = PARQUET_SUFFIX if self.output_format == 'parquet' else ".csv"
         consolidated_files = _list_files_in_directory(
             self.target_folder_name,
-            f"partition_consolidated_affiliations_*.csv"
+            f"partition_consolidated_affiliations_*{suffix}"
         )
         detailed_files = _list_files_in_directory(
             self.target_folder_name,
-            f"partition_detailed_affiliations_*.csv"
+            f"partition_detailed_affiliations_*{suffix}"
         )
         return consolidated_files, detailed_files
 
     def push_to_ovh(self):
         """Compress (gzip) the consolidated and detailed affiliation file and
-        upload them to OVH """
-        compressed_global_file = gzip_cli(str(self.global_consolidated_affiliation_file_path))
-        upload_object(
-            self.config["datacite_container"],
-            source=compressed_global_file,
-            target=OvhPath(self.config['processed_affiliation_files_prefix'],
-                           path.basename(compressed_global_file)).__str__(),
-        )
-        compressed_detailed_file = gzip_cli(str(self.global_detailed_affiliation_file_path))
-        upload_object(
-            self.config["datacite_container"],
-            source=compressed_detailed_file,
-            target=OvhPath(self.config['processed_affiliation_files_prefix'],
-                           path.basename(compressed_detailed_file)).__str__(),
-        )
+        upload them to OVH, the compressed blocks being uploaded by segments as they are compressed
+        (no compressed file is written on disk). A segment, config['upload_segment_size_mb'], is held in memory
+        while it is uploaded."""
+        if self.output_format == 'parquet':
+            self._push_parquet_files_to_ovh()
+            return
+        swift = SwiftSession(self.config['swift'])
+        segment_size = self.config.get('upload_segment_size_mb', DEFAULT_UPLOAD_SEGMENT_SIZE_MB) * 2**20
+        for file_path in [self.global_consolidated_affiliation_file_path, self.global_detailed_affiliation_file_path]:
+            compressed_blocks = gzip_blocks(file_path, nb_threads=self.config.get('compression_nb_threads'))
+            swift.upload_stream_to_swift(
+                self.config["datacite_container"],
+                compressed_blocks,
+                OvhPath(self.config['processed_affiliation_files_prefix'],
+                        f"{path.basename(file_path)}{COMPRESSION_SUFFIX}"),
+                segment_size=segment_size,
+            )
+
+    def _push_parquet_files_to_ovh(self):
+        """Upload the consolidated parquet file and the files of the detailed parquet dataset to OVH,
+        parquet files being already compressed"""
+        prefix = self.config['processed_affiliation_files_prefix']
+        detailed_folder = self.global_detailed_affiliation_file_path
+        file_path_dest_path_tuples = [(str(self.global_consolidated_affiliation_file_path),
+                                       OvhPath(prefix, self.global_consolidated_affiliation_file_path.name))]
+        file_path_dest_path_tuples += [(str(file), OvhPath(prefix, detailed_folder.name, *file.relative_to(detailed_folder).parts))
+                                       for file in sorted(detailed_folder.rglob(f"*{PARQUET_SUFFIX}"))]
+        swift = SwiftSession(self.config['swift'])
+        swift.upload_files_to_swift(self.config["datacite_container"], file_path_dest_path_tuples)
 
     def clear_local_directory(self):
-        """Remove partition files"""
+        """Remove partition files (and the dedup spill folder)"""
         for f in glob(self.config['processed_dump_folder_name'] + "/partition_*"):
-            os.remove(f)
+            if os.path.isdir(f):
+                shutil.rmtree(f)
+            else:
+                os.remove(f)
+        shutil.rmtree(self.dedup_spill_folder, ignore_errors=True)
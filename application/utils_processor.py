@@ -1,14 +1,25 @@
+import csv
+import gzip
+import io
 import json
 import numpy as np
+import orjson
 import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shutil
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from json import JSONDecodeError
 from pathlib import Path
-from typing import Dict, List, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
+from application.dedup_store import DedupStore
 from config.global_config import COMPRESSION_SUFFIX, MOUNTED_VOLUME_PATH
 from config.logger_config import LOGGER_LEVEL
-from config.exceptions import FileLoadingException
 from project.server.main.logger import get_logger
 from project.server.main.strings import normalize
 from project.server.main.utils import get_mbytes
@@ -18,35 +29,293 @@ logger = get_logger(__name__, level=LOGGER_LEVEL)
 
 re3_existing_signatures = {}
 
-def gzip_cli(file, keep=True, decompress=False):
-    if decompress:
-        os.system(f"gzip -d --force {'--keep' if keep else ''} {file}")
-        return os.path.splitext(file)[0]
-    else:
-        os.system(f"gzip --force {'--keep' if keep else ''} {file}")
-        return f"{file}{COMPRESSION_SUFFIX}"
-
-
-def _merge_files(list_of_files: List[Union[str, Path]], target_file_path: Path, header=None):
-    """Write the concatenation of multiple csv files in a csv file"""
-    tmp = []
-    for file in list_of_files:
-        if file.stat().st_size > 0:
-            tmp.append(pd.read_csv(file, header=header, dtype='str'))
-    df = pd.concat(tmp)
-    df.to_csv(target_file_path, index=False)
+PARQUET_SUFFIX = '.parquet'
+GZIP_BLOCK_SIZE = 16 * 1024 * 1024
+DEFAULT_MERGE_BUFFER_SIZE = 16 * 1024 * 1024
+# rough memory size of a csv row in a DataFrame, to read chunks of about buffer_size bytes
+DATAFRAME_ROW_SIZE = 1024
+# low cardinality columns, dictionary encoded in the parquet files
+PARQUET_DICTIONARY_COLUMNS = ["type", "doi_publisher", "doi_client_id"]
+# columns of the detailed affiliation files
+AFFILIATION_COLUMNS = ["doi_id", "doi_file_name", "type", "name", "doi_publisher", "doi_client_id", "affiliation",
+                       "origin_file"]
+CONSOLIDATED_AFFILIATION_COLUMNS = ["doi_publisher", "doi_client_id", "affiliation"]
+# 64 bits hashes of the consolidated affiliations: no collision expected below 10^8 affiliations
+ROW_DIGEST_SIZE = 8
+ROW_KEY_SEPARATOR = "\x1f"
+PARTITION_INDEX_SUFFIX = '.partitions.json'
+# number of record offsets of a partition index, so that any number of partitions up to it can be balanced
+PARTITION_INDEX_SIZE = 10000
+HASH_BUCKETS_SUFFIX = '.by_hash.csv'
+# number of hash buckets of a hash buckets file, so that any number of partitions up to it can be balanced
+NB_HASH_BUCKETS = 4096
+
+def gzip_blocks(file: Union[str, Path], nb_threads: Optional[int] = None, block_size: int = GZIP_BLOCK_SIZE,
+                compresslevel: int = 6) -> Iterator[bytes]:
+    """Gzip-compress a file by blocks of block_size bytes in nb_threads threads (zlib releases the GIL),
+    the number of cpus by default. Each block is a gzip member, so their concatenation is a standard gzip file.
+    The compressed blocks are yielded in order, up to 2 * nb_threads blocks being compressed ahead."""
+    nb_threads = nb_threads or os.cpu_count() or 1
+    with open(file, "rb") as f, ThreadPoolExecutor(max_workers=nb_threads) as executor:
+        compressed_blocks = deque()
+        for block in iter(lambda: f.read(block_size), b""):
+            compressed_blocks.append(executor.submit(gzip.compress, block, compresslevel, mtime=0))
+            if len(compressed_blocks) >= 2 * nb_threads:
+                yield compressed_blocks.popleft().result()
+        while compressed_blocks:
+            yield compressed_blocks.popleft().result()
+
+
+def _get_column_indices_header(csv_file: Union[str, Path]) -> bytes:
+    """Header line of the indices of the columns of the first row of a csv file, as pandas writes it without header"""
+    first_row = next(_csv_row_generator(csv_file), [])
+    return ",".join(str(index) for index in range(len(first_row))).encode() + b"\n"
+
+
+def _append_csv_chunks(csv_file: Union[str, Path], f_out, target_header: bytes, buffer_size: int):
+    """Append the rows of a csv file with a header to f_out, chunk by chunk, in the columns order of target_header"""
+    target_columns = next(csv.reader([target_header.decode()]))
+    chunksize = max(1, buffer_size // DATAFRAME_ROW_SIZE)
+    for chunk in pd.read_csv(csv_file, header=0, dtype='str', chunksize=chunksize):
+        f_out.write(chunk.reindex(columns=target_columns).to_csv(index=False, header=False).encode())
+
+
+def _merge_files(list_of_files: List[Union[str, Path]], target_file_path: Path, header=None,
+                 buffer_size: int = DEFAULT_MERGE_BUFFER_SIZE):
+    """Write the concatenation of multiple csv files in a csv file, copying them by blocks of buffer_size bytes.
+    The header of the target file is the header of the first file if header=0, else the indices of its columns
+    (as pandas writes them). With header=0, a file whose header differs is rewritten chunk by chunk instead,
+    its columns being ordered as in the target file."""
+    target_header = None
+    with open(target_file_path, "wb") as f_out:
+        for file in list_of_files:
+            if Path(file).stat().st_size == 0:
+                continue
+            with open(file, "rb") as f_in:
+                file_header = f_in.readline().rstrip(b"\r\n") + b"\n" if header == 0 else None
+                if target_header is None:
+                    target_header = file_header if header == 0 else _get_column_indices_header(file)
+                    f_out.write(target_header)
+                if header == 0 and file_header != target_header:
+                    logger.debug(f"{file} header differs from {target_file_path} header, rewriting it")
+                    _append_csv_chunks(file, f_out, target_header, buffer_size)
+                    continue
+                copy_start = f_in.tell()
+                shutil.copyfileobj(f_in, f_out, buffer_size)
+                if f_in.tell() > copy_start:
+                    f_in.seek(-1, os.SEEK_END)
+                    if f_in.read(1) != b"\n":
+                        f_out.write(b"\n")
+
+
+def _get_row_key(row) -> str:
+    """Key of a row for the deduplication, null values being empty strings as when read from a csv file"""
+    return ROW_KEY_SEPARATOR.join("" if pd.isna(value) else str(value) for value in row)
+
+
+def _drop_known_rows(df: pd.DataFrame, known_rows: DedupStore) -> pd.DataFrame:
+    """Keep the rows of df not in known_rows (nor earlier in df), and add them to known_rows"""
+    if df.shape[0] == 0:
+        return df
+    return df[[known_rows.add(_get_row_key(row)) for row in df.itertuples(index=False, name=None)]]
+
+
+def _csv_row_generator(csv_file: Union[str, Path]):
+    """Yield the rows of a csv file as lists of strings, reading it line by line"""
+    with open(csv_file, "r", encoding="utf-8", newline="") as f:
+        yield from csv.reader(f)
+
+
+def _merge_files_drop_duplicates(list_of_files: List[Union[str, Path]], target_file_path: Path,
+                                 known_rows: DedupStore) -> Tuple[int, int]:
+    """Write the rows of multiple csv files (without header) in a csv file, each unique row once.
+    The files are streamed, only the hashes of the rows (in known_rows) are kept.
+    Return the number of rows read and written."""
+    nb_read, nb_written = 0, 0
+    with open(target_file_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        for file in list_of_files:
+            for row in _csv_row_generator(file):
+                if not row:
+                    continue
+                if nb_read == 0:
+                    # same header as _merge_files (the indices of the columns)
+                    writer.writerow(range(len(row)))
+                nb_read += 1
+                if known_rows.add(_get_row_key(row)):
+                    writer.writerow(row)
+                    nb_written += 1
+    return nb_read, nb_written
+
+
+def _get_partition_index_path(csv_file: Union[str, Path]) -> Path:
+    return Path(f"{csv_file}{PARTITION_INDEX_SUFFIX}")
+
+
+def _write_partition_index(csv_file: Union[str, Path]) -> List[int]:
+    """Write the partition index of a csv file: the byte offsets of the starts of records, about every
+    file size / PARTITION_INDEX_SIZE bytes, with 0 and the file size. A newline inside a quoted field is not
+    a record boundary: a record ends at a newline once the number of quotes read since its start is even."""
+    file_size = os.path.getsize(csv_file)
+    step = max(1, file_size // PARTITION_INDEX_SIZE)
+    offsets = [0]
+    offset, nb_quotes = 0, 0
+    with open(csv_file, "rb") as f:
+        for line in f:
+            offset += len(line)
+            nb_quotes += line.count(b'"')
+            if nb_quotes % 2 == 0:
+                nb_quotes = 0
+                if offset - offsets[-1] >= step and offset < file_size:
+                    offsets.append(offset)
+    offsets.append(file_size)
+    _save_partition_index(csv_file, offsets)
+    return offsets
+
+
+def _save_partition_index(csv_file: Union[str, Path], offsets: List[int]):
+    """Write the offsets of the partition index of a csv file, with its size to detect a later change"""
+    index_path = _get_partition_index_path(csv_file)
+    tmp_index_path = f"{index_path}.tmp"
+    with open(tmp_index_path, "w") as f:
+        json.dump({"file_size": os.path.getsize(csv_file), "offsets": offsets}, f)
+    os.replace(tmp_index_path, index_path)
+    logger.debug(f"partition index of {csv_file} written with {len(offsets)} offsets")
+
+
+def _read_partition_index(csv_file: Union[str, Path]) -> Optional[List[int]]:
+    """Offsets of the partition index of a csv file, None if there is no index or the file changed since"""
+    index_path = _get_partition_index_path(csv_file)
+    if not index_path.exists():
+        return None
+    with open(index_path, "r") as f:
+        partition_index = json.load(f)
+    if partition_index["file_size"] != os.path.getsize(csv_file):
+        logger.debug(f"partition index of {csv_file} outdated")
+        return None
+    return partition_index["offsets"]
+
+
+def _get_partition_byte_range(offsets: List[int], partition_index: int, total_partition_number: int) -> Tuple[int, int]:
+    """Start and end byte offsets of the records of a partition (empty for partition_index >= total_partition_number)"""
+    nb_slices = len(offsets) - 1
+    start = min(round(partition_index * nb_slices / total_partition_number), nb_slices)
+    end = min(round((partition_index + 1) * nb_slices / total_partition_number), nb_slices)
+    return offsets[start], offsets[end]
+
+
+def _get_hash_bucket(key: str) -> int:
+    """Hash bucket of a key, the same in every process (unlike hash(), salted per process)"""
+    return zlib.crc32(key.encode()) % NB_HASH_BUCKETS
+
+
+def _get_hash_buckets_path(csv_file: Union[str, Path]) -> Path:
+    return Path(f"{csv_file}{HASH_BUCKETS_SUFFIX}")
+
+
+def _write_csv_rows(rows: List[List[str]], f):
+    """Write csv rows in a file opened in binary mode"""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    f.write(buffer.getvalue().encode("utf-8"))
+
+
+def _write_hash_buckets(csv_file: Union[str, Path], key_column: int, max_rows_in_memory: int) -> List[int]:
+    """Write the rows of a csv file (without header) in its hash buckets file, grouped by hash bucket of their
+    key_column value, with the partition index of the starts of the NB_HASH_BUCKETS buckets: the rows of
+    a range of buckets are read at once. Rows are bucketed in memory by runs of max_rows_in_memory rows,
+    the previous runs being written in temporary files merged bucket by bucket at the end. Return the offsets."""
+    buckets_path = _get_hash_buckets_path(csv_file)
+    run_paths, runs_offsets = [], []
+    rows_per_bucket = [[] for _ in range(NB_HASH_BUCKETS)]
+    nb_rows_in_memory = 0
+    for row in _csv_row_generator(csv_file):
+        if not row:
+            continue
+        rows_per_bucket[_get_hash_bucket(row[key_column])].append(row)
+        nb_rows_in_memory += 1
+        if nb_rows_in_memory >= max_rows_in_memory:
+            run_paths.append(f"{buckets_path}.run{len(run_paths)}")
+            run_offsets = [0]
+            with open(run_paths[-1], "wb") as f:
+                for rows in rows_per_bucket:
+                    _write_csv_rows(rows, f)
+                    run_offsets.append(f.tell())
+            runs_offsets.append(run_offsets)
+            rows_per_bucket = [[] for _ in range(NB_HASH_BUCKETS)]
+            nb_rows_in_memory = 0
+    tmp_buckets_path = f"{buckets_path}.tmp"
+    offsets = [0]
+    with ExitStack() as stack:
+        runs = [stack.enter_context(open(run_path, "rb")) for run_path in run_paths]
+        f_out = stack.enter_context(open(tmp_buckets_path, "wb"))
+        for bucket, rows in enumerate(rows_per_bucket):
+            # the rows of a bucket stay in the order of the csv file
+            for run, run_offsets in zip(runs, runs_offsets):
+                run.seek(run_offsets[bucket])
+                f_out.write(run.read(run_offsets[bucket + 1] - run_offsets[bucket]))
+            _write_csv_rows(rows, f_out)
+            offsets.append(f_out.tell())
+    for run_path in run_paths:
+        os.remove(run_path)
+    os.replace(tmp_buckets_path, buckets_path)
+    _save_partition_index(buckets_path, offsets)
+    logger.debug(f"hash buckets of {csv_file} written in {buckets_path} from {len(run_paths) + 1} runs")
+    return offsets
+
+
+def _get_hash_partition_byte_range(offsets: List[int], partition_index: int,
+                                   total_partition_number: int) -> Tuple[int, int]:
+    """Start and end byte offsets in a hash buckets file of the buckets of a partition,
+    bucket b being in partition b * total_partition_number // NB_HASH_BUCKETS"""
+    nb_buckets = len(offsets) - 1
+    start = min(-(-partition_index * nb_buckets // total_partition_number), nb_buckets)
+    end = min(-(-(partition_index + 1) * nb_buckets // total_partition_number), nb_buckets)
+    return offsets[start], offsets[end]
+
+
+def log_dedup_ratio(name: str, nb_read: int, nb_written: int):
+    dedup_ratio = round(1 - nb_written / nb_read, 4) if nb_read else 0
+    logger.info(f"{name}: {nb_read} rows read, {nb_written} unique rows written (dedup ratio {dedup_ratio})")
+
+
+def _open_dump_file(dump_file: Union[str, Path]):
+    """Open a (gzipped or not) dump file in binary mode"""
+    if str(dump_file).endswith(COMPRESSION_SUFFIX):
+        return gzip.open(dump_file, "rb")
+    return open(dump_file, "rb")
+
+
+def _json_loads(jsonstring: Union[str, bytes]):
+    try:
+        return orjson.loads(jsonstring)
+    except orjson.JSONDecodeError:
+        # orjson is stricter than json, e.g. on integers above 64 bits
+        return json.loads(jsonstring)
 
 
-def json_line_generator(ndjson_file):
-    with ndjson_file.open("r", encoding="utf-8") as f:
+def json_line_generator(ndjson_file: Union[str, Path]):
+    """Yield the json object of each line of a (gzipped or not) ndjson file, reading it line by line"""
+    with _open_dump_file(ndjson_file) as f:
         for jsonstring in f:
-            if jsonstring.strip() != "":
+            if jsonstring.strip():
                 try:
-                    yield json.loads(jsonstring)
+                    yield _json_loads(jsonstring)
                 except (TypeError, JSONDecodeError) as e:
                     print(f"Error reading line in file. Detailed error {e}")
 
 
+def dump_record_generator(dump_file: Union[str, Path]):
+    """Yield the doi records of a datacite dump file.
+    Lines can either be a {"data": [...]} envelope of records (raw dump) or a record (flat jsonl)"""
+    for json_obj in json_line_generator(dump_file):
+        data = json_obj.get('data')
+        if isinstance(data, list):
+            yield from data
+        else:
+            yield json_obj
+
+
 def listify(obj):
     """Returns the obj if the obj is a list.
     If the obj is a string of a list, runs eval to output a list.
@@ -395,8 +664,23 @@ def make_author(c, role, affiliations):
             elt['orcid'] = idi['nameIdentifier'].split('/')[-1]
     return elt, affiliations
 
-def append_to_es_index_sourcefile(doi, index_name, bso3_local_dict = {}):
+def append_to_es_index_sourcefile(doi, index_name, bso3_local_dict = {}, sink_writer = None):
+    """Append the ES index source record of the doi to the index file,
+    through sink_writer (an IndexSinkWriter) if given, else by reopening the file"""
+    es_index_record = get_es_index_record(doi, bso3_local_dict)
+    if es_index_record:
+        if sink_writer is not None:
+            sink_writer.write_record(es_index_record)
+        else:
+            append_to_file(
+                file=f'{MOUNTED_VOLUME_PATH}/{index_name}.jsonl',
+                _str=json.dumps(es_index_record))
+        return True
 
+
+def get_es_index_record(doi, bso3_local_dict = {}):
+    """Build the ES index source record of a doi.
+    Return None if the doi should not be indexed (versions, files or dois without id)"""
     global re3_existing_signatures
     if len(re3_existing_signatures) == 0:
         try:
@@ -535,10 +819,7 @@ def append_to_es_index_sourcefile(doi, index_name, bso3_local_dict = {}):
     # Keep only non-null values
     stripped_enriched_doi = trim_null_values(enriched_doi)
     if 'version' not in genre_detail and 'file' not in genre_detail:
-        append_to_file(
-            file=f'{MOUNTED_VOLUME_PATH}/{index_name}.jsonl',
-            _str=json.dumps(stripped_enriched_doi))
-        return True
+        return stripped_enriched_doi
 
 
 def strip_creators_or_contributors(creators_or_contributors: List) -> List:
@@ -606,55 +887,52 @@ def _list_files_in_directory(folder: Union[str, Path], regex: str):
     return list(folder_path.glob(regex))
 
 
-def _concat_affiliation(doi: Dict, objects_to_use_for_concatenation: str, origin_file: str):
-    """Create a list of affiliation objects for a doi"""
-    list_creators_or_contributors_and_affiliations = []
+def _new_affiliation_columns() -> Dict[str, List[str]]:
+    """Empty column buffers of the detailed affiliations"""
+    return {column: [] for column in AFFILIATION_COLUMNS}
 
-    for object_to_use_for_concatenation in doi["attributes"][objects_to_use_for_concatenation]:
 
-        doi_id: Union[str, List[str]] = str(doi["id"]).lower()
-        doi_file_name: Union[str, List[str]] = str(doi["mapped_id"]).lower()
-        doi_publisher: Union[str, List[str]] = str(get_publisher(doi)).lower()
-        doi_client_id: Union[str, List[str]] = str(_safe_get("", doi, "relationships", "client", "data", "id"))
-        list_affiliation_of_object: List[Dict[str, Union[str, List[str]]]]
+def _get_doi_values(doi: Dict) -> Tuple[str, str, str, str]:
+    """doi_id, doi_file_name, doi_publisher and doi_client_id of a doi, the same for all its affiliations"""
+    return (
+        str(doi["id"]).lower(),
+        str(doi["mapped_id"]).lower(),
+        str(get_publisher(doi)).lower(),
+        str(_safe_get("", doi, "relationships", "client", "data", "id")),
+    )
+
 
+def _append_affiliation_columns(columns: Dict[str, List[str]], doi: Dict, doi_values: Tuple[str, str, str, str],
+                                objects_to_use_for_concatenation: str, origin_file_name: str) -> int:
+    """Append a row per affiliation of each creator (or contributor) of a doi to the column buffers,
+    an empty affiliation for a creator without affiliation. doi_values are the _get_doi_values of the doi.
+    Nothing is appended if an error is raised. Return the number of rows appended."""
+    names = []
+    affiliations = []
+    for object_to_use_for_concatenation in doi["attributes"][objects_to_use_for_concatenation]:
         if len(object_to_use_for_concatenation) > 0 and len(object_to_use_for_concatenation["affiliation"]) > 0:
-            list_of_affiliation = [
+            object_affiliations = [
                 _create_affiliation_string(affiliation, exclude_list=["affiliationIdentifierScheme"])
                 if len(affiliation) > 0
                 else ""
                 for affiliation in object_to_use_for_concatenation["affiliation"]
             ]
-
-            list_affiliation_of_object = [
-                {
-                    "doi_id": doi_id,
-                    "doi_file_name": doi_file_name,
-                    "type": objects_to_use_for_concatenation,
-                    "name": _retrieve_object_name(object_to_use_for_concatenation),
-                    "doi_publisher": doi_publisher,
-                    "doi_client_id": doi_client_id,
-                    "affiliation": affiliation,
-                    "origin_file": os.path.basename(origin_file)
-                }
-                for affiliation in list_of_affiliation
-            ]
-            list_creators_or_contributors_and_affiliations += list_affiliation_of_object
         else:
-            list_affiliation_of_object = [
-                {
-                    "doi_id": doi_id,
-                    "doi_file_name": doi_file_name,
-                    "type": objects_to_use_for_concatenation,
-                    "name": _retrieve_object_name(object_to_use_for_concatenation),
-                    "doi_publisher": doi_publisher,
-                    "doi_client_id": doi_client_id,
-                    "affiliation": "",
-                    "origin_file": os.path.basename(origin_file)
-                }
-            ]
-            list_creators_or_contributors_and_affiliations += list_affiliation_of_object
-    return list_creators_or_contributors_and_affiliations
+            object_affiliations = [""]
+        names += [_retrieve_object_name(object_to_use_for_concatenation)] * len(object_affiliations)
+        affiliations += object_affiliations
+
+    nb_rows = len(affiliations)
+    doi_id, doi_file_name, doi_publisher, doi_client_id = doi_values
+    columns["doi_id"] += [doi_id] * nb_rows
+    columns["doi_file_name"] += [doi_file_name] * nb_rows
+    columns["type"] += [objects_to_use_for_concatenation] * nb_rows
+    columns["name"] += names
+    columns["doi_publisher"] += [doi_publisher] * nb_rows
+    columns["doi_client_id"] += [doi_client_id] * nb_rows
+    columns["affiliation"] += affiliations
+    columns["origin_file"] += [origin_file_name] * nb_rows
+    return nb_rows
 
 
 def _retrieve_object_name(creator_or_contributor: Dict):
@@ -716,41 +994,133 @@ def _safe_get(default_value, _dict, *keys):
         return default_value
 
 
-def _append_file(affiliation: pd.DataFrame, target_file: Union[str, Path], append_header=False):
-    if affiliation.shape[0] > 0:
-        if target_file.stat().st_size > 0:
-            checkpoint_target_df = pd.read_csv(target_file, header=None, dtype='str')
-        else:
-            checkpoint_target_df = pd.DataFrame()
-        try:
-            affiliation.to_csv(target_file, mode="a", index=False, header=append_header, encoding="utf-8")
-            # is the file still readable or is there a malformed line?
-            pd.read_csv(target_file, header=None, dtype='str')
-        except:
-            logger.exception(f"Error when adding {affiliation} to {target_file}", exc_info=True)
-            checkpoint_target_df.to_csv(target_file, index=False, header=False, encoding="utf-8")
-
+def _get_number_of_columns(target_file: Union[str, Path]) -> int:
+    """Number of columns of the first row of a csv file, 0 if the file is empty"""
+    if Path(target_file).stat().st_size == 0:
+        return 0
+    return pd.read_csv(target_file, header=None, dtype='str', nrows=1).shape[1]
 
-def _load_csv_file_and_drop_duplicates(global_affiliations_file_path: Union[Path, str],
-                                       names=None,
-                                       separator: str = ",", header=None):
-    if names is None:
-        names = ["doi_publisher", "doi_client_id", "affiliation"]
 
+def _append_file(affiliation: pd.DataFrame, target_file: Union[str, Path], append_header=False):
+    """Append the rows of affiliation to the csv target_file, without reading the file.
+    The rows are serialized and checked in memory first: they must be readable back and not have more columns
+    than the first row of the file (the file would no more be readable). They are then written at once,
+    and the file is truncated back to its previous size if the write fails."""
+    if affiliation.shape[0] == 0:
+        return
     try:
-        global_affiliation = pd.read_csv(
-            global_affiliations_file_path,
-            sep=separator,
-            names=names,
-            header=header,
-            lineterminator="\n"
-        )
-    except FileLoadingException as e:
-        logger.exception(f"Failed to load file {global_affiliations_file_path} . Detailed messages {e}")
-
-    if global_affiliation.shape[0] > 0:
-        global_affiliation.drop_duplicates(inplace=True)
-        global_affiliation.to_csv(global_affiliations_file_path, index=False, header=False, encoding="utf-8")
+        csv_rows = affiliation.to_csv(index=False, header=append_header)
+        rows_read = pd.read_csv(io.StringIO(csv_rows), header=None, dtype='str')
+        number_of_columns = _get_number_of_columns(target_file)
+        if number_of_columns and rows_read.shape[1] > number_of_columns:
+            raise ValueError(f"{rows_read.shape[1]} columns to append to a file of {number_of_columns} columns")
+    except Exception:
+        logger.exception(f"Error when adding {affiliation} to {target_file}", exc_info=True)
+        return
+    previous_size = Path(target_file).stat().st_size
+    try:
+        with open(target_file, "a", encoding="utf-8", newline="") as f:
+            f.write(csv_rows)
+    except Exception:
+        logger.exception(f"Error when adding {affiliation} to {target_file}", exc_info=True)
+        with open(target_file, "r+b") as f:
+            f.truncate(previous_size)
+
+
+def _to_arrow_table(affiliation: pd.DataFrame) -> pa.Table:
+    """Arrow table of string columns (nulls kept), the low cardinality ones being dictionary encoded"""
+    columns = {}
+    for column in affiliation.columns:
+        array = pa.array(affiliation[column].where(affiliation[column].isna(), affiliation[column].astype(str)),
+                         type=pa.string(), from_pandas=True)
+        columns[column] = array.dictionary_encode() if column in PARQUET_DICTIONARY_COLUMNS else array
+    return pa.table(columns)
+
+
+def _write_parquet_dataset(affiliation: pd.DataFrame, dataset_folder: Union[str, Path], partition_column: str = "origin_file"):
+    """Write the rows of affiliation in the parquet dataset_folder, partitioned by partition_column.
+    The partitions written replace the existing ones, so processing a file again does not duplicate its rows."""
+    if affiliation.shape[0] == 0:
+        return
+    pq.write_to_dataset(_to_arrow_table(affiliation), root_path=str(dataset_folder), partition_cols=[partition_column],
+                        basename_template="part-{i}.parquet", existing_data_behavior="delete_matching")
+
+
+def _write_parquet_file(affiliation: pd.DataFrame, target_file: Union[str, Path]):
+    """Write the rows of affiliation in the parquet target_file, through a temporary file"""
+    tmp_file = f"{target_file}.tmp"
+    pq.write_table(_to_arrow_table(affiliation), tmp_file)
+    os.replace(tmp_file, target_file)
+
+
+def _write_parquet_part_file(affiliation: pd.DataFrame, target_folder: Union[str, Path]) -> Path:
+    """Write the rows of affiliation in a new part file of the parquet target_folder, after its existing parts"""
+    target_folder = Path(target_folder)
+    target_folder.mkdir(parents=True, exist_ok=True)
+    part_file = target_folder / f"part-{len(_list_parquet_part_files([target_folder])):06d}{PARQUET_SUFFIX}"
+    _write_parquet_file(affiliation, part_file)
+    return part_file
+
+
+def _list_parquet_part_files(list_of_files: List[Union[str, Path]]) -> List[Path]:
+    """Parquet files of a list of parquet files and folders, a folder standing for its part files in order"""
+    part_files = []
+    for file in map(Path, list_of_files):
+        part_files += sorted(file.glob(f"part-*{PARQUET_SUFFIX}")) if file.is_dir() else [file]
+    return part_files
+
+
+def _merge_parquet_files(list_of_files: List[Union[str, Path]], target_file_path: Path,
+                         known_rows: Optional[DedupStore] = None,
+                         csv_file_path: Optional[Union[str, Path]] = None) -> Tuple[int, int]:
+    """Write the concatenation of multiple parquet files in a parquet file, one file in memory at a time.
+    A folder of the list stands for its part files (see _write_parquet_part_file).
+    If known_rows is given, only the rows not already in it are written.
+    If csv_file_path is given, the rows written are also written in this csv file, with the same header as
+    _merge_files_drop_duplicates (the indices of the columns), for the readers of csv files.
+    Return the number of rows read and written."""
+    nb_read, nb_written = 0, 0
+    writer = None
+    with ExitStack() as stack:
+        csv_writer = None
+        if csv_file_path is not None:
+            csv_writer = csv.writer(stack.enter_context(open(csv_file_path, "w", encoding="utf-8", newline="")),
+                                    lineterminator="\n")
+        try:
+            for file in _list_parquet_part_files(list_of_files):
+                table = pq.read_table(file)
+                rows = list(zip(*(column.to_pylist() for column in table.columns))) \
+                    if known_rows is not None or csv_writer is not None else []
+                if csv_writer is not None and nb_read == 0 and table.num_rows:
+                    csv_writer.writerow(range(table.num_columns))
+                nb_read += table.num_rows
+                if known_rows is not None:
+                    is_new_row = [known_rows.add(_get_row_key(row)) for row in rows]
+                    table = table.filter(pa.array(is_new_row, type=pa.bool_()))
+                    rows = [row for row, is_new in zip(rows, is_new_row) if is_new]
+                nb_written += table.num_rows
+                if csv_writer is not None:
+                    csv_writer.writerows(rows)
+                if writer is None:
+                    writer = pq.ParquetWriter(f"{target_file_path}.tmp", table.schema)
+                writer.write_table(table.cast(writer.schema))
+        finally:
+            if writer is not None:
+                writer.close()
+    if writer is not None:
+        os.replace(f"{target_file_path}.tmp", target_file_path)
+    return nb_read, nb_written
+
+
+def _merge_parquet_datasets(list_of_folders: List[Union[str, Path]], target_folder_path: Path):
+    """Move the partitions of multiple parquet datasets in one dataset, a partition replacing an existing one"""
+    target_folder_path.mkdir(parents=True, exist_ok=True)
+    for folder in list_of_folders:
+        for partition in Path(folder).iterdir():
+            target_partition = target_folder_path / partition.name
+            if target_partition.exists():
+                shutil.rmtree(target_partition)
+            os.replace(partition, target_partition)
 
 
 def trim_null_values(data: dict) -> dict:
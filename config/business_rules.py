@@ -50,3 +50,7 @@ FRENCH_PUBLISHERS = [
             "Nouvelle-Calédonie"
         ]
 FRENCH_ALPHA2 = ["fr", "gp", "gf", "mq", "re", "yt", "pm", "mf", "bl", "wf", "tf", "nc", "pf"]
+# Keywords looked for in the normalized creator/contributor names (fr_reasons name_<keyword>)
+FRENCH_NAME_KEYWORDS = ['cnrs', 'saclay', 'sorbonne', 'inrae', 'inserm', 'cirad', 'ifremer', 'cnes', 'paris france', 'arkeopen', 'cocoon']
+# Keywords looked for in the normalized affiliations (fr_reasons affiliation_<keyword>)
+FRENCH_AFFILIATION_KEYWORDS = ['france', 'french', 'umr ', 'cnrs', 'ifremer', 'cnes', 'saclay', 'sorbonne', 'paris', ' lyon', 'marseille', 'lille', 'nantes', 'rennes', 'inrae', 'inserm', 'montpellier', 'toulouse', 'strasbourg', 'lorraine', 'toulon', 'pierre simon laplace', 'grenoble', 'roscoff', 'agrocampus', 'nanterre', 'orleans', 'paul sabatier', 'caen', 'normandie', 'jean perrin', 'bordeaux', 'ecole polytechnique', 'reims', 'ardenne', 'la reunion', 'poitiers', 'ecole normale superieure', 'saint etienne', 'onera', 'cirm', 'savoie', 'salpetriere', 'cochin', 'inria', 'inra', 'cea', 'mondor', 'roussy', 'necker', 'nancy', 'tours', 'avicenne', 'lariboisiere']
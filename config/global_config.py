@@ -1,5 +1,6 @@
 import json
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Project path
@@ -24,6 +25,25 @@ DETAILED_AFFILIATION_FILE_NAME = "detailed_affiliations.csv"
 # Datacite configuration
 DATACITE_FILE_EXTENSION = ".ndjson"
 DEFAULT_START_DATE = "2018-01-01"
+# number of processes parsing the files of a partition, sequential if 0
+PROCESS_NB_WORKERS = int(os.getenv("PROCESS_NB_WORKERS", 0))
+# format of the detailed and consolidated affiliation files, csv or parquet
+AFFILIATION_FILES_FORMAT = os.getenv("AFFILIATION_FILES_FORMAT", "csv")
+# memory used to merge the partitions files (copy buffer and deduplication hashes)
+MERGE_MEMORY_BUDGET_MB = int(os.getenv("MERGE_MEMORY_BUDGET_MB", 1024))
+# threads compressing the affiliation files before their upload, the number of cpus if 0
+COMPRESSION_NB_THREADS = int(os.getenv("COMPRESSION_NB_THREADS", 0))
+# size of the segments of the uploaded files. swiftclient holds a segment in memory while it is uploaded
+# from the compressed stream: an upload uses about this memory, on top of the blocks being compressed
+UPLOAD_SEGMENT_SIZE_MB = int(os.getenv("UPLOAD_SEGMENT_SIZE_MB", 100))
+
+# maximum number of concurrent requests to the affiliation matcher
+AFFILIATION_MATCHER_MAX_IN_FLIGHT = int(os.getenv("AFFILIATION_MATCHER_MAX_IN_FLIGHT", 16))
+# results of the affiliation matcher, shared by the workers of the node and the runs. Keep it on a node-local
+# filesystem: the sqlite WAL mode needs a shared memory not supported by network filesystems
+AFFILIATION_MATCH_CACHE_FILE = os.getenv("AFFILIATION_MATCH_CACHE_FILE",
+                                         os.path.join(tempfile.gettempdir(), "affiliation_match_cache.sqlite"))
+AFFILIATION_MATCH_CACHE_MAX_SIZE_MB = int(os.getenv("AFFILIATION_MATCH_CACHE_MAX_SIZE_MB", 2048))
 
 # Elastic Searh configurations
 ES_LOGIN_BSO3_BACK = os.getenv("ES_LOGIN_BSO3_BACK", "")
@@ -71,10 +91,18 @@ def get_harvester_config() -> dict:
     config_harvester['global_affiliation_file_name'] = GLOBAL_AFFILIATION_FILE_NAME
     config_harvester['detailed_affiliation_file_name'] = DETAILED_AFFILIATION_FILE_NAME
     config_harvester['affiliation_matcher_service'] = os.getenv("AFFILIATION_MATCHER_SERVICE")
+    config_harvester['affiliation_matcher_max_in_flight'] = AFFILIATION_MATCHER_MAX_IN_FLIGHT
+    config_harvester['affiliation_match_cache_file'] = AFFILIATION_MATCH_CACHE_FILE
+    config_harvester['affiliation_match_cache_max_size_mb'] = AFFILIATION_MATCH_CACHE_MAX_SIZE_MB
     config_harvester['dump_default_start_date'] = DEFAULT_START_DATE
     config_harvester['es_index_sourcefile'] = os.path.join(MOUNTED_VOLUME_PATH, "datacite_fr.jsonl")
     # Datacite configuration
     config_harvester['datacite_file_extension'] = DATACITE_FILE_EXTENSION
+    config_harvester['process_nb_workers'] = PROCESS_NB_WORKERS
+    config_harvester['affiliation_files_format'] = AFFILIATION_FILES_FORMAT
+    config_harvester['merge_memory_budget_mb'] = MERGE_MEMORY_BUDGET_MB
+    config_harvester['compression_nb_threads'] = COMPRESSION_NB_THREADS
+    config_harvester['upload_segment_size_mb'] = UPLOAD_SEGMENT_SIZE_MB
 
     # Elastic Search configuration
     config_harvester['ES_LOGIN_BSO3_BACK'] = ES_LOGIN_BSO3_BACK
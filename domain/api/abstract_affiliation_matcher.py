@@ -1,5 +1,5 @@
 from abc import ABCMeta, abstractmethod
-from typing import List
+from typing import Dict, Iterable, List
 
 
 class AbstractAffiliationMatcher(metaclass=ABCMeta):
@@ -12,3 +12,14 @@ class AbstractAffiliationMatcher(metaclass=ABCMeta):
     def get_affiliation(self, match_type: str, affiliation_string: str):
         raise NotImplementedError
 
+    @abstractmethod
+    def get_affiliations_many(self, match_type: str, affiliation_strings: Iterable[str]) -> List[List]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_affiliations_multi(self, match_types: List[str], affiliation_strings: Iterable[str]) -> Dict[str, List[List]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def stats(self) -> Dict:
+        raise NotImplementedError
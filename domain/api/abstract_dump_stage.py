@@ -0,0 +1,22 @@
+from abc import ABCMeta, abstractmethod
+from typing import Dict
+
+
+class AbstractDumpStage(metaclass=ABCMeta):
+    """Consumer of the records of the dump files read by a DumpPipeline"""
+
+    @abstractmethod
+    def start_file(self, dump_file: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def process_record(self, doi: Dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    def end_file(self, dump_file: str):
+        raise NotImplementedError
+
+    def close(self):
+        """Called once all the dump files are read, or the pipeline failed"""
+        pass
@@ -1,7 +1,7 @@
 from abc import ABCMeta, abstractmethod
 from domain.databases.abstract_session import AbstractSession
 from domain.model.process_state import ProcessState
-from typing import List
+from typing import Iterable, List, Set
 
 
 class AbstractProcessStateRepository(metaclass=ABCMeta):
@@ -15,6 +15,18 @@ class AbstractProcessStateRepository(metaclass=ABCMeta):
     def create(self):
         raise NotImplementedError
 
+    @abstractmethod
+    def create_many(self, process_states: List[ProcessState]) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def migrate(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_processed_file_paths(self, file_paths: Iterable[str]) -> Set[str]:
+        raise NotImplementedError
+
     @abstractmethod
     def get(self) -> List[ProcessState]:
         raise NotImplementedError
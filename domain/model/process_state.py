@@ -7,6 +7,7 @@ class ProcessState:
     id: int
     file_name: str
     file_path: str
+    relative_path: str
     number_of_dois: int
     number_of_dois_with_null_attributes: int
     number_of_non_null_dois: int
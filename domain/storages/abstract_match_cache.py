@@ -0,0 +1,18 @@
+from abc import ABCMeta, abstractmethod
+from typing import Dict, Iterable, List
+
+
+class AbstractMatchCache(metaclass=ABCMeta):
+    matcher_version: str
+
+    @abstractmethod
+    def get_many(self, match_type: str, affiliation_strings: Iterable[str]) -> Dict[str, List]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_many(self, match_type: str, results_by_string: Dict[str, List]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def stats(self) -> Dict:
+        raise NotImplementedError
@@ -0,0 +1,26 @@
+from abc import ABCMeta, abstractmethod
+from typing import Any, Iterator
+
+
+class AbstractReferenceStore(metaclass=ABCMeta):
+    fingerprint: str
+
+    @abstractmethod
+    def __contains__(self, key: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def __getitem__(self, key: str) -> Any:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    @abstractmethod
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def __iter__(self) -> Iterator[str]:
+        raise NotImplementedError
@@ -108,8 +108,11 @@ def parse_pdb(e, bso_doi_dict):
         elt['bso_local_affiliations_from_publications'] = bso_local_affiliations_from_publications
     return elt
 
-def treat_pdb(e, bso_doi_dict, index_name):
+def treat_pdb(e, bso_doi_dict, index_name, sink_writer=None):
     elt = parse_pdb(e, bso_doi_dict)
     if len(elt.get('fr_reasons', []))>0:
         logger.debug(f"french pdb {elt['doi']}")
-        append_to_file(file=f'/data/{index_name}.jsonl', _str=json.dumps(elt))
+        if sink_writer is not None:
+            sink_writer.write_record(elt)
+        else:
+            append_to_file(file=f'/data/{index_name}.jsonl', _str=json.dumps(elt))
@@ -2,6 +2,8 @@
 import re
 import string
 import unicodedata
+from functools import lru_cache
+from typing import Dict, List
 
 from tokenizers import normalizers
 from tokenizers.normalizers import BertNormalizer, Sequence, Strip
@@ -43,14 +45,50 @@ normalizer = Sequence([BertNormalizer(clean_text=True,
         lowercase=True), Strip()])
 pre_tokenizer = pre_tokenizers.Sequence([Whitespace()])
 
-def normalize(x, min_length = 0):
+NORMALIZE_CACHE_SIZE = 1_000_000
+MULTIPLE_SPACES = re.compile(' +')
+
+
+def _normalize(x, min_length = 0):
     normalized = normalizer.normalize_str(x)
     for c in ['\n', '<', '>', '$']:
         normalized = normalized.replace(c, ' ')
-    normalized = re.sub(' +', ' ', normalized)
+    normalized = MULTIPLE_SPACES.sub(' ', normalized)
     # keep if digit alone
     return " ".join([e[0] for e in pre_tokenizer.pre_tokenize_str(normalized) if (len(e[0]) > min_length) or (e[0] in string.digits)])
 
+
+# names, affiliations and publishers are repeated millions of times in the datacite dumps
+_cached_normalize = lru_cache(maxsize=NORMALIZE_CACHE_SIZE)(_normalize)
+
+
+def normalize(x, min_length = 0):
+    return _cached_normalize(x, min_length)
+
+
+def normalize_many(x_list: List[str], min_length = 0) -> List[str]:
+    """Normalize a list of strings, each distinct string being normalized (or read from the cache) only once"""
+    normalized_by_x = {x: _cached_normalize(x, min_length) for x in dict.fromkeys(x_list)}
+    return [normalized_by_x[x] for x in x_list]
+
+
+def normalize_cache_stats(since: Dict = None) -> Dict:
+    """Hits and misses of the normalize cache, counted from the since snapshot if given"""
+    cache_info = _cached_normalize.cache_info()
+    hits = cache_info.hits - (since or {}).get('hits', 0)
+    misses = cache_info.misses - (since or {}).get('misses', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else 0,
+        'size': cache_info.currsize,
+        'max_size': cache_info.maxsize,
+    }
+
+
+def log_normalize_cache_stats(task_name: str, since: Dict = None):
+    logger.debug(f'{task_name} - normalize cache {normalize_cache_stats(since)}')
+
 def normalize2(x, remove_space = True, min_length = 0):
     if not isinstance(x, str):
         return ''
@@ -14,17 +14,28 @@ from adapters.api.affiliation_matcher import AffiliationMatcher
 from adapters.databases.harvest_state_repository import HarvestStateRepository
 from adapters.databases.postgres_session import PostgresSession
 from adapters.databases.process_state_repository import ProcessStateRepository
+from adapters.storages.match_cache import MatchCache
+from adapters.storages.reference_store import ReferenceStore
 from adapters.storages.swift_session import SwiftSession
+from application.affiliation_matching import (
+    AFFILIATION_FILE_COLUMNS, match_affiliations, read_affiliations_partition_by_hash,
+    read_affiliations_partition_by_offsets,
+)
+from application.dump_pipeline import AffiliationStage, DumpPipeline, EnrichmentStage
 from application.elastic import reset_index
+from application.enricher import enrich_dump_files, enrich_dump_files_incremental, enrich_dump_files_sharded
+from application.enrichment_checkpoint import EnrichmentCheckpoint
+from application.enrichment_report import EnrichmentReport
 from application.harvester import Harvester
+from application.index_sink_writer import IndexSinkWriter
 from application.processor import Processor, PartitionsController
-from application.utils_processor import _merge_files, append_to_es_index_sourcefile, get_publisher, get_client_id, get_resourceTypeGeneral, get_natural_key
-from config.business_rules import FRENCH_PUBLISHERS, FRENCH_ALPHA2
-from config.global_config import config_harvester, MOUNTED_VOLUME_PATH
+from application.utils_processor import _merge_files, dump_record_generator
+from config.business_rules import FRENCH_ALPHA2
+from config.global_config import COMPRESSION_SUFFIX, config_harvester, MOUNTED_VOLUME_PATH
 from domain.model.ovh_path import OvhPath
 from project.server.main.logger import get_logger
 from project.server.main.pdb import load_pdbs, treat_pdb
-from project.server.main.strings import normalize
+from project.server.main.strings import log_normalize_cache_stats, normalize, normalize_cache_stats
 from project.server.main.utils import to_jsonl
 from project.server.main.utils_swift import download_object, get_list_files, init_cmd, upload_object
 import dask.dataframe as dd
@@ -32,10 +43,18 @@ import dask.dataframe as dd
 
 logger = get_logger(__name__)
 
+BSO_DOI_STORE = '/data/bso_doi_dict.refstore'
+FRENCH_AUTHORS_STORE = '/data/french_authors.refstore'
+FRENCH_RORS_STORE = '/data/french_rors.refstore'
+# root folder of the updated_* folders of dump files read by the enrichment
+DOIS_DUMP_FOLDER = '/data/dois'
 
-def run_task_import_elastic_search(index_name, new_index_name):
-    """Create an ES index from a file using elasticdump, deleting it if already exists."""
-    os.system(f'cd /data && gzip -k {index_name}.jsonl')
+
+def run_task_import_elastic_search(index_name, new_index_name, compressed=False):
+    """Create an ES index from a file using elasticdump, deleting it if already exists.
+    If compressed, the index file has been written directly as {index_name}.jsonl.gz."""
+    if not compressed:
+        os.system(f'cd /data && gzip -k {index_name}.jsonl')
     upload_object(
         container='bso_dump',
         source=f'{MOUNTED_VOLUME_PATH}/{index_name}.jsonl.gz',
@@ -53,9 +72,10 @@ def run_task_import_elastic_search(index_name, new_index_name):
     es_host = f"https://{ES_LOGIN_BSO3_BACK}:{parse.quote(ES_PASSWORD_BSO3_BACK)}@{es_url_without_http}"
     logger.debug("loading datacite index")
     reset_index(index=new_index_name)
+    input_file = f'{MOUNTED_VOLUME_PATH}/{index_name}.jsonl{COMPRESSION_SUFFIX if compressed else ""}'
     elasticimport = (
-            f"elasticdump --input={MOUNTED_VOLUME_PATH}/{index_name}.jsonl --output={es_host}{new_index_name} --type=data --limit 50 "
-            + "--transform='doc._source=Object.assign({},doc)'"
+            f"elasticdump --input={input_file} --output={es_host}{new_index_name} --type=data --limit 50 "
+            + f"{'--fsCompress ' if compressed else ''}--transform='doc._source=Object.assign({{}},doc)'"
     )
     logger.debug("Import file into elasticsearch - start")
     os.system(elasticimport)
@@ -67,52 +87,51 @@ def get_partition_size(source_metadata_file, total_partition_number):
     Divide the number of lines of the file by the number of partitions
     Return the integer part of the division.
     """
-    with open(source_metadata_file, "rt") as f:
-        number_of_lines = len(f.readlines())
+    with open(source_metadata_file, "rb") as f:
+        number_of_lines = sum(1 for _ in f)
     partition_size = number_of_lines // total_partition_number
     return partition_size
 
 
-def run_task_match_affiliations_partition(file_prefix, partition_index, total_partition_number):
-    """Run Affiliation Matcher on a partition of global affiliation file and write the result in a CSV file"""
+def run_task_match_affiliations_partition(file_prefix, partition_index, total_partition_number,
+                                          by_affiliation_hash=False):
+    """Run Affiliation Matcher on a partition of global affiliation file and write the result in a CSV file.
+    The partitions are byte ranges of the file from its partition index (ranges of lines if it has no index),
+    or if by_affiliation_hash is set the affiliation strings whose hash bucket is in the partition (a byte range of
+    the hash buckets file written at consolidation), so that each distinct affiliation string is matched in one
+    partition only."""
     # Read csv file from volume
     local_affiliation_file = os.path.join(config_harvester['processed_dump_folder_name'], f"{file_prefix}_{config_harvester['global_affiliation_file_name']}")
     # read partition
-    partition_size = get_partition_size(local_affiliation_file, total_partition_number)
-    not_in_partition = lambda x: not x in range(
-        partition_index * partition_size, (partition_index + 1) * partition_size
-    )
-    affiliations_df = pd.read_csv(local_affiliation_file, header=None,
-                                  names=["doi_publisher", "doi_client_id", "affiliation_str"],
-                                  skiprows=not_in_partition
-                                  )
+    if by_affiliation_hash:
+        affiliations_df = read_affiliations_partition_by_hash(local_affiliation_file, partition_index,
+                                                              total_partition_number)
+    else:
+        affiliations_df = read_affiliations_partition_by_offsets(local_affiliation_file, partition_index,
+                                                                 total_partition_number)
+    if affiliations_df is None:
+        logger.debug(f"no partition index for {local_affiliation_file}, reading the partition by lines")
+        partition_size = get_partition_size(local_affiliation_file, total_partition_number)
+        not_in_partition = lambda x: not partition_index * partition_size <= x < (partition_index + 1) * partition_size
+        affiliations_df = pd.read_csv(local_affiliation_file, header=None,
+                                      names=AFFILIATION_FILE_COLUMNS,
+                                      skiprows=not_in_partition
+                                      )
     if affiliations_df.empty:
         logger.debug("affiliations_df is empty")
         return
     # process partition
-    affiliation_matcher = AffiliationMatcher(base_url=config_harvester["affiliation_matcher_service"])
+    affiliation_matcher = AffiliationMatcher(base_url=config_harvester["affiliation_matcher_service"],
+                                             max_in_flight=config_harvester.get('affiliation_matcher_max_in_flight'))
     affiliation_matcher_version = affiliation_matcher.get_version()
+    affiliation_matcher.cache = MatchCache(config_harvester['affiliation_match_cache_file'], affiliation_matcher_version,
+                                           max_size_mb=config_harvester.get('affiliation_match_cache_max_size_mb'))
     logger.debug(f'start country matching with {affiliation_matcher_version} affiliation-matcher for {len(affiliations_df)} cases')
-    affiliations_df["detected_countries"] = affiliations_df["affiliation_str"].apply(
-        lambda x: affiliation_matcher.get_affiliation("country", x))
-    affiliations_df["is_publisher_fr"] = affiliations_df["doi_publisher"].apply(str).apply(
-        affiliation_matcher.is_publisher_fr)
-    affiliations_df["is_clientId_fr"] = affiliations_df["doi_client_id"].apply(str).apply(
-        affiliation_matcher.is_clientId_fr)
-    affiliations_df["is_countries_fr"] = affiliations_df["detected_countries"].apply(affiliation_matcher.is_countries_fr)
-    is_fr = (affiliations_df.is_publisher_fr | affiliations_df.is_clientId_fr | affiliations_df.is_countries_fr)
-    affiliations_df["grid"] = [[]] * len(affiliations_df)
-    affiliations_df["rnsr"] = [[]] * len(affiliations_df)
-    affiliations_df["ror"] = [[]] * len(affiliations_df)
-    affiliations_df.loc[is_fr, "grid"] = affiliations_df.loc[is_fr, "affiliation_str"].apply(
-        lambda x: affiliation_matcher.get_affiliation("grid", x))
-    affiliations_df.loc[is_fr, "rnsr"] = affiliations_df.loc[is_fr, "affiliation_str"].apply(
-        lambda x: affiliation_matcher.get_affiliation("rnsr", x))
-    affiliations_df.loc[is_fr, "ror"] = affiliations_df.loc[is_fr, "affiliation_str"].apply(
-        lambda x: affiliation_matcher.get_affiliation("ror", x))
+    match_affiliations(affiliations_df, affiliation_matcher)
 
     processed_filename = f"{affiliation_matcher_version}_partition_{partition_index}.csv"
-    logger.debug(affiliation_matcher.get_affiliation.cache_info())
+    logger.debug(f'partition {partition_index} affiliation matcher {affiliation_matcher.stats()}')
+    affiliation_matcher.cache.close()
     logger.debug(f"Saving affiliations_df at {processed_filename}")
     affiliations_df.to_csv(os.path.join(config_harvester['affiliation_folder_name'], processed_filename), index=False)
 
@@ -261,11 +280,19 @@ def update_bso_publications():
                 bso_local_affiliations = [a for a in row.bso_local_affiliations.split('|')]
             bso_doi_dict[row.doi]['bso_local_affiliations_from_publications'] = bso_local_affiliations
     logger.debug(f'writing {len(bso_doi_dict)} dois info from bso publications')
-    pickle.dump(bso_doi_dict, open('/data/bso_doi_dict.pkl', 'wb'))
+    ReferenceStore.build(BSO_DOI_STORE, bso_doi_dict).close()
+
+
+def load_reference_data(store_file, legacy_pickle_file):
+    """Open the reference store file, or load the pickle written by the previous versions if there is no store yet"""
+    if os.path.isfile(store_file):
+        return ReferenceStore(store_file)
+    logger.debug(f'no {store_file}, loading {legacy_pickle_file}')
+    return pickle.load(open(legacy_pickle_file, 'rb'))
 
 
 def get_bso_publications():
-    return pickle.load(open('/data/bso_doi_dict.pkl', 'rb'))
+    return load_reference_data(BSO_DOI_STORE, '/data/bso_doi_dict.pkl')
 
 
 @retry(delay=200, tries=5)
@@ -320,14 +347,13 @@ def update_french_authors():
                         french_authors_dict[k][y].append(ror)
     final_french_authors_dict = {k: french_authors_dict[k] for k in french_authors_dict if french_authors_dict[k]['has_duplicate'] == False}
     logger.debug(f'writing {len(final_french_authors_dict)} french authors info')
-    pickle.dump(final_french_authors_dict, open('/data/french_authors.pkl', 'wb'))
+    ReferenceStore.build(FRENCH_AUTHORS_STORE, final_french_authors_dict).close()
 
 
 def get_french_authors():
-    return pickle.load(open('/data/french_authors.pkl', 'rb'))
+    return load_reference_data(FRENCH_AUTHORS_STORE, '/data/french_authors.pkl')
 
 
-EXCLUDED_FULL_NAMES = ["anne houles"]
 last_names_url = "https://raw.githubusercontent.com/dataesr/bso3-harvest-datacite/refs/heads/main/project/server/main/excluded_last_names.csv"
 df_excluded_last_names = pd.read_csv(last_names_url)
 EXCLUDED_LAST_NAMES = [normalize(x) for x in df_excluded_last_names.key.to_list()]
@@ -387,11 +413,11 @@ def update_french_rors():
             if loc.get('geonames_details', {}).get('country_code', '').lower() in FRENCH_ALPHA2:
                 french_rors.add(r['id'].split('/')[-1].lower())
     logger.debug(f'{len(french_rors)} french rors')
-    pickle.dump(french_rors, open('/data/french_rors.pkl', 'wb'))
+    ReferenceStore.build(FRENCH_RORS_STORE, french_rors).close()
 
 
 def get_french_rors():
-    return pickle.load(open('/data/french_rors.pkl', 'rb'))
+    return load_reference_data(FRENCH_RORS_STORE, '/data/french_rors.pkl')
 
 
 def build_bso3_local_dict():
@@ -467,13 +493,43 @@ def get_dois_from_input(filename: str) -> list:
     return res
 
 
-def run_task_enrich_dois(partition_files, index_name, new_index_name):
+def load_enrichment_references(report: EnrichmentReport) -> dict:
+    """Reference data of the enrichment (see enrich_doi), the time spent loading them being added to report"""
+    with report.timer('load_references'):
+        bso_doi_dict = get_bso_publications()
+        logger.debug(f"bso_doi_dict {len(bso_doi_dict)} elts")
+        french_authors_dict = get_french_authors()
+        logger.debug(f"french_authors_dict {len(french_authors_dict)} elts")
+        french_rors = get_french_rors()
+        logger.debug(f"french_rors {len(french_rors)} elts")
+        bso3_local_affiliations_dict = build_bso3_local_dict()
+    return {
+        'bso_doi_dict': bso_doi_dict,
+        'french_authors_dict': french_authors_dict,
+        'french_rors': french_rors,
+        'bso3_local_affiliations_dict': bso3_local_affiliations_dict,
+        'excluded_last_names': EXCLUDED_LAST_NAMES,
+    }
+
+
+def run_task_enrich_dois(partition_files, index_name, new_index_name, nb_workers=None, compress_output=False, dedup_dois=False,
+                         incremental=False, resume=False):
     """Read downloaded datacite files and :
         - write a file for each doi. If the doi contains a french affiliation,
         it is enriched with informations from Affiliation Matcher
         - write a file for creating an ES index with french affiliation containing dois infos
+    If nb_workers is set, the dump files are enriched in a pool of nb_workers processes (sharded mode).
+    If compress_output is set, the ES index file is written directly gzipped.
+    If dedup_dois is set, only the latest version of a doi is kept (sequential mode only).
+    If incremental is set, the shards of the previous enrichment are kept and only the new or changed dump files
+    are enriched, unless the reference data changed.
+    If resume is set, the task restarts from the checkpoint of a previous interrupted run on the same dump files.
+    Return the report of the task (seconds per stage, dois read / french / indexed...), also written
+    in {index_name}_report.json.
     """
     logger.debug(f'start run_task_enrich_dois with {len(partition_files)} files')
+    report = EnrichmentReport()
+    normalize_cache_stats_start = normalize_cache_stats()
     # sort partition files to start by the lastest
     partition_files.sort(reverse=True)
     # affiliations_matches = get_affiliations_matches()
@@ -488,173 +544,58 @@ def run_task_enrich_dois(partition_files, index_name, new_index_name):
     if not os.path.isdir(output_dir):
         os.makedirs(output_dir)
 
-    bso_doi_dict = get_bso_publications()
-    logger.debug(f"bso_doi_dict {len(bso_doi_dict)} elts")
-    french_authors_dict = get_french_authors()
-    logger.debug(f"french_authors_dict {len(french_authors_dict)} elts")
-    french_rors = get_french_rors()
-    logger.debug(f"french_rors {len(french_rors)} elts")
+    references = load_enrichment_references(report)
+    bso_doi_dict = references['bso_doi_dict']
 
     #matches = get_affiliations_matches(index_name)
     output_file = f'{MOUNTED_VOLUME_PATH}/{index_name}.jsonl'
-    os.system(f'rm -rf {output_file}')
-    known_dois = set([]) # to handle dois present multiple times
-    known_natural_keys = set([]) # to handle natural keys present multiple times
-
-    bso3_local_affiliations_dict = build_bso3_local_dict()
-
-    pdbs_data = load_pdbs()
-    for pdb_id in pdbs_data:
-        treat_pdb(pdbs_data[pdb_id], bso_doi_dict, index_name)
-
-    for dump_file in partition_files:
-        logger.debug(f'treating {dump_file}')
-        nb_new_doi, nb_new_country, nb_new_publisher, nb_new_client = 0, 0, 0, 0
-        logger.debug(f'start reading {dump_file}')
-        df_dois = pd.read_json(dump_file, lines=True, chunksize=1000)
-        for c in df_dois:
-            logger.debug('new chunk ...')
-            dump_objects = c.to_dict(orient='records')
-            logger.debug(f'read len = {len(dump_objects)}')
-            #for json_obj in json_line_generator(Path(dump_file)):
-            for doi in dump_objects:
-                # data = json_obj.get('data')
-                #nb_data = len(data)
-                #logger.debug(f'{nb_data} objects')
-                if doi['id'] not in known_dois:
-                    #if doi['id'] in known_dois:
-                    #    continue
-                    natural_key = get_natural_key(doi)
-                    if natural_key and natural_key in known_natural_keys:
-                        continue
-                    fr_reasons = []
-                    rors = []
-                    bso_local_affiliations_from_publications = []
-                    fr_publications_linked = []
-                    fr_authors_orcid = []
-                    fr_authors_name = []
-                    current_year = doi['attributes'].get('publicationYear')
-                    publisher = doi['attributes'].get('publisher')
-                    doi_split_last = doi['id'].lower().split('.')[-1]
-                    has_version_in_doi = ( len(doi_split_last) >= 2 and doi_split_last[0] == 'v' and doi_split_last[1:].isdigit() )
-                    # do not keep 10.6084/m9.figshare.12874890.v1 type doi (duplicates from figshare)
-                    if has_version_in_doi:
-                        if isinstance(publisher, str) and publisher.lower() in ['figshare', '4tu.researchdata']:
-                            continue
-                        if 'figshare' in doi['id'].lower():
-                            continue
-                    if 'attributes' in doi and 'relatedIdentifiers' in doi['attributes']:
-                        for rel_id in doi['attributes']['relatedIdentifiers']:
-                            if rel_id.get('relationType') == 'IsSupplementTo':
-                                if isinstance(rel_id.get('relatedIdentifier'), str) and rel_id['relatedIdentifier'].lower() in bso_doi_dict:
-                                    fr_reasons.append('linked_article')
-                                    publi_info = bso_doi_dict[rel_id['relatedIdentifier'].lower()]
-                                    rors += publi_info['rors']
-                                    bso_local_affiliations_from_publications += publi_info['bso_local_affiliations_from_publications']
-                                    fr_publications_linked.append({'doi': rel_id['relatedIdentifier'].lower(), 'rors': publi_info['rors'], 'bso_local_affiliations_from_publications': publi_info['bso_local_affiliations_from_publications']})
-                    countries, affiliations = [], []
-                    for obj in doi["attributes"]["creators"] + doi["attributes"]["contributors"]:
-                        if 'nameIdentifiers' in obj:
-                            nameIdentifiers = obj.get('nameIdentifiers', [])
-                            if not isinstance(nameIdentifiers, list):
-                                nameIdentifiers = [nameIdentifiers]
-                            assert(isinstance(nameIdentifiers, list))
-                            for nameIdentifier in nameIdentifiers:
-                                if isinstance(nameIdentifier.get('nameIdentifierScheme'), str) and nameIdentifier.get('nameIdentifierScheme').lower().strip()=='orcid':
-                                    if isinstance(nameIdentifier.get('nameIdentifier'), str):
-                                        current_orcid = nameIdentifier.get('nameIdentifier').split('/')[-1].upper()
-                                        if current_orcid in french_authors_dict and current_year in french_authors_dict[current_orcid]:
-                                            fr_reasons.append('french_orcid')
-                                            orcid_info = french_authors_dict[current_orcid][current_year]
-                                            rors += orcid_info
-                                            fr_authors_orcid.append({'author': obj, 'rors': orcid_info})
-                        normalized_names = []
-                        if isinstance(obj.get('name'), str):
-                            normalized_name = normalize(obj['name'].replace(',', ' '))
-                            normalized_names.append(normalized_name)
-                            for k in ['cnrs', 'saclay', 'sorbonne', 'inrae', 'inserm', 'cirad', 'ifremer', 'cnes', 'paris france', 'arkeopen', 'cocoon']:
-                                if k in normalized_name:
-                                    fr_reasons.append(f'name_{k}')
-                        if isinstance(obj.get('familyName'), str) and isinstance(obj.get('givenName'), str):
-                            normalized_name = normalize(obj['givenName'])+' '+normalize(obj['familyName'])
-                            normalized_names.append(normalized_name)
-                            normalized_name = normalize(obj['familyName'])+' '+normalize(obj['givenName'])
-                            normalized_names.append(normalized_name)
-                        for normalized_name in list(set(normalized_names)):
-                            to_exclude = False
-                            if normalized_name in french_authors_dict and current_year in french_authors_dict[normalized_name]:
-                                if publisher=='UNITE Community' and normalized_name in EXCLUDED_FULL_NAMES:
-                                    to_exclude = True
-                                for word in EXCLUDED_LAST_NAMES:
-                                    if word in normalized_name.split(' '):
-                                        to_exclude = True
-                                if to_exclude:
-                                    continue
-                                fr_reasons.append('french_author')
-                                author_info = french_authors_dict[normalized_name][current_year]
-                                rors += author_info
-                                fr_authors_name.append({'author': {'name': normalized_name}, 'rors':author_info})
-                        for affiliation in obj.get("affiliation", []):
-                            if 'affiliationIdentifier' in obj:
-                                assert(isinstance(obj['affiliationIdentifier'], str))
-                                if 'ror' in obj['affiliationIdentifier'].lower():
-                                    current_ror = obj['affiliationIdentifier'].lower().split('/')[-1]
-                                    rors.append(current_ror)
-                                    if current_ror in french_rors:
-                                        fr_reasons.append('french_ror')
-                            if affiliation:
-                                local_matches = {}
-                                aff_str = str(affiliation)
-                                aff_str_normalized = normalize(aff_str)
-                                for k in ['france', 'french', 'umr ', 'cnrs', 'ifremer', 'cnes', 'saclay', 'sorbonne', 'paris', ' lyon', 'marseille', 'lille', 'nantes', 'rennes', 'inrae', 'inserm', 'montpellier', 'toulouse', 'strasbourg', 'lorraine', 'toulon', 'pierre simon laplace', 'grenoble', 'roscoff', 'agrocampus', 'nanterre', 'orleans', 'paul sabatier', 'caen', 'normandie', 'jean perrin', 'bordeaux', 'ecole polytechnique', 'reims', 'ardenne', 'la reunion', 'poitiers', 'ecole normale superieure', 'saint etienne', 'onera', 'cirm', 'savoie', 'salpetriere', 'cochin', 'inria', 'inra', 'cea', 'mondor', 'roussy', 'necker', 'necker', 'nancy', 'tours', 'avicenne', 'lariboisiere']:
-                                    if k in aff_str_normalized:
-                                        fr_reasons.append(f'affiliation_{k}')
-                    countries = list(set(countries))
-                    doi['countries'] = countries
-                    doi['affiliations'] = affiliations
-                    for c in countries:
-                        if c in FRENCH_ALPHA2:
-                            fr_reasons.append('country')
-                            nb_new_country += 1
-                    current_publisher = get_publisher(doi)
-                    #match regex INRA par ex (pas INRAP)
-                    pattern_str = '|'.join([fr"\b{w}\b" for w in FRENCH_PUBLISHERS])
-                    pattern = re.compile(pattern_str, re.IGNORECASE)
-                    if isinstance(current_publisher, str):
-                        if re.search(pattern, get_publisher(doi)):
-                            fr_reasons.append('publisher')
-                            nb_new_publisher += 1
-                    if get_client_id(doi).startswith('inist.'):
-                        fr_reasons.append("clientId")
-                        nb_new_client += 1
-                    rors = list(set(rors))
-                    bso_local_affiliations_from_publications = list(set(bso_local_affiliations_from_publications))
-                    fr_reasons = list(set(fr_reasons))
-                    fr_reasons.sort()
-                    fr_reasons_concat = ';'.join(fr_reasons)
-                    # skip image from nakala without any other interesting meta
-                    if fr_reasons_concat == 'clientId;publisher' and get_resourceTypeGeneral(doi) == 'image':
-                        fr_reasons = []
-                        continue
-                    if len(fr_reasons)>0:
-                        doi['fr_reasons'] = fr_reasons
-                        doi['fr_reasons_concat'] = fr_reasons_concat
-                        doi['rors'] = rors
-                        doi['bso_local_affiliations_from_publications'] = bso_local_affiliations_from_publications
-                        doi['fr_authors_orcid'] = fr_authors_orcid
-                        doi['fr_authors_name'] = fr_authors_name
-                        doi['fr_publications_linked'] = fr_publications_linked
-                        doi['natural_key'] = natural_key
-                        is_doi_kept = append_to_es_index_sourcefile(doi, index_name, bso3_local_affiliations_dict)
-                        if is_doi_kept:
-                            nb_new_doi += 1
-                        known_natural_keys = set(list(known_natural_keys) + [natural_key])# only for french
-                    #known_dois.add(doi['id'])
-            logger.debug(f'{nb_new_doi} doi added to {index_name} - country {nb_new_country} - publisher {nb_new_publisher} - client {nb_new_client}')
-            logger.debug(f"known_natural_keys={len(known_natural_keys)} / known_dois = {len(known_dois)}")
-        if '0000.jsonl.gz' in dump_file:
-            known_natural_keys = {}
-    run_task_import_elastic_search(index_name, new_index_name)
+    if (nb_workers or incremental) and dedup_dois:
+        logger.debug('dois deduplication is only available in sequential mode, enriching sequentially')
+    if incremental and not dedup_dois:
+        mode, nb_workers = 'incremental', nb_workers or 1
+    elif nb_workers and not dedup_dois:
+        mode = 'sharded'
+    else:
+        mode, nb_workers = 'sequential', None
+    # a checkpoint of another mode is not resumed, its output file and shards having another layout
+    checkpoint = EnrichmentCheckpoint(f'{MOUNTED_VOLUME_PATH}/{index_name}_checkpoint', partition_files,
+                                      f'{output_file}{COMPRESSION_SUFFIX if compress_output else ""}', resume=resume,
+                                      mode=mode, nb_workers=nb_workers)
+    if not checkpoint.is_resumed:
+        os.system(f'rm -rf {output_file} {output_file}{COMPRESSION_SUFFIX}')
+
+    if checkpoint.get('completed'):
+        logger.debug(f'enrichment already completed, only importing {index_name}')
+    else:
+        with IndexSinkWriter.for_index(MOUNTED_VOLUME_PATH, index_name, compress=compress_output,
+                                       truncate_at=checkpoint.get('output_offset')) as sink_writer:
+            if not checkpoint.get('pdbs_done'):
+                with report.timer('pdb'):
+                    pdbs_data = load_pdbs()
+                    for pdb_id in pdbs_data:
+                        treat_pdb(pdbs_data[pdb_id], bso_doi_dict, index_name, sink_writer=sink_writer)
+                checkpoint.save(pdbs_done=True, output_offset=sink_writer.checkpoint())
+
+            if mode == 'incremental':
+                enrich_dump_files_incremental(partition_files, sink_writer, references, nb_workers,
+                                              shard_folder=f'{MOUNTED_VOLUME_PATH}/{index_name}_incremental',
+                                              fingerprint_files=[f'{MOUNTED_VOLUME_PATH}/re3data_dict.json'],
+                                              report=report)
+            elif mode == 'sharded':
+                enrich_dump_files_sharded(partition_files, sink_writer, references, nb_workers,
+                                          shard_folder=f'{MOUNTED_VOLUME_PATH}/{index_name}_shards',
+                                          resume=checkpoint.is_resumed, report=report)
+            else:
+                enrich_dump_files(partition_files, sink_writer, references, dedup_dois=dedup_dois,
+                                  spill_folder=f'{MOUNTED_VOLUME_PATH}/{index_name}_dedup', checkpoint=checkpoint,
+                                  report=report)
+            checkpoint.save(completed=True, output_offset=sink_writer.checkpoint())
+    log_normalize_cache_stats('run_task_enrich_dois', since=normalize_cache_stats_start)
+    report.extra['normalize_cache'] = normalize_cache_stats(since=normalize_cache_stats_start)
+    with report.timer('import'):
+        run_task_import_elastic_search(index_name, new_index_name, compressed=compress_output)
+    checkpoint.clear()
+    return report.save(f'{MOUNTED_VOLUME_PATH}/{index_name}_report.json')
     #for i, file in enumerate(partition_files):
     #    logger.debug(f"Processing {i} / {len(partition_files)}")
     #    write_doi_files(merged_affiliations, is_fr, Path(file), output_dir, index_name)
@@ -674,10 +615,23 @@ def run_task_enrich_dois(partition_files, index_name, new_index_name):
     #    os.remove(file)
 
 
-def run_task_process_dois(partition_index, files_in_partition):
+def run_task_migrate_process_state():
+    """Create the process_state table and its indexes if needed, enqueued once before the run_task_process_dois
+    partition jobs, which push their states concurrently"""
+    postgres_session = PostgresSession(host=config_harvester['db']['db_host'],
+                                       port=config_harvester['db']['db_port'],
+                                       database_name=config_harvester['db']['db_name'],
+                                       password=config_harvester['db']['db_password'],
+                                       username=config_harvester['db']['db_user'])
+    ProcessStateRepository(postgres_session).migrate()
+
+
+def run_task_process_dois(partition_index, files_in_partition, nb_workers=None, output_format=None):
     """Read downloaded datacite files and extracts affiliations infos from
-    downloaded datacite files. Write it in CSV files to be optimally processed
-    by Affiliation Matcher. Track the progress with a Postgres Session"""
+    downloaded datacite files. Write it in CSV (or parquet) files to be optimally processed
+    by Affiliation Matcher. Track the progress with a Postgres Session.
+    The files are parsed by nb_workers processes, config_harvester['process_nb_workers'] if not set.
+    output_format is 'csv' or 'parquet', config_harvester['affiliation_files_format'] if not set."""
     postgres_session = PostgresSession(host=config_harvester['db']['db_host'],
                                        port=config_harvester['db']['db_port'],
                                        database_name=config_harvester['db']['db_name'],
@@ -688,10 +642,51 @@ def run_task_process_dois(partition_index, files_in_partition):
 
     processor = Processor(config=config_harvester, index_of_partition=partition_index,
                           files_in_partition=files_in_partition,
-                          repository=process_state_repository)
+                          repository=process_state_repository,
+                          nb_workers=nb_workers or config_harvester.get('process_nb_workers'),
+                          output_format=output_format or config_harvester.get('affiliation_files_format', 'csv'))
     processor.process_partition()
 
 
+def run_task_process_and_enrich_dois(partition_files, index_name, new_index_name, partition_index=0, output_format=None,
+                                     compress_output=False, dump_folder=DOIS_DUMP_FOLDER):
+    """Fused mode of run_task_process_dois and run_task_enrich_dois: each dump file is read once, its dois being
+    given to the affiliations extraction (written in the partition_index partition files, processed files
+    being skipped) and then to the enrichment (written in the ES index file, then imported in new_index_name).
+    The dump files are read sequentially, without dois deduplication nor checkpoint. They are identified by their
+    path relative to dump_folder in the process states and the affiliation files.
+    Return the report of the task, also written in {index_name}_report.json."""
+    logger.debug(f'start run_task_process_and_enrich_dois with {len(partition_files)} files')
+    report = EnrichmentReport()
+    # sort partition files to start by the lastest
+    partition_files.sort(reverse=True)
+    references = load_enrichment_references(report)
+    postgres_session = PostgresSession(host=config_harvester['db']['db_host'],
+                                       port=config_harvester['db']['db_port'],
+                                       database_name=config_harvester['db']['db_name'],
+                                       password=config_harvester['db']['db_password'],
+                                       username=config_harvester['db']['db_user'])
+    process_state_repository = ProcessStateRepository(postgres_session)
+    process_state_repository.migrate()
+    processor = Processor(config=config_harvester, index_of_partition=partition_index,
+                          files_in_partition=partition_files,
+                          repository=process_state_repository,
+                          output_format=output_format or config_harvester.get('affiliation_files_format', 'csv'),
+                          dump_folder=dump_folder)
+    output_file = f'{MOUNTED_VOLUME_PATH}/{index_name}.jsonl'
+    os.system(f'rm -rf {output_file} {output_file}{COMPRESSION_SUFFIX}')
+    with IndexSinkWriter.for_index(MOUNTED_VOLUME_PATH, index_name, compress=compress_output) as sink_writer:
+        with report.timer('pdb'):
+            pdbs_data = load_pdbs()
+            for pdb_id in pdbs_data:
+                treat_pdb(pdbs_data[pdb_id], references['bso_doi_dict'], index_name, sink_writer=sink_writer)
+        stages = [AffiliationStage(processor, report), EnrichmentStage(sink_writer, references, report)]
+        DumpPipeline(stages, report).run(partition_files)
+    with report.timer('import'):
+        run_task_import_elastic_search(index_name, new_index_name, compressed=compress_output)
+    return report.save(f'{MOUNTED_VOLUME_PATH}/{index_name}_report.json')
+
+
 def run_task_harvest_dois(target_directory, start_date, end_date, interval, use_thread=False, force=True):
     """Run dcdump go script. Track the progress with a Postgres Session"""
     postgres_session = PostgresSession(host=config_harvester['db']['db_host'],
@@ -712,12 +707,13 @@ def run_task_harvest_dois(target_directory, start_date, end_date, interval, use_
     upload_object(container='bso-datacite', source='/data/dump', target='dump')
 
 
-def run_task_consolidate_processed_files(file_prefix):
+def run_task_consolidate_processed_files(file_prefix, output_format=None):
     """Concatenate all the partitions files into one detailed affiliation file
     and one consolidated affiliation file. Upload the files to OVH.
     Remove partition files."""
     logger.info("Consolidating of processed files")
-    partitions_controller = PartitionsController(config_harvester, file_prefix)
+    partitions_controller = PartitionsController(config_harvester, file_prefix,
+                                                 output_format=output_format or config_harvester.get('affiliation_files_format', 'csv'))
     partitions_controller.concat_files()
     partitions_controller.push_to_ovh()
     partitions_controller.clear_local_directory()
@@ -731,27 +727,24 @@ def run_task_dump_files():
     locals_publications = {}
     for struct_id in struct_ids:
         locals_publications[struct_id] = []
-    # Download latest dump of bso-datacite from "bso_dump" Swift container and read it by chunk of 1000 lines
+    # Download latest dump of bso-datacite from "bso_dump" Swift container and stream its records
     bso_datasets_latest_dump = f"{LOCAL_DATA_FOLDER}/bso-datacite-latest.jsonl.gz"
     download_object("bso_dump", "bso-datacite-latest.jsonl.gz", bso_datasets_latest_dump)
-    dfs = pd.read_json(bso_datasets_latest_dump, lines=True, chunksize=1000)
+    # Locally creates JSONL and CSV files dedicated to each local BSO
+    for dataset in dump_record_generator(bso_datasets_latest_dump):
+        bso3_local_affiliations = dataset.get("bso3_local_affiliations", [])
+        bso3_local_affiliations = bso3_local_affiliations if isinstance(bso3_local_affiliations, list) else []
+        for bso3_local_affiliation in bso3_local_affiliations:
+            if bso3_local_affiliation in locals_publications.keys():
+                to_jsonl([dataset], f"{LOCAL_DATA_FOLDER}/bso-datasets-{bso3_local_affiliation}.jsonl", "a")
+                data = pd.read_json(f"{LOCAL_DATA_FOLDER}/bso-datasets-{bso3_local_affiliation}.jsonl", lines=True)
+                for field in ["description", "methods"]:
+                    if field in data.columns:
+                        del data[field]
+                data.to_csv(f"{LOCAL_DATA_FOLDER}/bso-datasets-{bso3_local_affiliation}.csv", index=False)
     # Delete downloaded latest dump of bso-datacite
     if os.path.exists(bso_datasets_latest_dump):
         os.remove(bso_datasets_latest_dump)
-    # Locally creates JSONL and CSV files dedicated to each local BSO
-    for df in dfs:
-        datasets = df.to_dict(orient="records")
-        for dataset in datasets:
-            bso3_local_affiliations = dataset.get("bso3_local_affiliations", [])
-            bso3_local_affiliations = bso3_local_affiliations if isinstance(bso3_local_affiliations, list) else []
-            for bso3_local_affiliation in bso3_local_affiliations:
-                if bso3_local_affiliation in locals_publications.keys():
-                    to_jsonl([dataset], f"{LOCAL_DATA_FOLDER}/bso-datasets-{bso3_local_affiliation}.jsonl", "a")
-                    data = pd.read_json(f"{LOCAL_DATA_FOLDER}/bso-datasets-{bso3_local_affiliation}.jsonl", lines=True)
-                    for field in ["description", "methods"]:
-                        if field in data.columns:
-                            del data[field]
-                    data.to_csv(f"{LOCAL_DATA_FOLDER}/bso-datasets-{bso3_local_affiliation}.csv", index=False)
     # Upload the dedicated JSONL and CSV files into "bso_dump" Swift container and delete them
     for struct_id in locals_publications.keys():
         for filename in [f"bso-datasets-{struct_id}.jsonl", f"bso-datasets-{struct_id}.csv"]:
@@ -18,6 +18,8 @@ from project.server.main.tasks import (
     run_task_harvest_dois,
     run_task_import_elastic_search,
     run_task_match_affiliations_partition,
+    run_task_migrate_process_state,
+    run_task_process_and_enrich_dois,
     run_task_process_dois,
     update_bso_publications,
     update_french_authors,
@@ -33,6 +35,9 @@ main_blueprint = Blueprint(
 
 logger = get_logger(__name__)
 
+# options of run_task_enrich_dois not available in the fused mode (run_task_process_and_enrich_dois)
+FUSED_MODE_UNSUPPORTED_ARGS = ["nb_workers", "dedup_dois", "incremental", "resume"]
+
 # @deprecated("This function is not use anymore")
 def get_partitions(files: List[str], number_of_partitions: int = None, partition_size: int = None) -> List[List[str]]:
     """Return a list of partitions of files.
@@ -114,18 +119,23 @@ def create_task_process_dois():
         tasks_list = []
         with Connection(redis.from_url(current_app.config["REDIS_URL"])):
             q = Queue("harvest-datacite", default_timeout=1500 * 3600)
+            # the process_state table is migrated once, before the partition jobs
+            task_migrate_process_state = q.enqueue(run_task_migrate_process_state)
             for i, partition in enumerate(partitions):
                 task_kwargs = {
                     "partition_index": i,
                     "files_in_partition": partition,
+                    "nb_workers": args.get("nb_workers"),
+                    "output_format": args.get("output_format"),
                 }
-                task = q.enqueue(run_task_process_dois, **task_kwargs)
+                task = q.enqueue(run_task_process_dois, **task_kwargs, depends_on=task_migrate_process_state)
                 response_objects.append({"status": "success", "data": {"task_id": task.get_id()}})
                 logger.debug({task.get_id()})
                 tasks_list.append(task)
             # consolidate files
             consolidate_task_kwargs = {
                 "file_prefix": file_prefix,
+                "output_format": args.get("output_format"),
             }
             task_consolidate_processed_files = q.enqueue(run_task_consolidate_processed_files,
                                                      **consolidate_task_kwargs,
@@ -150,6 +160,7 @@ def create_task_affiliations():
                 "file_prefix": file_prefix,
                 "partition_index": partition_index,
                 "total_partition_number": number_of_partitions,
+                "by_affiliation_hash": args.get("by_affiliation_hash", False),
                 "job_timeout": 20 * 3600,
             }
             task = q.enqueue(run_task_match_affiliations_partition, **task_kwargs)
@@ -173,7 +184,18 @@ def create_task_affiliations():
 @main_blueprint.route("/enrich_dois", methods=["POST"])
 def create_task_enrich_doi():
     args = request.get_json(force=True)
-    skip_re3data = args.get("skip_re3data", False)
+    if args.get("process_affiliations", False):
+        # the affiliation files of the fused mode are consolidated in {file_prefix}_* files
+        if not args.get("file_prefix"):
+            return jsonify({"status": "error", "message": "file_prefix is required with process_affiliations"}), 400
+        # the fused mode enriches sequentially from scratch: these options would be silently ignored
+        unsupported_args = [arg for arg in FUSED_MODE_UNSUPPORTED_ARGS if args.get(arg)]
+        if unsupported_args:
+            return jsonify({"status": "error",
+                            "message": f"{', '.join(unsupported_args)} not supported with process_affiliations"}), 400
+    # when resuming, the reference data are not updated by default, to enrich the remaining dois with the same ones
+    resume = args.get("resume", False)
+    skip_re3data = args.get("skip_re3data", resume)
     if skip_re3data == False:
         get_list_re3data_repositories()
         enrich_re3data()
@@ -182,8 +204,9 @@ def create_task_enrich_doi():
     index_name = args.get("index_name")
     # new_index_name = args.get("new_index_name")
     output_filename =  f'{MOUNTED_VOLUME_PATH}/{index_name}.jsonl'
-    logger.debug(f'remove {output_filename}')
-    os.system(f'rm -rf {output_filename}')
+    if not resume:
+        logger.debug(f'remove {output_filename}')
+        os.system(f'rm -rf {output_filename} {output_filename}.gz')
     # datacite_dump_files = glob(os.path.join(
     #     config_harvester['raw_dump_folder_name'],
     #     '*' + config_harvester['datacite_file_extension'])
@@ -201,11 +224,11 @@ def create_task_enrich_doi():
     datacite_files.sort()
     partition = datacite_files
     logger.debug(f"nb partition = {len(partition)} || {partition}")
-    if args.get('update_publications', True):
+    if args.get('update_publications', not resume):
         update_bso_publications()
     if args.get('update_french_authors', False):
         update_french_authors()
-    if args.get('update_french_rors', True):
+    if args.get('update_french_rors', not resume):
         update_french_rors()
     if args.get('update_pdb', False):
         update_pdbs()
@@ -213,7 +236,18 @@ def create_task_enrich_doi():
         q = Queue(name="harvest-datacite", default_timeout=1500 * 3600)
         # for partition in partitions:
             # task = q.enqueue(run_task_enrich_dois, partition, index_name)
-        task = q.enqueue(run_task_enrich_dois, partition, index_name, index_name)
+        if args.get("process_affiliations", False):
+            # fused mode: the affiliations files are written during the same read of the dump files
+            task = q.enqueue(run_task_process_and_enrich_dois, partition, index_name, index_name,
+                             output_format=args.get("output_format"),
+                             compress_output=args.get("compress_output", False))
+            response_objects.append({"status": "success", "data": {"task_id": task.get_id()}})
+            task = q.enqueue(run_task_consolidate_processed_files, file_prefix=args.get("file_prefix"),
+                             output_format=args.get("output_format"), depends_on=task)
+        else:
+            task = q.enqueue(run_task_enrich_dois, partition, index_name, index_name, nb_workers=args.get("nb_workers"),
+                             compress_output=args.get("compress_output", False), dedup_dois=args.get("dedup_dois", False),
+                             incremental=args.get("incremental", False), resume=resume)
         response_objects.append({"status": "success", "data": {"task_id": task.get_id()}})
     return jsonify(response_objects), 202
 
@@ -0,0 +1,86 @@
+"""Throughput of Processor.get_affiliations (column buffers) against the former list of per-row dicts.
+
+Usage: python -m tests.benchmark.bench_affiliation_extraction [dump_file.ndjson] [nb_dois]
+Without dump file, a ndjson file of nb_dois (1000 per line) is synthesized from the sample.ndjson fixture.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from application.processor import Processor
+from application.utils_processor import (
+    _create_affiliation_string, _format_string, _retrieve_object_name, _safe_get, get_publisher, json_line_generator
+)
+
+SAMPLE_FILE = Path(__file__).parent.parent / "unit_test" / "fixtures" / "sample.ndjson"
+DOIS_PER_LINE = 1000
+
+
+def synthesize_dump_file(path, nb_dois):
+    with open(SAMPLE_FILE, "r") as f:
+        records = json.loads(f.readline())["data"]
+    with open(path, "w") as f:
+        for start in range(0, nb_dois, DOIS_PER_LINE):
+            line = [records[i % len(records)] for i in range(start, min(start + DOIS_PER_LINE, nb_dois))]
+            f.write(json.dumps({"data": line}))
+            f.write("\n")
+
+
+def _concat_affiliation(doi, objects_to_use_for_concatenation, origin_file):
+    """Former extraction: a dict per affiliation, the per-doi values being computed for each of them"""
+    return [
+        {
+            "doi_id": str(doi["id"]).lower(),
+            "doi_file_name": str(doi["mapped_id"]).lower(),
+            "type": objects_to_use_for_concatenation,
+            "name": _retrieve_object_name(obj),
+            "doi_publisher": str(get_publisher(doi)).lower(),
+            "doi_client_id": str(_safe_get("", doi, "relationships", "client", "data", "id")),
+            "affiliation": _create_affiliation_string(affiliation, exclude_list=["affiliationIdentifierScheme"])
+            if len(affiliation) > 0 else "",
+            "origin_file": os.path.basename(origin_file),
+        }
+        for obj in doi["attributes"][objects_to_use_for_concatenation]
+        for affiliation in (obj["affiliation"] if len(obj) > 0 and len(obj["affiliation"]) > 0 else [{}])
+    ]
+
+
+def dict_rows_extraction(dump_file):
+    affiliations = []
+    for json_obj in json_line_generator(dump_file):
+        for doi in json_obj.get("data"):
+            doi["mapped_id"] = _format_string(doi["id"])
+            affiliations += _concat_affiliation(doi, "creators", dump_file)
+            affiliations += _concat_affiliation(doi, "contributors", dump_file)
+    return pd.DataFrame(affiliations)
+
+
+def column_buffers_extraction(dump_file):
+    return pd.DataFrame(Processor.get_affiliations(dump_file, 0)[3])
+
+
+def timed(extraction, dump_file):
+    start = time.perf_counter()
+    df = extraction(dump_file)
+    return df, time.perf_counter() - start
+
+
+def main(dump_file=None, nb_dois=1000000):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not dump_file:
+            dump_file = os.path.join(tmp_dir, "dump.ndjson")
+            synthesize_dump_file(dump_file, int(nb_dois))
+        print(f"{dump_file}: {os.path.getsize(dump_file) / 1e6:.1f} MB")
+        for name, extraction in [("per-row dicts", dict_rows_extraction), ("column buffers", column_buffers_extraction)]:
+            df, duration = timed(extraction, dump_file)
+            print(f"{name:15s} {len(df)} affiliations in {duration:.2f}s ({len(df) / duration:.0f} rows/s, "
+                  f"{df.memory_usage(deep=True).sum() / 1e6:.1f} MB DataFrame)")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,56 @@
+"""Throughput of the dump reader against the former pandas read_json(lines=True) round-trip.
+
+Usage: python -m tests.benchmark.bench_dump_reader [dump_file.jsonl.gz] [nb_records]
+Without dump file, a gzipped JSONL file of nb_records is synthesized from the sample.ndjson fixture.
+"""
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from application.utils_processor import dump_record_generator
+
+SAMPLE_FILE = Path(__file__).parent.parent / "unit_test" / "fixtures" / "sample.ndjson"
+
+
+def synthesize_dump_file(path, nb_records):
+    with open(SAMPLE_FILE, "r") as f:
+        records = json.loads(f.readline())["data"]
+    with gzip.open(path, "wt") as f:
+        for i in range(nb_records):
+            f.write(json.dumps(records[i % len(records)]))
+            f.write("\n")
+
+
+def pandas_reader(dump_file):
+    for df in pd.read_json(dump_file, lines=True, chunksize=1000):
+        for doi in df.to_dict(orient='records'):
+            yield doi
+
+
+def timed(reader, dump_file):
+    start = time.perf_counter()
+    nb_records = sum(1 for _ in reader(dump_file))
+    return nb_records, time.perf_counter() - start
+
+
+def main(dump_file=None, nb_records=100000):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not dump_file:
+            dump_file = os.path.join(tmp_dir, "dump.jsonl.gz")
+            synthesize_dump_file(dump_file, int(nb_records))
+        size_mb = os.path.getsize(dump_file) / 1e6
+        print(f"{dump_file}: {size_mb:.1f} MB compressed")
+        for name, reader in [("pandas read_json", pandas_reader), ("dump_record_generator", dump_record_generator)]:
+            nb_read, duration = timed(reader, dump_file)
+            print(f"{name:22s} {nb_read} records in {duration:.2f}s ({size_mb / duration:.1f} MB/s, "
+                  f"{nb_read / duration:.0f} records/s)")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,77 @@
+"""Micro-benchmark of the FrenchSignalDetector against the former per-DOI keyword loops.
+
+Usage: python -m tests.benchmark.bench_french_signal_detector [repeat]
+"""
+import json
+import re
+import sys
+from pathlib import Path
+from timeit import timeit
+
+from application.french_signal_detector import FrenchSignalDetector
+from config.business_rules import FRENCH_AFFILIATION_KEYWORDS, FRENCH_NAME_KEYWORDS, FRENCH_PUBLISHERS
+from project.server.main.strings import normalize
+
+DUMP_TEST_FILE = Path(__file__).parent.parent / "unit_test" / "application" / "dump-test.ndjson"
+
+
+def load_strings():
+    """Normalized names, normalized affiliations and publishers of the dump-test fixture"""
+    with open(DUMP_TEST_FILE, "r") as f:
+        dois = json.load(f)["data"]
+    names, affiliations, publishers = [], [], []
+    for doi in dois:
+        publishers.append(str(doi["attributes"].get("publisher")))
+        for obj in doi["attributes"]["creators"] + doi["attributes"]["contributors"]:
+            if isinstance(obj.get("name"), str):
+                names.append(normalize(obj["name"].replace(",", " ")))
+            for affiliation in obj.get("affiliation", []):
+                if affiliation:
+                    affiliations.append(normalize(str(affiliation)))
+    return names, affiliations, publishers
+
+
+def legacy_loop(names, affiliations, publishers):
+    fr_reasons = []
+    for normalized_name in names:
+        for k in FRENCH_NAME_KEYWORDS:
+            if k in normalized_name:
+                fr_reasons.append(f'name_{k}')
+    for aff_str_normalized in affiliations:
+        for k in FRENCH_AFFILIATION_KEYWORDS:
+            if k in aff_str_normalized:
+                fr_reasons.append(f'affiliation_{k}')
+    for publisher in publishers:
+        pattern_str = '|'.join([fr"\b{w}\b" for w in FRENCH_PUBLISHERS])
+        pattern = re.compile(pattern_str, re.IGNORECASE)
+        if re.search(pattern, publisher):
+            fr_reasons.append('publisher')
+    return sorted(set(fr_reasons))
+
+
+def detector_loop(detector, names, affiliations, publishers):
+    fr_reasons = []
+    for reasons in detector.get_name_reasons_many(names):
+        fr_reasons += reasons
+    for reasons in detector.get_affiliation_reasons_many(affiliations):
+        fr_reasons += reasons
+    for publisher in publishers:
+        if detector.is_french_publisher(publisher):
+            fr_reasons.append('publisher')
+    return sorted(set(fr_reasons))
+
+
+def main(repeat=10000):
+    names, affiliations, publishers = load_strings()
+    detector = FrenchSignalDetector()
+    assert legacy_loop(names, affiliations, publishers) == detector_loop(detector, names, affiliations, publishers)
+    legacy_time = timeit(lambda: legacy_loop(names, affiliations, publishers), number=repeat)
+    detector_time = timeit(lambda: detector_loop(detector, names, affiliations, publishers), number=repeat)
+    print(f"{len(names)} names, {len(affiliations)} affiliations, {len(publishers)} publishers x {repeat}")
+    print(f"keyword loops: {legacy_time:.3f}s ({legacy_time / repeat * 1e6:.1f} us / dump)")
+    print(f"detector:      {detector_time:.3f}s ({detector_time / repeat * 1e6:.1f} us / dump)")
+    print(f"speedup:       x{legacy_time / detector_time:.1f}")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
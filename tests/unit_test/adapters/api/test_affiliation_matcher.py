@@ -1,3 +1,7 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import MagicMock, Mock, patch
 from unittest import TestCase
 from adapters.api.affiliation_matcher import AffiliationMatcher
@@ -5,6 +9,45 @@ from adapters.api.affiliation_matcher import AffiliationMatcher
 TESTED_MODULE = "adapters.api.affiliation_matcher"
 
 
+class StubAffiliationMatcherHandler(BaseHTTPRequestHandler):
+    """Affiliation matcher answering the first two letters of the query after LATENCY seconds,
+    over keep-alive connections"""
+    protocol_version = "HTTP/1.1"
+    LATENCY = 0.05
+
+    def do_POST(self):
+        server = self.server
+        match = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        query = match["query"]
+        with server.lock:
+            server.queries.append(query)
+            server.matches.append((match["type"], query))
+            server.client_ports.add(self.client_address[1])
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(self.LATENCY)
+        with server.lock:
+            server.in_flight -= 1
+        body = json.dumps({"results": [query[:2]], "version": "0.0.0"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_affiliation_matcher() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAffiliationMatcherHandler)
+    server.lock = threading.Lock()
+    server.queries, server.matches, server.client_ports = [], [], set()
+    server.in_flight, server.max_in_flight = 0, 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
 class TestAffiliationMatcher(TestCase):
     def setUp(self):
         self.affiliation_matcher = AffiliationMatcher("fake_url")
@@ -47,7 +90,7 @@ class TestAffiliationMatcher(TestCase):
         self.assertEqual(countries_should_be_fr, True)
         self.assertEqual(countries_should_not_be_fr, False)
 
-    @patch(f"{TESTED_MODULE}.requests.post")
+    @patch(f"{TESTED_MODULE}.requests.Session.post")
     def test_get_version(self, mock_post):
         # Given
         # When
@@ -62,7 +105,7 @@ class TestAffiliationMatcher(TestCase):
             },
         )
 
-    @patch(f"{TESTED_MODULE}.requests.post")
+    @patch(f"{TESTED_MODULE}.requests.Session.post")
     def test_get_affiliation_first_request(self, mock_post):
         # Given
         # When
@@ -76,7 +119,7 @@ class TestAffiliationMatcher(TestCase):
         self.assertEqual(self.affiliation_matcher.get_affiliation.cache_info().hits, 0)
         self.assertEqual(self.affiliation_matcher.get_affiliation.cache_info().currsize, 1)
 
-    @patch(f"{TESTED_MODULE}.requests.post")
+    @patch(f"{TESTED_MODULE}.requests.Session.post")
     def test_get_affiliation_cached_request(self, mock_post):
         # Given
         self.affiliation_matcher.get_affiliation(self.match_type, self.affiliation_string)
@@ -87,10 +130,66 @@ class TestAffiliationMatcher(TestCase):
         self.assertEqual(self.affiliation_matcher.get_affiliation.cache_info().currsize, 1)
         self.assertEqual(self.affiliation_matcher.get_affiliation.cache_info().hits, 1)
 
-    @patch(f"{TESTED_MODULE}.requests.post", MagicMock(side_effect=Exception()))
+    @patch(f"{TESTED_MODULE}.requests.Session.post", MagicMock(side_effect=Exception()))
     def test_get_affiliation_exception(self):
         # Given
         # When
         affiliation = self.affiliation_matcher.get_affiliation(self.match_type, self.affiliation_string)
         # Then
         self.assertEqual(affiliation, [])
+
+    def test_get_affiliations_many_concurrent_requests_on_pooled_connections(self):
+        # Given
+        server = start_stub_affiliation_matcher()
+        affiliation_matcher = AffiliationMatcher(f"http://127.0.0.1:{server.server_port}", max_in_flight=4)
+        affiliation_strings = [f"{i:02d} university" for i in range(20)]
+        # When
+        start = time.perf_counter()
+        affiliations = affiliation_matcher.get_affiliations_many("country", affiliation_strings + affiliation_strings[:5])
+        duration = time.perf_counter() - start
+        server.shutdown()
+        server.server_close()
+        # Then
+        self.assertEqual(affiliations, [[f"{i:02d}"] for i in range(20)] + [[f"{i:02d}"] for i in range(5)])
+        self.assertEqual(sorted(server.queries), affiliation_strings)
+        self.assertTrue(1 < server.max_in_flight <= 4)
+        self.assertLessEqual(len(server.client_ports), 4)
+        self.assertLess(duration, 20 * StubAffiliationMatcherHandler.LATENCY / 2)
+
+    def test_stats_count_requests_and_failures(self):
+        # Given
+        affiliation_matcher = AffiliationMatcher("fake_url")
+        responses = [Mock(json=Mock(return_value={"results": ["fr"]})), Exception()]
+        # When
+        with patch(f"{TESTED_MODULE}.requests.Session.post", side_effect=responses):
+            affiliation_matcher.get_affiliations_many("country", ["CNRS", "Inria", "CNRS", None])
+        # Then
+        self.assertEqual(affiliation_matcher.stats(), {'requests': 2, 'failed_requests': 1})
+
+    def test_get_affiliations_many_not_string(self):
+        # Given
+        # When
+        affiliations = self.affiliation_matcher.get_affiliations_many("country", [None, float("nan")])
+        # Then
+        self.assertEqual(affiliations, [[], []])
+
+    @patch.object(StubAffiliationMatcherHandler, "LATENCY", 0.2)
+    def test_get_affiliations_multi_send_the_match_types_together(self):
+        # Given
+        server = start_stub_affiliation_matcher()
+        affiliation_matcher = AffiliationMatcher(f"http://127.0.0.1:{server.server_port}", max_in_flight=16)
+        affiliation_strings = ["fr university", "paris university", "fr university"]
+        # When
+        start = time.perf_counter()
+        affiliations = affiliation_matcher.get_affiliations_multi(["grid", "rnsr", "ror"], affiliation_strings)
+        duration = time.perf_counter() - start
+        server.shutdown()
+        server.server_close()
+        # Then
+        expected_affiliations = [["fr"], ["pa"], ["fr"]]
+        self.assertEqual(affiliations, {"grid": expected_affiliations, "rnsr": expected_affiliations,
+                                        "ror": expected_affiliations})
+        self.assertEqual(sorted(server.matches), sorted((match_type, string) for match_type in ["grid", "rnsr", "ror"]
+                                                        for string in ["fr university", "paris university"]))
+        # one match type after the other would take 3 latencies
+        self.assertLess(duration, 3 * StubAffiliationMatcherHandler.LATENCY / 2)
@@ -1,7 +1,11 @@
+from datetime import datetime
 from unittest import TestCase
-from unittest.mock import patch, Mock
+from unittest.mock import MagicMock, patch, Mock
+
+from sqlalchemy.dialects import postgresql
 
 from adapters.databases.process_state_repository import ProcessStateRepository
+from adapters.databases.process_state_table import ProcessStateTable
 from tests.unit_test.adapters.databases.mock_postgres_session import MockPostgresSession
 
 TESTED_MODULE = "adapters.databases.process_state_repository"
@@ -239,3 +243,79 @@ class TestProcessStateRepository(TestCase):
         self.assertEqual(self.mock_postgres_session.nb_calls_getEngine, nb_calls_getEngine_expected)
         self.assertEqual(self.mock_postgres_session.nb_calls_getSession, nb_calls_getSession_expected)
         self.assertEqual(self.mock_postgres_session.nb_calls_sessionScope, nb_calls_sessionScope_expected)
+
+    def test_given_mock_postgres_session_and_a_process_state_repository_when_using_create_many_then_one_insert_on_conflict_do_nothing_is_executed(
+            self):
+        # Given after setUp
+        process_states = [
+            ProcessStateTable(process_date=datetime(2024, 1, 1), file_name=f"part_000{i}.ndjson",
+                              file_path=f"/data/dump/part_000{i}.ndjson", number_of_dois=10, processed=True)
+            for i in range(3)
+        ]
+
+        # When
+        self.process_state_repository.create_many(process_states)
+        self.process_state_repository.create_many(process_states)
+
+        # Then
+        self.assertEqual(self.mock_postgres_session.nb_calls_getEngine, 0)
+        self.assertEqual(self.mock_postgres_session.nb_calls_sessionScope, 2)
+        self.assertEqual(self.mock_postgres_session.session.execute.call_count, 2)
+        statement = self.mock_postgres_session.session.execute.call_args[0][0]
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        self.assertIn("ON CONFLICT (relative_path) DO NOTHING", sql)
+        self.assertEqual(len(statement.compile(dialect=postgresql.dialect()).params), 3 * 8)
+
+    def test_given_mock_postgres_session_and_a_process_state_repository_when_using_migrate_then_duplicates_are_removed_before_creating_the_unique_index_under_a_lock(
+            self):
+        # Given after setUp
+        engine = self.mock_postgres_session.engine = MagicMock()
+        connection = engine.begin.return_value.__enter__.return_value
+        connection.execute.return_value.fetchall.return_value = [("0000.jsonl.gz", "0000.jsonl.gz")]
+
+        # When
+        with patch.object(ProcessStateTable.__table__, "create") as mock_create_table, \
+                patch("adapters.databases.process_state_table.logger") as mock_logger:
+            self.process_state_repository.migrate()
+
+        # Then
+        mock_create_table.assert_called_once_with(connection, checkfirst=True)
+        statements = [str(call_args[0][0]) for call_args in connection.execute.call_args_list]
+        self.assertTrue(statements[0].startswith("SELECT pg_advisory_xact_lock"))
+        self.assertIn("ADD COLUMN IF NOT EXISTS relative_path", statements[1])
+        self.assertIn("SET relative_path = file_name WHERE relative_path IS NULL", statements[2])
+        self.assertTrue(statements[3].startswith("DELETE FROM process_state duplicate"))
+        self.assertIn("duplicate.relative_path = kept.relative_path", statements[3])
+        self.assertIn("RETURNING duplicate.file_name", statements[3])
+        mock_logger.warning.assert_called_once()
+        self.assertIn("1 duplicate process_state rows deleted", mock_logger.warning.call_args[0][0])
+        self.assertIn("0000.jsonl.gz", mock_logger.warning.call_args[0][0])
+        self.assertIn("DROP INDEX IF EXISTS process_state_file_name_idx", statements[4])
+        self.assertIn("CREATE UNIQUE INDEX IF NOT EXISTS process_state_relative_path_idx", statements[5])
+        self.assertIn("CREATE INDEX IF NOT EXISTS process_state_file_path_idx", statements[6])
+
+    def test_given_mock_postgres_session_and_a_process_state_repository_when_using_create_many_without_states_then_nothing_is_executed(
+            self):
+        # When
+        nb_added = self.process_state_repository.create_many([])
+
+        # Then
+        self.assertEqual(nb_added, 0)
+        self.assertEqual(self.mock_postgres_session.nb_calls_sessionScope, 0)
+
+    def test_given_mock_postgres_session_and_a_process_state_repository_when_using_get_processed_file_paths_then_only_file_path_is_selected_by_chunks(
+            self):
+        # Given after setUp
+        file_paths = [f"/data/dump/part_{i:04d}.ndjson" for i in range(5)]
+        self.mock_postgres_session.session.execute.return_value.scalars.return_value.all.return_value = [file_paths[1]]
+
+        # When
+        with patch(f"{TESTED_MODULE}.FILE_PATHS_CHUNK_SIZE", 2):
+            processed_file_paths = self.process_state_repository.get_processed_file_paths(file_paths)
+
+        # Then
+        self.assertEqual(processed_file_paths, {file_paths[1]})
+        self.assertEqual(self.mock_postgres_session.nb_calls_sessionScope, 1)
+        self.assertEqual(self.mock_postgres_session.session.execute.call_count, 3)
+        sql = str(self.mock_postgres_session.session.execute.call_args[0][0].compile(dialect=postgresql.dialect()))
+        self.assertTrue(sql.startswith("SELECT process_state.file_path \nFROM process_state \nWHERE process_state.file_path IN"))
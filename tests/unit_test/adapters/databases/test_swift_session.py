@@ -1,7 +1,7 @@
 from unittest import TestCase
 from unittest.mock import patch
 
-from adapters.storages.swift_session import SwiftSession
+from adapters.storages.swift_session import SwiftSession, _IterableStream
 
 TESTED_MODULE = "adapters.storages.swift_session"
 
@@ -28,3 +28,18 @@ class TestSwiftSession(TestCase):
         # Then
         mock_create_engine.assert_called_once()
         self.assertIsNotNone(get_session_result)
+
+    def test_iterable_stream_read(self):
+        # Given
+        stream = _IterableStream([b"abc", b"", b"defgh", b"i"])
+
+        # When
+        first_read = stream.read(4)
+        second_read = stream.read(4)
+        last_read = stream.read()
+
+        # Then
+        self.assertEqual(first_read, b"abc")
+        self.assertEqual(second_read, b"defg")
+        self.assertEqual(last_read, b"hi")
+        self.assertEqual(stream.read(4), b"")
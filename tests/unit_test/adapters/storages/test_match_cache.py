@@ -0,0 +1,95 @@
+import os
+from itertools import count
+import shutil
+import sqlite3
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from adapters.api.affiliation_matcher import AffiliationMatcher
+from adapters.storages.match_cache import MatchCache
+
+TESTED_MODULE = "adapters.storages.match_cache"
+
+
+class TestMatchCache(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, "cache", "matches.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_many_put_many_normalized_strings(self):
+        # Given
+        cache = MatchCache(self.cache_file, "1.0.0")
+        cache.put_many("country", {"Université  Paris Cité": ["fr"], "MIT": ["us"], None: []})
+        # When
+        results = cache.get_many("country", ["Université Paris Cité", " MIT ", "CNRS", None])
+        # Then
+        self.assertEqual(results, {"Université Paris Cité": ["fr"], " MIT ": ["us"]})
+        self.assertEqual(cache.get_many("ror", ["MIT"]), {})
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 2)
+        self.assertEqual(cache.stats()["hit_rate"], 0.5)
+        cache.close()
+
+    def test_shared_across_instances_and_invalidated_by_version(self):
+        # Given
+        cache = MatchCache(self.cache_file, "1.0.0")
+        cache.put_many("country", {"MIT": ["us"]})
+        cache.close()
+        # When
+        same_version_results = MatchCache(self.cache_file, "1.0.0").get_many("country", ["MIT"])
+        new_version_cache = MatchCache(self.cache_file, "1.1.0")
+        # Then
+        self.assertEqual(same_version_results, {"MIT": ["us"]})
+        self.assertEqual(new_version_cache.get_many("country", ["MIT"]), {})
+        self.assertEqual(len(new_version_cache), 0)
+        new_version_cache.close()
+
+    @patch(f"{TESTED_MODULE}.time", side_effect=count())
+    @patch(f"{TESTED_MODULE}.EVICTED_SHARE", 0.5)
+    def test_evict_least_recently_used_when_over_size(self, _):
+        # Given
+        cache = MatchCache(self.cache_file, "1.0.0")
+        cache.put_many("country", {f"affiliation {i}": ["fr"] for i in range(10)})
+        cache.get_many("country", [f"affiliation {i}" for i in range(5, 10)])
+        cache.max_size = cache.get_size() - 1
+        # When
+        cache.put_many("country", {"affiliation 10": ["fr"]})
+        # Then
+        self.assertEqual(cache.stats()["evicted"], 5)
+        self.assertEqual(sorted(cache.get_many("country", [f"affiliation {i}" for i in range(11)])),
+                         sorted([f"affiliation {i}" for i in range(5, 11)]))
+        cache.close()
+
+    @patch(f"{TESTED_MODULE}.time", side_effect=count(1))
+    def test_get_many_does_not_write_and_last_used_written_on_close(self, _):
+        # Given
+        cache = MatchCache(self.cache_file, "1.0.0")
+        cache.put_many("country", {"MIT": ["us"], "CNRS": ["fr"]})
+        nb_changes = cache._connection.total_changes
+        # When
+        cache.get_many("country", ["MIT", "Inria"])
+        # Then
+        self.assertEqual(cache._connection.total_changes, nb_changes)
+        cache.close()
+        with sqlite3.connect(self.cache_file) as connection:
+            last_used = dict(connection.execute("SELECT query, last_used FROM matches"))
+        self.assertEqual(last_used, {"MIT": 2, "CNRS": 1})
+
+    def test_affiliation_matcher_only_query_strings_not_in_cache(self):
+        # Given
+        cache = MatchCache(self.cache_file, "1.0.0")
+        cache.put_many("country", {"MIT": ["us"]})
+        affiliation_matcher = AffiliationMatcher("fake_url", cache=cache)
+        # When
+        with patch.object(affiliation_matcher, "_request_affiliation",
+                          side_effect=lambda match_type, string: None if string == "failing" else ["fr"]) as mock_request:
+            affiliations = affiliation_matcher.get_affiliations_many("country", ["MIT", "CNRS", "failing", "CNRS"])
+        # Then
+        self.assertEqual(affiliations, [["us"], ["fr"], [], ["fr"]])
+        self.assertEqual(sorted(call.args[1] for call in mock_request.call_args_list), ["CNRS", "failing"])
+        self.assertEqual(cache.get_many("country", ["CNRS", "failing"]), {"CNRS": ["fr"]})
+        cache.close()
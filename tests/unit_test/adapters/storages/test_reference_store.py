@@ -0,0 +1,88 @@
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import TestCase
+
+from adapters.storages.reference_store import ReferenceStore
+
+TESTED_MODULE = "adapters.storages.reference_store"
+
+
+class TestReferenceStore(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.french_authors_dict = {
+            "0000-0002-1825-0097": {"has_duplicate": False, 2021: ["02feahw73"], 2022: ["02feahw73", "05f82e368"]},
+            "jean dupont": {"has_duplicate": False, 2020: ["05f82e368"]},
+            "élodie": {"has_duplicate": False},
+        }
+        self.french_rors = {"02feahw73", "05f82e368", "01ggx4157"}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_same_lookups_as_dict(self):
+        # When
+        store = ReferenceStore.build(os.path.join(self.tmp_dir, "authors.refstore"), self.french_authors_dict)
+        # Then
+        self.assertEqual(len(store), 3)
+        for key, value in self.french_authors_dict.items():
+            self.assertIn(key, store)
+            self.assertEqual(store[key], value)
+        self.assertTrue(2022 in store["0000-0002-1825-0097"])
+        self.assertNotIn("john doe", store)
+        self.assertNotIn(None, store)
+        self.assertIsNone(store.get("john doe"))
+        self.assertEqual(store.get("jean dupont"), self.french_authors_dict["jean dupont"])
+        self.assertEqual(dict(store.items()), self.french_authors_dict)
+        with self.assertRaises(KeyError):
+            store["john doe"]
+        store.close()
+
+    def test_set(self):
+        # When
+        store = ReferenceStore.build(os.path.join(self.tmp_dir, "rors.refstore"), self.french_rors)
+        # Then
+        self.assertEqual(set(store), self.french_rors)
+        self.assertIn("02feahw73", store)
+        self.assertNotIn("03yrm5c26", store)
+        store.close()
+
+    def test_empty(self):
+        store = ReferenceStore.build(os.path.join(self.tmp_dir, "empty.refstore"), {})
+        self.assertEqual(len(store), 0)
+        self.assertNotIn("02feahw73", store)
+        store.close()
+
+    def test_pickle_only_path(self):
+        # Given
+        store = ReferenceStore.build(os.path.join(self.tmp_dir, "rors.refstore"), self.french_rors)
+        # When
+        pickled_store = pickle.dumps(store)
+        unpickled_store = pickle.loads(pickled_store)
+        # Then
+        self.assertLess(len(pickled_store), 200)
+        self.assertEqual(set(unpickled_store), self.french_rors)
+        store.close()
+        unpickled_store.close()
+
+    def test_fingerprint(self):
+        # Given
+        first_store = ReferenceStore.build(os.path.join(self.tmp_dir, "first.refstore"), self.french_rors)
+        same_store = ReferenceStore.build(os.path.join(self.tmp_dir, "same.refstore"), set(sorted(self.french_rors)))
+        other_store = ReferenceStore.build(os.path.join(self.tmp_dir, "other.refstore"), {"02feahw73"})
+        # Then
+        self.assertEqual(first_store.fingerprint, same_store.fingerprint)
+        self.assertNotEqual(first_store.fingerprint, other_store.fingerprint)
+        for store in [first_store, same_store, other_store]:
+            store.close()
+
+    def test_not_a_store(self):
+        # Given
+        path = os.path.join(self.tmp_dir, "french_rors.pkl")
+        with open(path, "wb") as f:
+            pickle.dump(self.french_rors, f)
+        # Then
+        with self.assertRaises(ValueError):
+            ReferenceStore(path)
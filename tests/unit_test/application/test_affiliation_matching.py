@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import pandas as pd
+
+from adapters.api.affiliation_matcher import AffiliationMatcher
+from application.affiliation_matching import (
+    get_affiliation_partition_index, match_affiliations, read_affiliations_partition_by_hash,
+    read_affiliations_partition_by_offsets,
+)
+from application.utils_processor import _get_hash_buckets_path, _write_hash_buckets, _write_partition_index
+
+TESTED_MODULE = "application.affiliation_matching"
+
+
+class TestAffiliationMatching(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.affiliation_file = os.path.join(self.tmp_dir, "global_affiliations.csv")
+        rows = [[f"publisher {i % 7}", f"client.{i % 3}", f"affiliation {i % 10}"] for i in range(50)]
+        pd.DataFrame(rows).to_csv(self.affiliation_file, header=False, index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_affiliation_partition_index_stable(self):
+        # When
+        partition_index = get_affiliation_partition_index("Université Paris Cité", 101)
+        # Then
+        self.assertEqual(partition_index, get_affiliation_partition_index("Université Paris Cité", 101))
+        self.assertTrue(0 <= partition_index < 101)
+
+    @patch(f"{TESTED_MODULE}.READ_CHUNK_SIZE", 8)
+    def test_read_affiliations_partition_by_hash_each_string_in_one_partition(self):
+        # When
+        partitions = [read_affiliations_partition_by_hash(self.affiliation_file, partition_index, 4)
+                      for partition_index in range(4)]
+        # Then
+        self.assertEqual(sum(len(partition) for partition in partitions), 50)
+        strings_per_partition = [set(partition["affiliation_str"]) for partition in partitions]
+        for index, strings in enumerate(strings_per_partition):
+            for other_strings in strings_per_partition[index + 1:]:
+                self.assertEqual(strings & other_strings, set())
+
+    def test_read_affiliations_partition_by_hash_from_hash_buckets_file(self):
+        # Given
+        rows = [[f"publisher {i % 7}", f"client.{i % 3}", f'affiliation "{i % 40}",\nParis' if i % 5 == 0
+                 else f"affiliation {i % 40}"] for i in range(300)]
+        pd.DataFrame(rows).to_csv(self.affiliation_file, header=False, index=False)
+        expected_partitions = [read_affiliations_partition_by_hash(self.affiliation_file, partition_index, 7)
+                               for partition_index in range(7)]
+        # When
+        _write_hash_buckets(self.affiliation_file, key_column=2, max_rows_in_memory=64)
+        with patch(f"{TESTED_MODULE}.pd.read_csv", wraps=pd.read_csv) as mock_read_csv:
+            partitions = [read_affiliations_partition_by_hash(self.affiliation_file, partition_index, 7)
+                          for partition_index in range(7)]
+        # Then
+        self.assertEqual([sorted(partition.values.tolist()) for partition in partitions],
+                         [sorted(partition.values.tolist()) for partition in expected_partitions])
+        self.assertEqual(sum(len(partition) for partition in partitions), 300)
+        read_files = {call_args[0][0] for call_args in mock_read_csv.call_args_list}
+        self.assertNotIn(self.affiliation_file, read_files)
+        # the temporary run files are removed
+        buckets_file_name = os.path.basename(_get_hash_buckets_path(self.affiliation_file))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ["global_affiliations.csv", buckets_file_name, f"{buckets_file_name}.partitions.json"])
+
+    def test_match_affiliations_match_each_distinct_string_once(self):
+        # Given
+        affiliations_df = pd.read_csv(self.affiliation_file, header=None,
+                                      names=["doi_publisher", "doi_client_id", "affiliation_str"])
+        affiliation_matcher = AffiliationMatcher("fake_url")
+        french_strings = {"affiliation 1", "affiliation 2"}
+
+        def request_affiliation(match_type, affiliation_string):
+            if match_type == "country":
+                return ["fr"] if affiliation_string in french_strings else ["us"]
+            return [f"{match_type} of {affiliation_string}"]
+
+        # When
+        with patch.object(affiliation_matcher, "_request_affiliation", side_effect=request_affiliation) as mock_request:
+            stats = match_affiliations(affiliations_df, affiliation_matcher)
+        # Then
+        self.assertEqual(mock_request.call_count, 10 + 2 * 3)
+        self.assertEqual(stats, {'nb_rows': 50, 'nb_french_rows': 10, 'nb_matcher_calls': 16, 'nb_calls_per_row': 80,
+                                 'calls_reduction': 0.8})
+        self.assertEqual(affiliations_df.loc[1, "ror"], ["ror of affiliation 1"])
+        self.assertEqual(affiliations_df.loc[3, "ror"], [])
+        self.assertEqual(affiliations_df.loc[3, "detected_countries"], ["us"])
+
+    def test_read_affiliations_partition_by_offsets_quoted_newlines(self):
+        # Given
+        rows = [[f"publisher {i}", f"client.{i}", f'affiliation "{i}",\nParis' if i % 3 == 0 else f"affiliation {i}"]
+                for i in range(200)]
+        pd.DataFrame(rows).to_csv(self.affiliation_file, header=False, index=False)
+        with patch("application.utils_processor.PARTITION_INDEX_SIZE", 30):
+            _write_partition_index(self.affiliation_file)
+        # When
+        partitions = [read_affiliations_partition_by_offsets(self.affiliation_file, partition_index, 7)
+                      for partition_index in range(8)]
+        # Then
+        self.assertTrue(all(len(partition) > 0 for partition in partitions[:7]))
+        self.assertTrue(partitions[7].empty)
+        self.assertEqual(pd.concat(partitions, ignore_index=True).values.tolist(), rows)
+
+    def test_read_affiliations_partition_by_offsets_without_index(self):
+        # When
+        partition = read_affiliations_partition_by_offsets(self.affiliation_file, 0, 4)
+        # Then
+        self.assertIsNone(partition)
+
+    def test_read_affiliations_partition_by_offsets_outdated_index(self):
+        # Given
+        _write_partition_index(self.affiliation_file)
+        with open(self.affiliation_file, "a") as f:
+            f.write("publisher,client,affiliation\n")
+        # When
+        partition = read_affiliations_partition_by_offsets(self.affiliation_file, 0, 4)
+        # Then
+        self.assertIsNone(partition)
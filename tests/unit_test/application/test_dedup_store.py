@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from application.dedup_store import DedupStore
+
+TESTED_MODULE = "application.dedup_store"
+
+
+class TestDedupStore(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.keys = [f"title {i};Doe, John;2021;Zenodo" for i in range(100)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_add_and_contains(self):
+        # Given
+        store = DedupStore()
+        # When
+        is_new = [store.add(key) for key in self.keys + self.keys[:10]]
+        # Then
+        self.assertEqual(is_new, [True] * 100 + [False] * 10)
+        self.assertIn(self.keys[0], store)
+        self.assertNotIn("another title", store)
+        self.assertEqual(len(store), 100)
+
+    def test_digest_is_fixed_width(self):
+        store = DedupStore(digest_size=8)
+        self.assertEqual(len(store.digest("short")), 8)
+        self.assertEqual(len(store.digest("a much longer natural key " * 20)), 8)
+
+    def test_reset(self):
+        # Given
+        store = DedupStore()
+        store.update(self.keys)
+        # When
+        store.reset()
+        # Then
+        self.assertEqual(len(store), 0)
+        self.assertTrue(store.add(self.keys[0]))
+
+    def test_spill_to_disk(self):
+        # Given
+        store = DedupStore(spill_folder=self.tmp_dir, max_keys_in_memory=30)
+        # When
+        is_new = [store.add(key) for key in self.keys + self.keys]
+        # Then
+        self.assertEqual(is_new, [True] * 100 + [False] * 100)
+        self.assertEqual(len(store), 100)
+        self.assertLess(len(store._digests), 30)
+        self.assertTrue(all(key in store for key in self.keys))
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 1)
+
+    def test_spill_reset_and_close(self):
+        # Given
+        store = DedupStore(spill_folder=self.tmp_dir, max_keys_in_memory=30)
+        store.update(self.keys)
+        # When
+        store.reset()
+        # Then
+        self.assertEqual(len(store), 0)
+        self.assertNotIn(self.keys[0], store)
+        store.close()
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_snapshot_and_restore(self):
+        # Given
+        snapshot_file = os.path.join(self.tmp_dir, "keys.dedup")
+        store = DedupStore(snapshot_file=snapshot_file)
+        store.update(self.keys[:40])
+        first_size = store.snapshot()
+        store.update(self.keys[40:60])
+        second_size = store.snapshot()
+        store.update(self.keys[60:])
+        store.snapshot()
+        # When
+        restored_store = DedupStore(snapshot_file=snapshot_file)
+        restored_store.restore(second_size)
+        # Then
+        self.assertEqual(first_size, 40 * 16)
+        self.assertEqual(len(restored_store), 60)
+        self.assertIn(self.keys[59], restored_store)
+        self.assertNotIn(self.keys[60], restored_store)
+        self.assertEqual(os.path.getsize(snapshot_file), second_size)
+
+    def test_snapshot_after_reset(self):
+        # Given
+        snapshot_file = os.path.join(self.tmp_dir, "keys.dedup")
+        store = DedupStore(snapshot_file=snapshot_file)
+        store.update(self.keys[:40])
+        store.snapshot()
+        store.reset()
+        store.add(self.keys[0])
+        # When
+        size = store.snapshot()
+        # Then
+        self.assertEqual(size, 16)
@@ -0,0 +1,157 @@
+import csv
+import glob
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict
+from unittest import TestCase
+from unittest.mock import patch, Mock
+
+from adapters.databases.process_state_repository import ProcessStateRepository
+from application.dump_pipeline import AffiliationStage, DumpPipeline, EnrichmentStage
+from application.enricher import enrich_dump_files
+from application.enrichment_report import EnrichmentReport
+from application.index_sink_writer import IndexSinkWriter
+from application.processor import Processor
+from application.utils_processor import dump_record_generator
+from domain.api.abstract_dump_stage import AbstractDumpStage
+from tests.unit_test.adapters.databases.mock_postgres_session import MockPostgresSession
+from tests.unit_test.application.test_enricher import get_test_dois, make_french_doi, write_dump_file
+from tests.unit_test.application.test_global_config import test_config_harvester
+
+TESTED_MODULE = "application.dump_pipeline"
+
+
+class RecordingStage(AbstractDumpStage):
+    """Stage recording the calls it receives"""
+
+    def __init__(self):
+        self.calls = []
+
+    def start_file(self, dump_file: str):
+        self.calls.append(("start_file", os.path.basename(dump_file)))
+
+    def process_record(self, doi: Dict):
+        self.calls.append(("process_record", doi["id"]))
+
+    def end_file(self, dump_file: str):
+        self.calls.append(("end_file", os.path.basename(dump_file)))
+
+    def close(self):
+        self.calls.append(("close",))
+
+
+class TestDumpPipeline(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.references = {
+            "bso_doi_dict": {},
+            "french_authors_dict": {},
+            "french_rors": set(),
+            "bso3_local_affiliations_dict": {},
+            "excluded_last_names": [],
+        }
+        doi = get_test_dois()[0]
+        not_french = get_test_dois()[1:]
+        latest_folder = os.path.join(self.tmp_dir, "updated_2024-02")
+        oldest_folder = os.path.join(self.tmp_dir, "updated_2024-01")
+        write_dump_file(os.path.join(latest_folder, "part_0001.jsonl.gz"),
+                        [make_french_doi(doi, "10.1/new", "Same title"), make_french_doi(doi, "10.1/other", "Other title")] + not_french)
+        write_dump_file(os.path.join(latest_folder, "part_0000.jsonl.gz"),
+                        [make_french_doi(doi, "10.1/old", "Same title")] + not_french)
+        write_dump_file(os.path.join(oldest_folder, "part_0000.jsonl.gz"),
+                        not_french + [make_french_doi(doi, "10.1/older", "Same title")])
+        self.dump_files = sorted([str(p) for p in Path(self.tmp_dir).glob("updated*/*.jsonl.gz")], reverse=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        for f in glob.glob(f"{test_config_harvester['processed_dump_folder_name']}/partition_*"):
+            if os.path.isdir(f):
+                shutil.rmtree(f)
+            else:
+                os.remove(f)
+
+    @patch('adapters.databases.process_state_table.ProcessStateTable.__table__.exists', Mock(return_value=True))
+    def get_processor(self, dump_files, dump_folder=None):
+        repository = ProcessStateRepository(MockPostgresSession("fake_host", 0, "fake_username", "fake_password",
+                                                                "fake_db_name"))
+        return Processor(test_config_harvester, 0, dump_files, repository, dump_folder=dump_folder)
+
+    def test_run_read_each_file_once_for_all_stages(self):
+        # Given
+        stages = [RecordingStage(), RecordingStage()]
+        # When
+        with patch(f"{TESTED_MODULE}.dump_record_generator", side_effect=dump_record_generator) as mock_reader:
+            DumpPipeline(stages).run(self.dump_files[:1])
+        # Then
+        mock_reader.assert_called_once_with(self.dump_files[0])
+        self.assertEqual(stages[0].calls, stages[1].calls)
+        self.assertEqual(stages[0].calls[:2], [("start_file", "part_0001.jsonl.gz"), ("process_record", "10.1/new")])
+        self.assertEqual(stages[0].calls[-2:], [("end_file", "part_0001.jsonl.gz"), ("close",)])
+        self.assertEqual(len(stages[0].calls), 2 + 5 + 1)
+
+    def test_enrichment_stage_is_identical_to_enrich_dump_files(self):
+        # Given
+        expected_output_file = os.path.join(self.tmp_dir, "expected_index.jsonl")
+        with IndexSinkWriter(expected_output_file) as sink_writer:
+            enrich_dump_files(self.dump_files, sink_writer, self.references)
+        output_file = os.path.join(self.tmp_dir, "index.jsonl")
+        report = EnrichmentReport()
+        # When
+        with IndexSinkWriter(output_file) as sink_writer:
+            DumpPipeline([EnrichmentStage(sink_writer, self.references, report)], report).run(self.dump_files)
+        # Then
+        self.assertEqual(Path(output_file).read_bytes(), Path(expected_output_file).read_bytes())
+        result = report.to_dict()
+        self.assertEqual((result["nb_files"], result["nb_read"], result["nb_french"], result["nb_indexed"]), (3, 13, 3, 3))
+
+    def test_affiliation_stage_is_identical_to_process_partition(self):
+        # Given dump files with {"data": [...]} envelopes, as read by the processor
+        dump_files = []
+        for dump_file in self.dump_files:
+            envelope_file = dump_file.replace(".jsonl.gz", ".ndjson.gz")
+            with gzip.open(envelope_file, "wt") as f:
+                f.write(json.dumps({"data": list(dump_record_generator(dump_file))}))
+                f.write("\n")
+            dump_files.append(envelope_file)
+        processor = self.get_processor(dump_files)
+        expected_number_of_dois, expected_files_and_status = processor.process_partition()
+        expected_detailed_affiliations = Path(processor.partition_detailed_affiliation_file_path).read_bytes()
+        self.assertGreater(expected_number_of_dois, 0)
+        expected_consolidated_affiliations = Path(processor.partition_consolidated_affiliation_file_path).read_bytes()
+        self.tearDown()
+        self.setUp()
+        processor = self.get_processor(self.dump_files)
+        stage = AffiliationStage(processor)
+        # When
+        DumpPipeline([stage]).run(self.dump_files)
+        # Then
+        self.assertEqual(stage.global_processed_dois, expected_number_of_dois)
+        self.assertEqual([status["number_of_non_null_dois"] for status in stage.processed_files_and_status],
+                         [status["number_of_non_null_dois"] for status in expected_files_and_status])
+        self.assertEqual(Path(processor.partition_detailed_affiliation_file_path).read_bytes(),
+                         expected_detailed_affiliations.replace(b".ndjson.gz", b".jsonl.gz"))
+        self.assertEqual(Path(processor.partition_consolidated_affiliation_file_path).read_bytes(),
+                         expected_consolidated_affiliations)
+
+    def test_affiliation_stage_identify_files_by_their_path_relative_to_the_dump_folder(self):
+        # Given dump files of the same name in different folders
+        processor = self.get_processor(self.dump_files, dump_folder=self.tmp_dir)
+        stage = AffiliationStage(processor)
+        # When
+        with patch.object(processor.process_state_repository, "create_many") as mock_create_many:
+            DumpPipeline([stage]).run(self.dump_files)
+        # Then
+        expected_relative_paths = ["updated_2024-02/part_0001.jsonl.gz", "updated_2024-02/part_0000.jsonl.gz",
+                                   "updated_2024-01/part_0000.jsonl.gz"]
+        self.assertEqual([status["relative_path"] for status in stage.processed_files_and_status],
+                         expected_relative_paths)
+        pushed_states = [state for call_args in mock_create_many.call_args_list for state in call_args[0][0]]
+        self.assertEqual([state.relative_path for state in pushed_states], expected_relative_paths)
+        self.assertEqual(len({state.file_name for state in pushed_states}), 2)
+        with open(processor.partition_detailed_affiliation_file_path, newline="") as f:
+            origin_files = {row[-1] for row in csv.reader(f)}
+        self.assertEqual(origin_files, set(expected_relative_paths))
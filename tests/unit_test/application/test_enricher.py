@@ -0,0 +1,311 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from copy import deepcopy
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from adapters.storages.reference_store import ReferenceStore
+from application.enricher import (
+    enrich_doi, enrich_dump_files, enrich_dump_files_incremental, enrich_dump_files_sharded, get_shard_file,
+    merge_shards, write_shard,
+)
+from application.enrichment_checkpoint import EnrichmentCheckpoint
+from application.enrichment_report import EnrichmentReport
+from application.index_sink_writer import IndexSinkWriter
+
+TESTED_MODULE = "application.enricher"
+
+fixture_path = Path(__file__).parent / "dump-test.ndjson"
+
+
+def get_test_dois():
+    with open(fixture_path, "r") as f:
+        return json.load(f)["data"]
+
+
+def make_french_doi(doi, doi_id, title, affiliation_name="Université Paris Cité"):
+    french_doi = deepcopy(doi)
+    french_doi["id"] = doi_id
+    french_doi["attributes"]["titles"] = [{"title": title}]
+    french_doi["attributes"]["publisher"] = {"name": "E. Löpfe-Benz"}
+    french_doi["attributes"]["creators"] = [{
+        "name": "Doe, John", "givenName": "John", "familyName": "Doe",
+        "affiliation": [{"name": affiliation_name}], "nameIdentifiers": [],
+    }]
+    return french_doi
+
+
+def write_dump_file(path, dois):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path, "wt") as f:
+        for doi in dois:
+            f.write(json.dumps(doi))
+            f.write("\n")
+
+
+class FailingSinkWriter(IndexSinkWriter):
+    """Sink writer interrupted before writing its fail_at th line"""
+
+    def __init__(self, *args, fail_at=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fail_at = fail_at
+
+    def write(self, _str):
+        if self.nb_lines + 1 == self.fail_at:
+            raise RuntimeError("interrupted")
+        super().write(_str)
+
+
+class TestEnricher(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.references = {
+            "bso_doi_dict": {},
+            "french_authors_dict": {},
+            "french_rors": set(),
+            "bso3_local_affiliations_dict": {},
+            "excluded_last_names": [],
+        }
+        doi = get_test_dois()[0]
+        not_french = get_test_dois()[1:]
+        latest_folder = os.path.join(self.tmp_dir, "updated_2024-02")
+        oldest_folder = os.path.join(self.tmp_dir, "updated_2024-01")
+        # same natural key in the two files of the latest folder, and again in the oldest folder
+        write_dump_file(os.path.join(latest_folder, "part_0001.jsonl.gz"),
+                        [make_french_doi(doi, "10.1/new", "Same title"), make_french_doi(doi, "10.1/other", "Other title")] + not_french)
+        write_dump_file(os.path.join(latest_folder, "part_0000.jsonl.gz"),
+                        [make_french_doi(doi, "10.1/old", "Same title")] + not_french)
+        write_dump_file(os.path.join(oldest_folder, "part_0000.jsonl.gz"),
+                        not_french + [make_french_doi(doi, "10.1/older", "Same title")])
+        self.dump_files = sorted([str(p) for p in Path(self.tmp_dir).glob("updated*/*.jsonl.gz")], reverse=True)
+        self.output_file = os.path.join(self.tmp_dir, "index.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_output(self, output_file):
+        with open(output_file, "rb") as f:
+            return f.read()
+
+    def test_enrich_doi_french_affiliation(self):
+        # Given
+        doi = make_french_doi(get_test_dois()[0], "10.1/fr", "A title")
+        counters = {'nb_new_country': 0, 'nb_new_publisher': 0, 'nb_new_client': 0}
+        # When
+        enriched_doi = enrich_doi(doi, self.references, counters)
+        # Then
+        self.assertEqual(enriched_doi["fr_reasons"], ["affiliation_paris"])
+        self.assertEqual(enriched_doi["fr_reasons_concat"], "affiliation_paris")
+
+    def test_enrich_doi_not_french(self):
+        # Given
+        counters = {'nb_new_country': 0, 'nb_new_publisher': 0, 'nb_new_client': 0}
+        # When
+        enriched_dois = [enrich_doi(doi, self.references, counters) for doi in get_test_dois()]
+        # Then
+        self.assertEqual(enriched_dois, [None] * 4)
+
+    def test_enrich_dump_files_keep_latest_natural_key_per_folder(self):
+        # When
+        with IndexSinkWriter(self.output_file) as sink_writer:
+            enrich_dump_files(self.dump_files, sink_writer, self.references)
+        # Then
+        with open(self.output_file, "r") as f:
+            dois = [json.loads(line)["doi"] for line in f]
+        self.assertEqual(dois, ["10.1/new", "10.1/other", "10.1/older"])
+
+    def test_enrich_dump_files_dedup_dois_keep_latest_version(self):
+        # Given
+        doi = get_test_dois()[0]
+        latest_folder = os.path.join(self.tmp_dir, "updated_2024-03")
+        write_dump_file(os.path.join(latest_folder, "part_0000.jsonl.gz"),
+                        [make_french_doi(doi, "10.1/older", "Title of the latest version")])
+        dump_files = sorted([str(p) for p in Path(self.tmp_dir).glob("updated*/*.jsonl.gz")], reverse=True)
+        # When
+        with IndexSinkWriter(self.output_file) as sink_writer:
+            enrich_dump_files(dump_files, sink_writer, self.references, dedup_dois=True,
+                              spill_folder=os.path.join(self.tmp_dir, "dedup"))
+        # Then
+        with open(self.output_file, "r") as f:
+            dois = [json.loads(line)["doi"] for line in f]
+        self.assertEqual(dois, ["10.1/older", "10.1/new", "10.1/other"])
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, "dedup")), [])
+
+    def test_enrich_dump_files_sharded_one_worker_is_identical_to_sequential(self):
+        # Given
+        sequential_output_file = os.path.join(self.tmp_dir, "sequential.jsonl")
+        with IndexSinkWriter(sequential_output_file) as sink_writer:
+            enrich_dump_files(self.dump_files, sink_writer, self.references)
+        # When
+        with IndexSinkWriter(self.output_file) as sink_writer:
+            enrich_dump_files_sharded(self.dump_files, sink_writer, self.references, nb_workers=1,
+                                      shard_folder=os.path.join(self.tmp_dir, "shards"))
+        # Then
+        self.assertEqual(self.read_output(self.output_file), self.read_output(sequential_output_file))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, "shards")))
+
+    def test_enrich_dump_files_sharded_several_workers_is_identical_to_sequential(self):
+        # Given
+        sequential_output_file = os.path.join(self.tmp_dir, "sequential.jsonl")
+        with IndexSinkWriter(sequential_output_file) as sink_writer:
+            enrich_dump_files(self.dump_files, sink_writer, self.references)
+        # When
+        with IndexSinkWriter(self.output_file) as sink_writer:
+            enrich_dump_files_sharded(self.dump_files, sink_writer, self.references, nb_workers=3,
+                                      shard_folder=os.path.join(self.tmp_dir, "shards"))
+        # Then
+        self.assertEqual(self.read_output(self.output_file), self.read_output(sequential_output_file))
+
+    def test_enrich_dump_files_report(self):
+        # Given
+        report = EnrichmentReport()
+        # When
+        with IndexSinkWriter(self.output_file) as sink_writer:
+            enrich_dump_files(self.dump_files, sink_writer, self.references, report=report)
+        # Then
+        result = report.to_dict()
+        self.assertEqual((result["nb_files"], result["nb_read"], result["nb_french"], result["nb_indexed"]), (3, 13, 3, 3))
+        self.assertEqual(result["fr_reasons"], {"affiliation_paris": 3})
+        self.assertEqual(list(result["seconds"]), ["read", "natural_key", "detect", "index_record", "write"])
+
+    def test_enrich_dump_files_sharded_report(self):
+        # Given
+        report = EnrichmentReport()
+        # When
+        with IndexSinkWriter(self.output_file) as sink_writer:
+            enrich_dump_files_sharded(self.dump_files, sink_writer, self.references, nb_workers=2,
+                                      shard_folder=os.path.join(self.tmp_dir, "shards"), report=report)
+        # Then
+        result = report.to_dict()
+        # the french dois are counted in the shards, before the deduplication of the natural keys across files
+        self.assertEqual((result["nb_files"], result["nb_read"], result["nb_french"]), (3, 13, 4))
+        self.assertIn("merge", result["seconds"])
+
+    def test_merge_shards_deduplicates_natural_keys_across_shards(self):
+        # Given
+        shard_folder = os.path.join(self.tmp_dir, "shards")
+        os.makedirs(shard_folder)
+        shard_files = [get_shard_file(dump_file, shard_folder) for dump_file in self.dump_files]
+        for dump_file, shard_file in zip(self.dump_files, shard_files):
+            write_shard(dump_file, shard_file, self.references)
+        # When
+        with IndexSinkWriter(self.output_file) as sink_writer:
+            merge_shards(self.dump_files, shard_files, sink_writer)
+        # Then
+        with open(shard_files[1], "r") as f:
+            self.assertEqual(len(f.readlines()), 1)
+        with open(self.output_file, "r") as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_enrich_dump_files_incremental_only_enrich_changed_files(self):
+        # Given
+        shard_folder = os.path.join(self.tmp_dir, "incremental")
+        sequential_output_file = os.path.join(self.tmp_dir, "sequential.jsonl")
+        with IndexSinkWriter(sequential_output_file) as sink_writer:
+            enrich_dump_files(self.dump_files, sink_writer, self.references)
+        with IndexSinkWriter(os.path.join(self.tmp_dir, "first.jsonl")) as sink_writer:
+            first_enriched = enrich_dump_files_incremental(self.dump_files, sink_writer, self.references, 1, shard_folder)
+        with IndexSinkWriter(os.path.join(self.tmp_dir, "second.jsonl")) as sink_writer:
+            second_enriched = enrich_dump_files_incremental(self.dump_files, sink_writer, self.references, 1, shard_folder)
+        write_dump_file(self.dump_files[0], [make_french_doi(get_test_dois()[0], "10.1/new", "Same title")])
+        # When
+        with IndexSinkWriter(self.output_file) as sink_writer:
+            third_enriched = enrich_dump_files_incremental(self.dump_files, sink_writer, self.references, 1, shard_folder)
+        # Then
+        self.assertEqual(first_enriched, self.dump_files)
+        self.assertEqual(second_enriched, [])
+        self.assertEqual(third_enriched, [self.dump_files[0]])
+        self.assertEqual(self.read_output(os.path.join(self.tmp_dir, "second.jsonl")), self.read_output(sequential_output_file))
+        with open(self.output_file, "r") as f:
+            dois = [json.loads(line)["doi"] for line in f]
+        self.assertEqual(dois, ["10.1/new", "10.1/older"])
+
+    def test_enrich_dump_files_incremental_references_changed(self):
+        # Given
+        shard_folder = os.path.join(self.tmp_dir, "incremental")
+        with IndexSinkWriter(os.path.join(self.tmp_dir, "first.jsonl")) as sink_writer:
+            enrich_dump_files_incremental(self.dump_files, sink_writer, self.references, 1, shard_folder)
+        self.references["french_rors"] = {"02feahw73"}
+        # When
+        with IndexSinkWriter(self.output_file) as sink_writer:
+            enriched = enrich_dump_files_incremental(self.dump_files, sink_writer, self.references, 1, shard_folder)
+        # Then
+        self.assertEqual(enriched, self.dump_files)
+
+    def enrich_with_interruption(self, dump_files, fail_at):
+        checkpoint_folder = os.path.join(self.tmp_dir, "checkpoint")
+        checkpoint = EnrichmentCheckpoint(checkpoint_folder, dump_files, self.output_file)
+        with self.assertRaises(RuntimeError):
+            with FailingSinkWriter(self.output_file, fail_at=fail_at) as sink_writer:
+                enrich_dump_files(dump_files, sink_writer, self.references, checkpoint=checkpoint)
+        checkpoint = EnrichmentCheckpoint(checkpoint_folder, dump_files, self.output_file, resume=True)
+        self.assertTrue(checkpoint.is_resumed)
+        with IndexSinkWriter(self.output_file, truncate_at=checkpoint.get("output_offset")) as sink_writer:
+            enrich_dump_files(dump_files, sink_writer, self.references, checkpoint=checkpoint)
+        return checkpoint
+
+    def test_enrich_dump_files_resume_after_completed_file(self):
+        # Given
+        sequential_output_file = os.path.join(self.tmp_dir, "sequential.jsonl")
+        with IndexSinkWriter(sequential_output_file) as sink_writer:
+            enrich_dump_files(self.dump_files, sink_writer, self.references)
+        # When
+        checkpoint = self.enrich_with_interruption(self.dump_files, fail_at=3)
+        # Then
+        self.assertEqual(self.read_output(self.output_file), self.read_output(sequential_output_file))
+        self.assertEqual(checkpoint.get("nb_files_done"), 3)
+
+    @patch(f"{TESTED_MODULE}.CHECKPOINT_EVERY_N_DOIS", 2)
+    def test_enrich_dump_files_resume_inside_file(self):
+        # Given
+        doi = get_test_dois()[0]
+        dump_file = os.path.join(self.tmp_dir, "updated_2024-03", "part_0000.jsonl.gz")
+        write_dump_file(dump_file, [make_french_doi(doi, f"10.1/{i}", f"Title {i}") for i in range(2)]
+                        + get_test_dois()[1:2] + [make_french_doi(doi, f"10.1/{i}", f"Title {i}") for i in range(2, 4)]
+                        + [make_french_doi(doi, "10.1/duplicate", "Title 0")])
+        dump_files = [dump_file] + self.dump_files
+        sequential_output_file = os.path.join(self.tmp_dir, "sequential.jsonl")
+        with IndexSinkWriter(sequential_output_file) as sink_writer:
+            enrich_dump_files(dump_files, sink_writer, self.references)
+        # When
+        self.enrich_with_interruption(dump_files, fail_at=3)
+        # Then
+        self.assertEqual(self.read_output(self.output_file), self.read_output(sequential_output_file))
+        with open(self.output_file, "r") as f:
+            dois = [json.loads(line)["doi"] for line in f]
+        self.assertEqual(dois, ["10.1/0", "10.1/1", "10.1/2", "10.1/3", "10.1/new", "10.1/other", "10.1/older"])
+
+    def test_enrich_dump_files_sharded_resume_keep_written_shards(self):
+        # Given
+        shard_folder = os.path.join(self.tmp_dir, "shards")
+        os.makedirs(shard_folder)
+        shard_file = get_shard_file(self.dump_files[0], shard_folder)
+        write_shard(self.dump_files[0], shard_file, self.references)
+        with open(shard_file, "a") as f:
+            f.write(json.dumps("only in the shard") + "\t" + json.dumps({"doi": "10.1/shard"}) + "\n")
+        # When
+        with IndexSinkWriter(self.output_file) as sink_writer:
+            enrich_dump_files_sharded(self.dump_files, sink_writer, self.references, nb_workers=2,
+                                      shard_folder=shard_folder, resume=True)
+        # Then
+        with open(self.output_file, "r") as f:
+            dois = [json.loads(line)["doi"] for line in f]
+        self.assertEqual(dois, ["10.1/new", "10.1/other", "10.1/shard", "10.1/older"])
+
+    def test_enrich_dump_files_sharded_with_reference_stores(self):
+        # Given
+        self.references["french_rors"] = ReferenceStore.build(os.path.join(self.tmp_dir, "rors.refstore"), {"02feahw73"})
+        self.references["bso_doi_dict"] = ReferenceStore.build(os.path.join(self.tmp_dir, "bso.refstore"), {})
+        sequential_output_file = os.path.join(self.tmp_dir, "sequential.jsonl")
+        with IndexSinkWriter(sequential_output_file) as sink_writer:
+            enrich_dump_files(self.dump_files, sink_writer, self.references)
+        # When
+        with IndexSinkWriter(self.output_file) as sink_writer:
+            enrich_dump_files_sharded(self.dump_files, sink_writer, self.references, nb_workers=2,
+                                      shard_folder=os.path.join(self.tmp_dir, "shards"))
+        # Then
+        self.assertEqual(self.read_output(self.output_file), self.read_output(sequential_output_file))
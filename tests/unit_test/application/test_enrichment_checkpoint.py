@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from application.enrichment_checkpoint import EnrichmentCheckpoint
+
+TESTED_MODULE = "application.enrichment_checkpoint"
+
+
+class TestEnrichmentCheckpoint(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.checkpoint_folder = os.path.join(self.tmp_dir, "checkpoint")
+        self.dump_files = ["updated_2024-02/part_0001.jsonl.gz", "updated_2024-02/part_0000.jsonl.gz"]
+        self.output_file = os.path.join(self.tmp_dir, "index.jsonl")
+        with open(self.output_file, "w") as f:
+            f.write("0123456789")
+        checkpoint = EnrichmentCheckpoint(self.checkpoint_folder, self.dump_files, self.output_file)
+        checkpoint.save(nb_files_done=1, nb_read=0, output_offset=10)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_resume(self):
+        # When
+        checkpoint = EnrichmentCheckpoint(self.checkpoint_folder, self.dump_files, self.output_file, resume=True)
+        # Then
+        self.assertTrue(checkpoint.is_resumed)
+        self.assertEqual(checkpoint.get("nb_files_done"), 1)
+        self.assertEqual(checkpoint.get("output_offset"), 10)
+
+    def test_no_resume(self):
+        # When
+        checkpoint = EnrichmentCheckpoint(self.checkpoint_folder, self.dump_files, self.output_file)
+        # Then
+        self.assertFalse(checkpoint.is_resumed)
+        self.assertFalse(os.path.exists(checkpoint.checkpoint_file))
+
+    def test_resume_other_dump_files(self):
+        # When
+        checkpoint = EnrichmentCheckpoint(self.checkpoint_folder, self.dump_files[1:], self.output_file, resume=True)
+        # Then
+        self.assertFalse(checkpoint.is_resumed)
+
+    def test_resume_other_mode_or_nb_workers(self):
+        # Given
+        checkpoint = EnrichmentCheckpoint(self.checkpoint_folder, self.dump_files, self.output_file, mode="sharded",
+                                          nb_workers=4)
+        checkpoint.save(nb_files_done=1, output_offset=10)
+        # When
+        same_mode_checkpoint = EnrichmentCheckpoint(self.checkpoint_folder, self.dump_files, self.output_file,
+                                                    resume=True, mode="sharded", nb_workers=4)
+        other_nb_workers_checkpoint = EnrichmentCheckpoint(self.checkpoint_folder, self.dump_files, self.output_file,
+                                                           resume=True, mode="sharded", nb_workers=8)
+        # Then
+        self.assertTrue(same_mode_checkpoint.is_resumed)
+        self.assertFalse(other_nb_workers_checkpoint.is_resumed)
+        self.assertFalse(os.path.exists(other_nb_workers_checkpoint.checkpoint_file))
+
+    def test_resume_sequential_checkpoint_in_sharded_mode(self):
+        # When
+        checkpoint = EnrichmentCheckpoint(self.checkpoint_folder, self.dump_files, self.output_file, resume=True,
+                                          mode="sharded", nb_workers=4)
+        # Then
+        self.assertFalse(checkpoint.is_resumed)
+
+    def test_resume_truncated_output_file(self):
+        # Given
+        with open(self.output_file, "w") as f:
+            f.write("01234")
+        # When
+        checkpoint = EnrichmentCheckpoint(self.checkpoint_folder, self.dump_files, self.output_file, resume=True)
+        # Then
+        self.assertFalse(checkpoint.is_resumed)
+
+    def test_clear(self):
+        # Given
+        checkpoint = EnrichmentCheckpoint(self.checkpoint_folder, self.dump_files, self.output_file, resume=True)
+        # When
+        checkpoint.clear()
+        # Then
+        self.assertFalse(os.path.exists(self.checkpoint_folder))
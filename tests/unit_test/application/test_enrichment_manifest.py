@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from adapters.storages.reference_store import ReferenceStore
+from application.enrichment_manifest import EnrichmentManifest, get_references_fingerprint
+
+TESTED_MODULE = "application.enrichment_manifest"
+
+
+class TestEnrichmentManifest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.references = {
+            "bso_doi_dict": {"10.1/a": {"rors": ["02feahw73"]}},
+            "french_authors_dict": {"0000-0001": {2021: ["02feahw73"]}},
+            "french_rors": {"02feahw73", "05f82e368"},
+        }
+        self.dump_file = os.path.join(self.tmp_dir, "part_0000.jsonl.gz")
+        self.shard_file = os.path.join(self.tmp_dir, "part_0000.shard")
+        for file in [self.dump_file, self.shard_file]:
+            with open(file, "w") as f:
+                f.write("content")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_references_fingerprint(self):
+        # Given
+        same_references = {
+            "french_rors": {"05f82e368", "02feahw73"},
+            "french_authors_dict": {"0000-0001": {2021: ["02feahw73"]}},
+            "bso_doi_dict": {"10.1/a": {"rors": ["02feahw73"]}},
+        }
+        other_references = {**self.references, "french_rors": {"02feahw73"}}
+        # When
+        fingerprint = get_references_fingerprint(self.references)
+        # Then
+        self.assertEqual(get_references_fingerprint(same_references), fingerprint)
+        self.assertNotEqual(get_references_fingerprint(other_references), fingerprint)
+        self.assertNotEqual(get_references_fingerprint(self.references, files=[self.dump_file]), fingerprint)
+
+    def test_manifest_up_to_date_after_save(self):
+        # Given
+        manifest = EnrichmentManifest(self.tmp_dir, "fingerprint")
+        self.assertFalse(manifest.is_up_to_date(self.dump_file, self.shard_file))
+        manifest.update(self.dump_file)
+        manifest.save()
+        # When
+        manifest = EnrichmentManifest(self.tmp_dir, "fingerprint")
+        # Then
+        self.assertTrue(manifest.is_up_to_date(self.dump_file, self.shard_file))
+
+    def test_manifest_changed_dump_file(self):
+        # Given
+        manifest = EnrichmentManifest(self.tmp_dir, "fingerprint")
+        manifest.update(self.dump_file)
+        # When
+        with open(self.dump_file, "a") as f:
+            f.write("new content")
+        # Then
+        self.assertFalse(manifest.is_up_to_date(self.dump_file, self.shard_file))
+
+    def test_manifest_invalidated_by_references(self):
+        # Given
+        manifest = EnrichmentManifest(self.tmp_dir, "fingerprint")
+        manifest.update(self.dump_file)
+        manifest.save()
+        # When
+        manifest = EnrichmentManifest(self.tmp_dir, "other fingerprint")
+        # Then
+        self.assertEqual(manifest.files, {})
+        self.assertFalse(manifest.is_up_to_date(self.dump_file, self.shard_file))
+
+    def test_references_fingerprint_with_reference_store(self):
+        # Given
+        store_references = {**self.references, "french_rors": ReferenceStore.build(
+            os.path.join(self.tmp_dir, "french_rors.refstore"), self.references["french_rors"])}
+        other_store_references = {**self.references, "french_rors": ReferenceStore.build(
+            os.path.join(self.tmp_dir, "other_rors.refstore"), {"02feahw73"})}
+        # When
+        fingerprint = get_references_fingerprint(store_references)
+        # Then
+        self.assertNotEqual(get_references_fingerprint(other_store_references), fingerprint)
+        store_references["french_rors"].close()
+        other_store_references["french_rors"].close()
@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from application.enrichment_report import EnrichmentReport
+
+TESTED_MODULE = "application.enrichment_report"
+
+
+class TestEnrichmentReport(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_timers(self):
+        # Given
+        report = EnrichmentReport()
+        # When
+        with report.timer("merge"):
+            pass
+        items = list(report.timed("read", range(3)))
+        # Then
+        self.assertEqual(items, [0, 1, 2])
+        self.assertEqual(list(report.to_dict()["seconds"]), ["read", "merge"])
+
+    def test_counters(self):
+        # Given
+        report = EnrichmentReport()
+        # When
+        report.count_file("part_0000.jsonl.gz", "read", 10)
+        report.count_french_doi("part_0000.jsonl.gz", ["affiliation_paris", "publisher"], "Publisher A", True)
+        report.count_french_doi("part_0000.jsonl.gz", ["affiliation_paris"], "Publisher B", False)
+        # Then
+        result = report.to_dict()
+        self.assertEqual((result["nb_files"], result["nb_read"], result["nb_french"], result["nb_indexed"]), (1, 10, 2, 1))
+        self.assertEqual(result["fr_reasons"], {"affiliation_paris": 2, "publisher": 1})
+        self.assertEqual(result["publishers"], {"Publisher A": 1, "Publisher B": 1})
+        self.assertEqual(result["files"], {"part_0000.jsonl.gz": {"read": 10, "french": 2, "indexed": 1}})
+
+    def test_merge(self):
+        # Given
+        report = EnrichmentReport()
+        report.count_file("part_0000.jsonl.gz", "read", 10)
+        report.add_time("read", 1.0)
+        worker_report = EnrichmentReport()
+        worker_report.count_file("part_0001.jsonl.gz", "read", 5)
+        worker_report.count_french_doi("part_0001.jsonl.gz", ["affiliation_paris"], "Publisher A", True)
+        worker_report.add_time("read", 2.0)
+        worker_report.nb_files_reused = 1
+        # When
+        report.merge(json.loads(json.dumps(worker_report.to_dict())))
+        # Then
+        result = report.to_dict()
+        self.assertEqual((result["nb_files"], result["nb_read"], result["nb_french"]), (2, 15, 1))
+        self.assertEqual(result["seconds"]["read"], 3.0)
+        self.assertEqual(result["nb_files_reused"], 1)
+
+    def test_save(self):
+        # Given
+        report = EnrichmentReport()
+        report.count_file("part_0000.jsonl.gz", "read", 10)
+        report.extra["normalize_cache"] = {"hits": 1}
+        report_file = os.path.join(self.tmp_dir, "index_report.json")
+        # When
+        result = report.save(report_file)
+        # Then
+        with open(report_file, "r") as f:
+            self.assertEqual(json.load(f), result)
+        self.assertEqual(result["normalize_cache"], {"hits": 1})
+        self.assertEqual(os.listdir(self.tmp_dir), ["index_report.json"])
@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from application.french_signal_detector import FrenchSignalDetector
+from config.business_rules import FRENCH_AFFILIATION_KEYWORDS, FRENCH_NAME_KEYWORDS
+
+TESTED_MODULE = "application.french_signal_detector"
+
+
+def legacy_reasons(keywords, prefix, _str):
+    return sorted(set(f'{prefix}{k}' for k in keywords if k in _str))
+
+
+class TestFrenchSignalDetector(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.detector = FrenchSignalDetector()
+
+    def test_is_french_publisher(self):
+        self.assertTrue(self.detector.is_french_publisher("Portail Data INRAE"))
+        self.assertTrue(self.detector.is_french_publisher("Université de Lorraine"))
+        self.assertFalse(self.detector.is_french_publisher("INRAP"))
+        self.assertFalse(self.detector.is_french_publisher(""))
+        self.assertFalse(self.detector.is_french_publisher(None))
+
+    def test_get_affiliation_reasons_overlapping_keywords(self):
+        # Given
+        normalized_affiliation = "umr 5558 cnrs universite lyon 1 inrae paris france"
+        # When
+        reasons = self.detector.get_affiliation_reasons(normalized_affiliation)
+        # Then
+        self.assertEqual(sorted(reasons), sorted([
+            'affiliation_umr ', 'affiliation_cnrs', 'affiliation_ lyon', 'affiliation_inra',
+            'affiliation_inrae', 'affiliation_paris', 'affiliation_france',
+        ]))
+
+    def test_get_affiliation_reasons_no_duplicate(self):
+        self.assertEqual(self.detector.get_affiliation_reasons("paris paris"), ['affiliation_paris'])
+
+    def test_get_name_reasons(self):
+        self.assertEqual(self.detector.get_name_reasons("labo cnrs paris france"), ['name_cnrs', 'name_paris france'])
+        self.assertEqual(self.detector.get_name_reasons("john doe"), [])
+        self.assertEqual(self.detector.get_name_reasons(""), [])
+
+    def test_get_reasons_many_same_as_keyword_loop(self):
+        # Given
+        strings = [
+            "laboratoire de physique ecole normale superieure paris",
+            "department of biology university of oxford",
+            "cea saclay gif sur yvette",
+            "necker enfants malades inserm",
+            "universite cote d azur nice",
+            "",
+        ]
+        # When
+        affiliation_reasons = self.detector.get_affiliation_reasons_many(strings)
+        name_reasons = self.detector.get_name_reasons_many(strings)
+        # Then
+        self.assertEqual([sorted(r) for r in affiliation_reasons],
+                         [legacy_reasons(FRENCH_AFFILIATION_KEYWORDS, 'affiliation_', s) for s in strings])
+        self.assertEqual([sorted(r) for r in name_reasons],
+                         [legacy_reasons(FRENCH_NAME_KEYWORDS, 'name_', s) for s in strings])
@@ -0,0 +1,117 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from application.index_sink_writer import IndexSinkWriter
+from application.utils_processor import append_to_file
+
+TESTED_MODULE = "application.index_sink_writer"
+
+
+class TestIndexSinkWriter(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.records = [{"doi": f"10.1/{i}", "title": "Un titre élégant"} for i in range(10)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_write_same_content_as_append_to_file(self):
+        # Given
+        expected_file = os.path.join(self.tmp_dir, "expected.jsonl")
+        output_file = os.path.join(self.tmp_dir, "index.jsonl")
+        for record in self.records:
+            append_to_file(file=expected_file, _str=json.dumps(record))
+        # When
+        with IndexSinkWriter(output_file, buffer_size=16) as sink_writer:
+            for record in self.records:
+                sink_writer.write_record(record)
+        # Then
+        with open(expected_file, "rb") as f_expected, open(output_file, "rb") as f_output:
+            self.assertEqual(f_output.read(), f_expected.read())
+        self.assertEqual(sink_writer.nb_lines, 10)
+        self.assertTrue(sink_writer.closed)
+
+    def test_append_to_existing_file(self):
+        # Given
+        output_file = os.path.join(self.tmp_dir, "index.jsonl")
+        append_to_file(file=output_file, _str="first line")
+        # When
+        with IndexSinkWriter(output_file) as sink_writer:
+            sink_writer.write("second line")
+        # Then
+        with open(output_file, "r") as f:
+            self.assertEqual([line.rstrip(os.linesep) for line in f], ["first line", "second line"])
+
+    def test_write_gzip(self):
+        # Given
+        sink_writer = IndexSinkWriter.for_index(self.tmp_dir, "index", compress=True)
+        # When
+        with sink_writer:
+            for record in self.records[:5]:
+                sink_writer.write_record(record)
+        with IndexSinkWriter.for_index(self.tmp_dir, "index", compress=True) as sink_writer:
+            for record in self.records[5:]:
+                sink_writer.write_record(record)
+        # Then
+        self.assertEqual(sink_writer.file, os.path.join(self.tmp_dir, "index.jsonl.gz"))
+        with gzip.open(sink_writer.file, "rt") as f:
+            self.assertEqual([json.loads(line) for line in f], self.records)
+
+    def test_resume_from_checkpoint(self):
+        # Given
+        output_file = os.path.join(self.tmp_dir, "index.jsonl")
+        sink_writer = IndexSinkWriter(output_file)
+        sink_writer.write_record(self.records[0])
+        offset = sink_writer.checkpoint()
+        sink_writer.write_record(self.records[1])
+        sink_writer.close()
+        # When
+        with IndexSinkWriter(output_file, truncate_at=offset) as sink_writer:
+            sink_writer.write_record(self.records[2])
+        # Then
+        with open(output_file, "r") as f:
+            self.assertEqual([json.loads(line) for line in f], [self.records[0], self.records[2]])
+
+    def test_checkpoint_before_any_write_after_resume(self):
+        # Given
+        output_file = os.path.join(self.tmp_dir, "index.jsonl")
+        sink_writer = IndexSinkWriter(output_file)
+        sink_writer.write_record(self.records[0])
+        offset = sink_writer.checkpoint()
+        sink_writer.write_record(self.records[1])
+        sink_writer.close()
+        # When
+        with IndexSinkWriter(output_file, truncate_at=offset) as sink_writer:
+            resumed_offset = sink_writer.checkpoint()
+        # Then
+        self.assertEqual(resumed_offset, offset)
+        self.assertEqual(os.path.getsize(output_file), offset)
+
+    def test_resume_gzip_from_checkpoint(self):
+        # Given
+        sink_writer = IndexSinkWriter.for_index(self.tmp_dir, "index", compress=True)
+        sink_writer.write_record(self.records[0])
+        offset = sink_writer.checkpoint()
+        sink_writer.write_record(self.records[1])
+        sink_writer.flush()
+        # interrupted without closing the gzip member
+        sink_writer._raw.close()
+        # When
+        with IndexSinkWriter.for_index(self.tmp_dir, "index", compress=True, truncate_at=offset) as sink_writer:
+            sink_writer.write_record(self.records[2])
+        # Then
+        with gzip.open(sink_writer.file, "rt") as f:
+            self.assertEqual([json.loads(line) for line in f], [self.records[0], self.records[2]])
+
+    def test_close_twice(self):
+        # Given
+        sink_writer = IndexSinkWriter(os.path.join(self.tmp_dir, "index.jsonl"))
+        sink_writer.close()
+        # When
+        sink_writer.close()
+        # Then
+        self.assertTrue(sink_writer.closed)
@@ -3,6 +3,7 @@ from unittest import TestCase
 from unittest.mock import patch, Mock
 import os
 import glob
+import shutil
 import pandas as pd
 
 from adapters.databases.process_state_repository import ProcessStateRepository
@@ -38,7 +39,10 @@ class TestProcessor(TestCase):
 
     def tearDown(self):
         for f in glob.glob(f"{test_config_harvester['processed_dump_folder_name']}/*"):
-            os.remove(f)
+            if os.path.isdir(f):
+                shutil.rmtree(f)
+            else:
+                os.remove(f)
 
     def test_init_processor_return_list_of_files_and_target_directory(self):
         expected_number_of_files = 1
@@ -97,3 +101,142 @@ class TestProcessor(TestCase):
 
         # expect
         self.assertEqual(detailed_affiliation.shape[0], expected_number_detailed_affiliation)
+
+    def test_process_partition_with_workers_is_identical_to_sequential(self):
+        # Given processor in SetUpClass
+        self.processor.process_partition()
+        with open(self.processor.partition_detailed_affiliation_file_path, "rb") as f:
+            expected_detailed_affiliations = f.read()
+        with open(self.processor.partition_consolidated_affiliation_file_path, "rb") as f:
+            expected_consolidated_affiliations = f.read()
+        self.tearDown()
+        self.setUp()
+        self.processor.nb_workers = 2
+
+        # When
+        global_number_of_processed_dois, processed_files_and_status = self.processor.process_partition()
+
+        # expect
+        self.assertEqual(global_number_of_processed_dois, 4)
+        self.assertEqual([status["file_path"] for status in processed_files_and_status], self.processor.files_to_process)
+        with open(self.processor.partition_detailed_affiliation_file_path, "rb") as f:
+            self.assertEqual(f.read(), expected_detailed_affiliations)
+        with open(self.processor.partition_consolidated_affiliation_file_path, "rb") as f:
+            self.assertEqual(f.read(), expected_consolidated_affiliations)
+
+    def test_get_files_affiliations_with_workers_parses_at_most_twice_nb_workers_files_ahead(self):
+        # Given
+        self.processor.nb_workers = 1
+        self.processor.files_to_process = [f"file_{i}.json.gz" for i in range(5)]
+        submitted_files = []
+        mock_pool = Mock()
+        mock_pool.apply_async.side_effect = lambda func, args: submitted_files.append(args[0][0]) or \
+            Mock(get=Mock(return_value=args[0][0]))
+
+        # When
+        with patch(f"{TESTED_MODULE}.Pool") as mock_pool_class:
+            mock_pool_class.return_value.__enter__.return_value = mock_pool
+            files_affiliations = self.processor._get_files_affiliations()
+            first_file_affiliations = next(files_affiliations)
+            submitted_files_before_first_yield = list(submitted_files)
+            remaining_files_affiliations = list(files_affiliations)
+
+        # expect
+        self.assertEqual(first_file_affiliations, ("file_0.json.gz", "file_0.json.gz"))
+        self.assertEqual(submitted_files_before_first_yield, ["file_0.json.gz", "file_1.json.gz"])
+        self.assertEqual([first_file_affiliations] + remaining_files_affiliations,
+                         [(file, file) for file in self.processor.files_to_process])
+
+    def test_process_partition_parquet_output(self):
+        # Given processor in SetUpClass
+        self.processor.process_partition()
+        expected_detailed_affiliations = pd.read_csv(self.processor.partition_detailed_affiliation_file_path, header=None,
+                                                     dtype=str, keep_default_na=False).values.tolist()
+        expected_consolidated_affiliations = pd.read_csv(self.processor.partition_consolidated_affiliation_file_path,
+                                                         header=None, dtype=str, keep_default_na=False).values.tolist()
+        self.tearDown()
+        self.setUp()
+        processor = self.processor
+        processor.output_format = "parquet"
+        processor._create_partition_affiliation_files(0)
+
+        # When
+        processor.process_partition()
+
+        # expect
+        detailed_affiliations = pd.read_parquet(processor.partition_detailed_affiliation_file_path)
+        self.assertEqual(detailed_affiliations.dtypes["doi_publisher"], "category")
+        detailed_affiliations = detailed_affiliations.astype(object)[
+            ["doi_id", "doi_file_name", "type", "name", "doi_publisher", "doi_client_id", "affiliation", "origin_file"]]
+        self.assertEqual(detailed_affiliations.values.tolist(), expected_detailed_affiliations)
+        consolidated_affiliations = pd.read_parquet(processor.partition_consolidated_affiliation_file_path).astype(object)
+        self.assertEqual(consolidated_affiliations.values.tolist(), expected_consolidated_affiliations)
+
+    def test_process_partition_push_states_by_batches(self):
+        # Given processor in SetUpClass
+        self.processor.files_to_process = self.processor.files_to_process * 3
+        self.processor.state_flush_every_n_files = 2
+
+        # When
+        with patch.object(self.process_state_repository, "create_many") as mock_create_many:
+            self.processor.process_partition()
+
+        # expect
+        self.assertEqual([len(call_args[0][0]) for call_args in mock_create_many.call_args_list], [2, 1])
+
+    def test_process_partition_parquet_output_writes_a_consolidated_part_file_per_batch(self):
+        # Given processor in SetUpClass
+        processor = self.processor
+        processor.output_format = "parquet"
+        processor._create_partition_affiliation_files(0)
+        processor.state_flush_every_n_files = 1
+        files_affiliations = [pd.DataFrame([{
+            "doi_id": f"10.1/{i}", "doi_file_name": f"10_1_{i}", "type": "creators", "name": "Doe, John",
+            "doi_publisher": "zenodo", "doi_client_id": "cern.zenodo", "affiliation": f"Univ {i % 2}",
+            "origin_file": f"part_000{i}.ndjson",
+        }]) for i in range(3)]
+
+        # When
+        with patch.object(self.process_state_repository, "create_many"), \
+                patch(f"{TESTED_MODULE}.pd.read_parquet") as mock_read_parquet:
+            processor.start_partition()
+            for i, affiliations_df in enumerate(files_affiliations):
+                processor.write_file_affiliations(Path(f"/data/dump/part_000{i}.ndjson"), 1, 1, 0, affiliations_df)
+            processor.end_partition()
+
+        # expect
+        # each batch is written in its own part file, the parts already written are not read back
+        mock_read_parquet.assert_not_called()
+        self.assertEqual(sorted(part_file.name for part_file in processor.partition_consolidated_affiliation_file_path.iterdir()),
+                         ["part-000000.parquet", "part-000001.parquet"])
+        consolidated_affiliations = pd.read_parquet(processor.partition_consolidated_affiliation_file_path)
+        self.assertEqual(consolidated_affiliations.affiliation.astype(str).tolist(), ["Univ 0", "Univ 1"])
+
+    def test_process_partition_parquet_output_does_not_push_states_if_consolidated_file_write_fails(self):
+        # Given processor in SetUpClass
+        processor = self.processor
+        processor.output_format = "parquet"
+        processor._create_partition_affiliation_files(0)
+        processor.state_flush_every_n_files = 1
+
+        # When
+        with patch.object(self.process_state_repository, "create_many") as mock_create_many, \
+                patch(f"{TESTED_MODULE}._write_parquet_part_file", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                processor.process_partition()
+
+        # expect
+        mock_create_many.assert_not_called()
+
+    def test_retrieve_files_to_process_keep_files_not_processed_in_order(self):
+        # Given
+        files_in_partition = [Path(f"/data/dump/part_{i:04d}.ndjson") for i in range(4)]
+
+        # When
+        with patch.object(self.process_state_repository, "get_processed_file_paths",
+                          return_value={"/data/dump/part_0002.ndjson"}) as mock_get_processed_file_paths:
+            files_to_process = self.processor.retrieve_files_to_process(files_in_partition + files_in_partition[:1])
+
+        # expect
+        mock_get_processed_file_paths.assert_called_once_with([str(file) for file in files_in_partition])
+        self.assertEqual(files_to_process, [files_in_partition[0], files_in_partition[1], files_in_partition[3]])
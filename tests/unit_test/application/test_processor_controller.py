@@ -1,9 +1,17 @@
+import gzip
+import os
+import shutil
+import tempfile
+from copy import deepcopy
 from pathlib import Path
 from unittest import TestCase
 from unittest.mock import patch, Mock
-from application.utils_processor import _list_files_in_directory, _create_file
+import pandas as pd
+from adapters.api.affiliation_matcher import AffiliationMatcher
+from application.utils_processor import _list_files_in_directory, _create_file, _read_partition_index, _write_parquet_dataset, _write_parquet_file
 from tests.unit_test.application.test_global_config import test_config_harvester
 from application.processor import PartitionsController
+from project.server.main import tasks
 
 TESTED_MODULE = "application.processor"
 
@@ -53,4 +61,134 @@ class TestPartitionsController(TestCase):
 
         self.assertEqual(Path(Path(test_config_harvester[
                                        'processed_dump_folder_name']) / f"{self.file_prefix}_{test_config_harvester['global_affiliation_file_name']}")
-                         , self.processor_controller.global_consolidated_affiliation_file_path)
\ No newline at end of file
+                         , self.processor_controller.global_consolidated_affiliation_file_path)
+
+    def test_concat_parquet_files(self):
+        # Given
+        tmp_dir = tempfile.mkdtemp()
+        config = deepcopy(test_config_harvester)
+        config['processed_dump_folder_name'] = tmp_dir
+        for i in range(2):
+            affiliations = pd.DataFrame([{
+                "doi_id": f"10.1/{i}", "doi_file_name": f"10_1_{i}", "type": "creators", "name": "Doe, John",
+                "doi_publisher": "zenodo", "doi_client_id": "cern.zenodo", "affiliation": f"Univ {i}",
+                "origin_file": f"part_000{i}.ndjson",
+            }])
+            _write_parquet_dataset(affiliations, Path(tmp_dir) / f"partition_detailed_affiliations_{i}.parquet")
+            _write_parquet_file(affiliations[["doi_publisher", "doi_client_id", "affiliation"]],
+                                Path(tmp_dir) / f"partition_consolidated_affiliations_{i}.parquet")
+        processor_controller = PartitionsController(config, self.file_prefix, output_format="parquet")
+
+        # When
+        processor_controller.concat_files()
+        processor_controller.clear_local_directory()
+
+        # expect
+        consolidated_affiliations = pd.read_parquet(processor_controller.global_consolidated_affiliation_file_path)
+        self.assertEqual(sorted(consolidated_affiliations.affiliation.astype(str)), ["Univ 0", "Univ 1"])
+        detailed_affiliations = pd.read_parquet(processor_controller.global_detailed_affiliation_file_path,
+                                                columns=["doi_id"], filters=[("origin_file", "in", ["part_0001.ndjson"])])
+        self.assertEqual(detailed_affiliations.doi_id.tolist(), ["10.1/1"])
+        self.assertEqual(sorted(path.name for path in Path(tmp_dir).iterdir()),
+                         ["20220101_detailed_affiliations.parquet", "20220101_global_affiliations.csv",
+                          "20220101_global_affiliations.csv.by_hash.csv",
+                          "20220101_global_affiliations.csv.by_hash.csv.partitions.json",
+                          "20220101_global_affiliations.csv.partitions.json", "20220101_global_affiliations.parquet"])
+        shutil.rmtree(tmp_dir)
+
+    @patch.object(AffiliationMatcher, "get_version", return_value="1.0.0")
+    @patch.object(AffiliationMatcher, "_request_affiliation",
+                  side_effect=lambda match_type, affiliation_string: [f"{match_type} of {affiliation_string}"])
+    def test_concat_parquet_files_then_match_affiliations(self, mock_request_affiliation, mock_get_version):
+        # Given
+        tmp_dir = tempfile.mkdtemp()
+        config = deepcopy(test_config_harvester)
+        config['processed_dump_folder_name'] = tmp_dir
+        for i in range(2):
+            affiliations = pd.DataFrame([{
+                "doi_id": f"10.1/{i}{j}", "doi_file_name": f"10_1_{i}{j}", "type": "creators", "name": "Doe, John",
+                "doi_publisher": "zenodo", "doi_client_id": "cern.zenodo", "affiliation": f"Univ, {i + j}",
+                "origin_file": f"part_000{i}.ndjson",
+            } for j in range(2)])
+            _write_parquet_dataset(affiliations, Path(tmp_dir) / f"partition_detailed_affiliations_{i}.parquet")
+            _write_parquet_file(affiliations[["doi_publisher", "doi_client_id", "affiliation"]],
+                                Path(tmp_dir) / f"partition_consolidated_affiliations_{i}.parquet")
+        processor_controller = PartitionsController(config, self.file_prefix, output_format="parquet")
+        processor_controller.concat_files()
+        processor_controller.clear_local_directory()
+        matcher_config = {
+            'processed_dump_folder_name': tmp_dir,
+            'global_affiliation_file_name': config['global_affiliation_file_name'],
+            'affiliation_folder_name': tmp_dir,
+            'affiliation_matcher_service': "fake_url",
+            'affiliation_match_cache_file': os.path.join(tmp_dir, "match_cache.sqlite"),
+        }
+
+        for by_affiliation_hash in [False, True]:
+            # When
+            with patch.dict(tasks.config_harvester, matcher_config):
+                for partition_index in range(2):
+                    tasks.run_task_match_affiliations_partition(self.file_prefix, partition_index, 2,
+                                                                by_affiliation_hash=by_affiliation_hash)
+
+            # Then
+            matched_affiliations = pd.concat([pd.read_csv(partition_file, dtype=str)
+                                              for partition_file in Path(tmp_dir).glob("1.0.0_partition_*.csv")])
+            self.assertTrue({"Univ, 0", "Univ, 1", "Univ, 2"} <= set(matched_affiliations.affiliation_str))
+            self.assertEqual(matched_affiliations.affiliation_str.duplicated().sum(), 0)
+            self.assertEqual(matched_affiliations.set_index("affiliation_str").loc["Univ, 1", "detected_countries"],
+                             "['country of Univ, 1']")
+            for partition_file in Path(tmp_dir).glob("1.0.0_partition_*.csv"):
+                os.remove(partition_file)
+        shutil.rmtree(tmp_dir)
+
+    def test_concat_files_keep_each_consolidated_affiliation_once(self):
+        # Given
+        tmp_dir = tempfile.mkdtemp()
+        config = deepcopy(test_config_harvester)
+        config['processed_dump_folder_name'] = tmp_dir
+        partitions = [
+            'zenodo,cern.zenodo,Univ 0\nzenodo,cern.zenodo,"Univ, 1"\n',
+            'zenodo,cern.zenodo,"Univ, 1"\nfigshare,,Univ 2\n',
+        ]
+        for i, partition in enumerate(partitions):
+            with open(Path(tmp_dir) / f"partition_consolidated_affiliations_{i}.csv", "w") as f:
+                f.write(partition)
+            with open(Path(tmp_dir) / f"partition_detailed_affiliations_{i}.csv", "w") as f:
+                f.write(f"10.1/{i},10_1_{i},creators,,zenodo,cern.zenodo,Univ {i},part_000{i}.ndjson\n")
+        processor_controller = PartitionsController(config, self.file_prefix)
+
+        # When
+        processor_controller.concat_files()
+
+        # expect
+        consolidated_affiliations = pd.read_csv(processor_controller.global_consolidated_affiliation_file_path, dtype=str,
+                                                keep_default_na=False)
+        self.assertEqual(sorted(consolidated_affiliations.values.tolist()), [["figshare", "", "Univ 2"],
+                                                                             ["zenodo", "cern.zenodo", "Univ 0"],
+                                                                             ["zenodo", "cern.zenodo", "Univ, 1"]])
+        self.assertEqual(_read_partition_index(processor_controller.global_consolidated_affiliation_file_path)[-1],
+                         processor_controller.global_consolidated_affiliation_file_path.stat().st_size)
+        shutil.rmtree(tmp_dir)
+
+    @patch(f"{TESTED_MODULE}.SwiftSession")
+    def test_push_to_ovh_upload_compressed_streams(self, mock_swift_session):
+        # Given
+        self.processor_controller.config = dict(test_config_harvester, processed_affiliation_files_prefix="processed")
+        uploaded = {}
+        mock_swift_session.return_value.upload_stream_to_swift.side_effect = \
+            lambda container, chunks, dest_path, segment_size: uploaded.update({str(dest_path): b"".join(chunks)})
+        for file_path in [self.processor_controller.global_consolidated_affiliation_file_path,
+                          self.processor_controller.global_detailed_affiliation_file_path]:
+            file_path.write_text("zenodo,cern.zenodo,Univ\n" * 1000)
+
+        # When
+        self.processor_controller.push_to_ovh()
+
+        # Then
+        self.assertEqual(sorted(uploaded), [
+            f"processed/{self.file_prefix}_{test_config_harvester['detailed_affiliation_file_name']}.gz",
+            f"processed/{self.file_prefix}_{test_config_harvester['global_affiliation_file_name']}.gz",
+        ])
+        for compressed_file in uploaded.values():
+            self.assertEqual(gzip.decompress(compressed_file), b"zenodo,cern.zenodo,Univ\n" * 1000)
@@ -1,18 +1,24 @@
 import gzip
+import json
 import os
+import tempfile
 import pandas as pd
 from copy import deepcopy
+from pathlib import Path
 from unittest import TestCase
+from unittest.mock import patch
 
+from application.dedup_store import DedupStore
 from application.utils_processor import (
-    _retrieve_object_name, _create_affiliation_string, _safe_get,
+    _append_affiliation_columns, _append_file, _drop_known_rows, _get_doi_values, _merge_files,
+    _new_affiliation_columns, _retrieve_object_name, _create_affiliation_string, _safe_get,
     get_classification_FOS, get_classification_subject,
     get_client_id, get_created, get_description_element, get_doi_element,
     get_grants, get_language, get_licenses,
     get_matched_affiliations, get_publicationYear, get_publisher,
     get_registered, get_resourceType, get_resourceTypeGeneral,
-    get_ror_or_orcid, get_title, get_updated, json_line_generator, listify, trim_null_values,
-    gzip_cli, _parse_url_and_retrieve_last_part)
+    get_ror_or_orcid, get_title, get_updated, gzip_blocks, json_line_generator, dump_record_generator, listify, trim_null_values,
+    _parse_url_and_retrieve_last_part)
 from tests.unit_test.fixtures.utils_processor import *
 
 TESTED_MODULE = "application.utils_processor"
@@ -95,31 +101,174 @@ class TestUtilsProcessor(TestCase):
     #     mock_append.assert_called_with(_str=json.dumps(expected_append), file=config_harvester["es_index_sourcefile"])
     #     shutil.rmtree(output_dir)
 
-    def test_gzip_cli_compress(self):
+    def test_gzip_blocks(self):
         # Given
-        expected_file_compressed = file_to_compress + ".gz"
-        with open(file_to_compress, "rb") as f:
-            expected_file_content = f.read()
-        # When
-        gzip_cli(file_to_compress)
+        content = os.urandom(1000) * 50
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file = Path(tmp_dir) / "affiliations.csv"
+            file.write_bytes(content)
+            # When
+            compressed_blocks = list(gzip_blocks(file, nb_threads=2, block_size=4096))
         # Then
-        self.assertTrue(os.path.exists(expected_file_compressed))
-        with gzip.open(expected_file_compressed, "rb") as f:
-            actual_file_content = f.read()
-        self.assertEqual(expected_file_content, actual_file_content)
+        self.assertEqual(len(compressed_blocks), 13)
+        self.assertEqual(gzip.decompress(b"".join(compressed_blocks)), content)
 
-    def test_gzip_cli_decompress(self):
+    def test_json_line_generator_gzip(self):
         # Given
-        expected_file = os.path.splitext(file_to_decompress)[0]
-        with gzip.open(file_to_decompress, "rb") as f:
-            expected_file_content = f.read()
-        # When
-        gzip_cli(file_to_decompress, decompress=True)
+        input_file_path = fixture_path / "sample.ndjson"
+        expected_json_objects = list(json_line_generator(input_file_path))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gzip_file_path = os.path.join(tmp_dir, "sample.ndjson.gz")
+            with open(input_file_path, "rb") as f_in, gzip.open(gzip_file_path, "wb") as f_out:
+                f_out.write(f_in.read())
+            # When
+            json_objects = list(json_line_generator(gzip_file_path))
         # Then
-        self.assertTrue(os.path.exists(expected_file))
-        with open(expected_file, "rb") as f:
-            actual_file_content = f.read()
-        self.assertEqual(expected_file_content, actual_file_content)
+        self.assertEqual(json_objects, expected_json_objects)
+
+    def test_dump_record_generator_envelope_and_flat_jsonl(self):
+        # Given
+        input_file_path = fixture_path / "sample.ndjson"
+        expected_records = next(json_line_generator(input_file_path)).get('data')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            flat_file_path = os.path.join(tmp_dir, "sample.jsonl.gz")
+            with gzip.open(flat_file_path, "wt") as f:
+                for record in expected_records:
+                    f.write(json.dumps(record) + "\n")
+            # When
+            envelope_records = list(dump_record_generator(input_file_path))
+            flat_records = list(dump_record_generator(flat_file_path))
+        # Then
+        self.assertEqual(len(envelope_records), 100)
+        self.assertEqual(envelope_records, expected_records)
+        self.assertEqual(flat_records, expected_records)
+
+    def test_append_file(self):
+        # Given
+        first_rows = pd.DataFrame([{"doi_publisher": "Publisher A", "doi_client_id": "a.b", "affiliation": "Univ, Paris"}])
+        second_rows = pd.DataFrame([{"doi_publisher": "Publisher B", "doi_client_id": "c.d", "affiliation": "Line\nbreak"}])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            target_file = Path(tmp_dir) / "partition.csv"
+            target_file.touch()
+            # When
+            _append_file(first_rows, target_file)
+            _append_file(pd.DataFrame(), target_file)
+            _append_file(second_rows, target_file)
+            # Then
+            rows = pd.read_csv(target_file, header=None, dtype="str")
+        self.assertEqual(rows.values.tolist(), [["Publisher A", "a.b", "Univ, Paris"], ["Publisher B", "c.d", "Line\nbreak"]])
+
+    def test_append_file_more_columns_not_appended(self):
+        # Given
+        rows = pd.DataFrame([{"doi_publisher": "Publisher A", "doi_client_id": "a.b", "affiliation": "Univ"}])
+        wider_rows = rows.assign(country="fr")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            target_file = Path(tmp_dir) / "partition.csv"
+            target_file.touch()
+            _append_file(rows, target_file)
+            expected_content = target_file.read_bytes()
+            # When
+            _append_file(wider_rows, target_file)
+            # Then
+            self.assertEqual(target_file.read_bytes(), expected_content)
+
+    def test_append_file_failed_write_truncated(self):
+        # Given
+        rows = pd.DataFrame([{"doi_publisher": "Publisher A", "doi_client_id": "a.b", "affiliation": "Univ"}])
+
+        class FailingFile:
+            def __init__(self, f):
+                self.f = f
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                self.f.close()
+
+            def write(self, data):
+                self.f.write(data[:5])
+                raise OSError("No space left on device")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            target_file = Path(tmp_dir) / "partition.csv"
+            target_file.touch()
+            _append_file(rows, target_file)
+            expected_content = target_file.read_bytes()
+            real_open = open
+            # When
+            with patch(f"{TESTED_MODULE}.open", create=True,
+                       side_effect=lambda file, mode, **kwargs: FailingFile(real_open(file, mode, **kwargs)) if mode == "a"
+                       else real_open(file, mode, **kwargs)):
+                _append_file(rows, target_file)
+            # Then
+            self.assertEqual(target_file.read_bytes(), expected_content)
+
+    def test_append_affiliation_columns(self):
+        # Given
+        doi = deepcopy(self.standard_doi)
+        doi["mapped_id"] = doi["id"]
+        nb_affiliations = sum(max(len(creator.get("affiliation", [])), 1) for creator in doi["attributes"]["creators"])
+        columns = _new_affiliation_columns()
+        # When
+        nb_rows = _append_affiliation_columns(columns, doi, _get_doi_values(doi), "creators", "dump.ndjson")
+        # Then
+        self.assertEqual(nb_rows, nb_affiliations)
+        self.assertEqual({len(values) for values in columns.values()}, {nb_affiliations})
+        self.assertEqual(set(columns["doi_id"]), {str(doi["id"]).lower()})
+        self.assertEqual(set(columns["type"]), {"creators"})
+        self.assertEqual(set(columns["origin_file"]), {"dump.ndjson"})
+
+    def test_append_affiliation_columns_error_nothing_appended(self):
+        # Given
+        doi = deepcopy(self.standard_doi)
+        doi["mapped_id"] = doi["id"]
+        doi["attributes"]["creators"].append({"name": "creator without affiliation key"})
+        columns = _new_affiliation_columns()
+        # When
+        with self.assertRaises(KeyError):
+            _append_affiliation_columns(columns, doi, _get_doi_values(doi), "creators", "dump.ndjson")
+        # Then
+        self.assertEqual({len(values) for values in columns.values()}, {0})
+
+    def test_drop_known_rows(self):
+        # Given
+        known_rows = DedupStore(digest_size=8)
+        first_rows = pd.DataFrame([["zenodo", "cern.zenodo", "Univ"], ["zenodo", None, "Univ"], ["zenodo", "cern.zenodo", "Univ"]])
+        second_rows = pd.DataFrame([["zenodo", "", "Univ"], ["figshare", "", "Univ"]])
+        # When
+        first_unique_rows = _drop_known_rows(first_rows, known_rows)
+        second_unique_rows = _drop_known_rows(second_rows, known_rows)
+        # Then
+        self.assertEqual(first_unique_rows.index.tolist(), [0, 1])
+        self.assertEqual(second_unique_rows.values.tolist(), [["figshare", "", "Univ"]])
+        self.assertEqual(len(known_rows), 3)
+
+    def test_merge_files_without_header(self):
+        # Given
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            files = [Path(tmp_dir) / f"partition_{i}.csv" for i in range(3)]
+            files[0].write_text('a,"b\nc",d\ne,f,g')
+            files[1].write_text("")
+            files[2].write_text("h,i,j\n")
+            target_file = Path(tmp_dir) / "merged.csv"
+            # When
+            _merge_files(files, target_file, buffer_size=4)
+            # Then
+            self.assertEqual(target_file.read_text(), '0,1,2\na,"b\nc",d\ne,f,g\nh,i,j\n')
+
+    def test_merge_files_with_header(self):
+        # Given
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            files = [Path(tmp_dir) / f"partition_{i}.csv" for i in range(3)]
+            files[0].write_text("x,y\n1,2\n")
+            files[1].write_text("x,y\n3,4\n")
+            files[2].write_text("y,x\n6,5\n")
+            target_file = Path(tmp_dir) / "merged.csv"
+            # When
+            _merge_files(files, target_file, header=0)
+            # Then
+            self.assertEqual(target_file.read_text(), "x,y\n1,2\n3,4\n5,6\n")
 
     def test_parse_url(self):
         # Given
@@ -0,0 +1,34 @@
+from unittest import TestCase
+
+from project.server.main.strings import _normalize, normalize, normalize_cache_stats, normalize_many
+
+TESTED_MODULE = "project.server.main.strings"
+
+
+class TestStrings(TestCase):
+    def test_normalize_same_as_uncached(self):
+        for x in ["Université Paris Cité", "  Doe,\nJohn <br> $ ", "ab 1 cd", ""]:
+            self.assertEqual(normalize(x), _normalize(x))
+            self.assertEqual(normalize(x, min_length=2), _normalize(x, min_length=2))
+
+    def test_normalize_cache_hits(self):
+        # Given
+        stats_start = normalize_cache_stats()
+        # When
+        normalize("Laboratoire de test des caches")
+        normalize("Laboratoire de test des caches")
+        normalize("Laboratoire de test des caches", min_length=3)
+        # Then
+        stats = normalize_cache_stats(since=stats_start)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["hit_ratio"], round(1 / 3, 4))
+
+    def test_normalize_many(self):
+        # Given
+        x_list = ["CNRS, Paris", "Inserm", "CNRS, Paris", "École Normale Supérieure"]
+        # When
+        normalized = normalize_many(x_list, min_length=1)
+        # Then
+        self.assertEqual(normalized, [_normalize(x, min_length=1) for x in x_list])
+        self.assertEqual(normalize_many([]), [])
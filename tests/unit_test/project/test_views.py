@@ -1,6 +1,9 @@
 from unittest import TestCase
+from unittest.mock import patch
 
-from project.server.main.views import get_partitions
+from flask import Flask
+
+from project.server.main.views import get_partitions, main_blueprint
 
 TESTED_MODULE = "project.server.main.views"
 
@@ -101,4 +104,36 @@ class TestGetPartitions(TestCase):
         partitions = get_partitions(_list, number_of_partitions=6)
         # Then
         self.assertEqual(partitions, [[1], [2], [3], [4], [5]])
-    
+
+
+class TestCreateTaskEnrichDoi(TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.register_blueprint(main_blueprint)
+        self.client = app.test_client()
+
+    @patch(f"{TESTED_MODULE}.os.system")
+    @patch(f"{TESTED_MODULE}.Queue")
+    def test_enrich_dois_process_affiliations_without_file_prefix_is_rejected(self, mock_queue, mock_system):
+        # When
+        response = self.client.post("/enrich_dois", json={"index_name": "bso-datacite-20240101",
+                                                          "process_affiliations": True, "skip_re3data": True})
+        # Then
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["status"], "error")
+        mock_system.assert_not_called()
+        mock_queue.assert_not_called()
+
+    @patch(f"{TESTED_MODULE}.os.system")
+    @patch(f"{TESTED_MODULE}.Queue")
+    def test_enrich_dois_process_affiliations_with_sequential_mode_options_is_rejected(self, mock_queue, mock_system):
+        for arg, value in [("nb_workers", 4), ("dedup_dois", True), ("incremental", True), ("resume", True)]:
+            # When
+            response = self.client.post("/enrich_dois", json={"index_name": "bso-datacite-20240101",
+                                                              "process_affiliations": True, "file_prefix": "20240101",
+                                                              "skip_re3data": True, arg: value})
+            # Then
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(arg, response.get_json()["message"])
+        mock_system.assert_not_called()
+        mock_queue.assert_not_called()